@@ -0,0 +1,378 @@
+"""
+Benchmarks: Likelihood
+======================
+
+This script benchmarks the run time and peak memory use of a single likelihood evaluation (the creation of a
+`FitImaging` or `FitInterferometer` and its `figure_of_merit`) on the datasets simulated by the instrument
+simulators in the folders:
+
+ - `autolens_workspace/scripts/imaging/simulators/instruments` (`vro`, `euclid`, `hst`, `hst_up` and `ao`).
+ - `autolens_workspace/scripts/interferometer/simulators/instruments` (`sma`).
+
+Every dataset is fitted with the following source galaxy cases, using the true lens mass model of the simulation:
+
+ - `parametric`: An `EllipticalSersic` bulge.
+ - `rectangular`: A `Rectangular` pixelization.
+ - `voronoi_magnification`: A `VoronoiMagnification` pixelization.
+ - `voronoi_brightness_image`: A `VoronoiBrightnessImage` pixelization, adapted to the image of the true tracer.
+
+The `sma` interferometer dataset is fitted using both the `TransformerDFT` and `TransformerNUFFT`.
+
+The results are output to the .json file `autolens_workspace/output/benchmarks/likelihood__<version>.json`, where
+`<version>` is the installed version of **PyAutoLens**. By running this script before and after upgrading, the two
+.json files can be compared (see the end of this script) to catch performance regressions.
+
+The datasets must have been simulated before running this script, for example the `ao` dataset is not distributed
+with the workspace because of its size, and is simulated by running `imaging/simulators/instruments/ao.py`.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+from os import path
+import autolens as al
+
+"""
+__Settings__
+
+The number of times every likelihood evaluation is repeated, which is in addition to one warm-up evaluation that is
+not timed (so that the compilation of **PyAutoLens**'s numba functions is not included in the run times).
+
+The instruments and cases which are benchmarked can be customized by removing entries from the lists below, for
+example the `ao` dataset with a pixelization can take minutes per likelihood evaluation.
+"""
+repeats = 5
+
+imaging_instruments = {
+    "vro": 0.2,
+    "euclid": 0.1,
+    "hst": 0.05,
+    "hst_up": 0.03,
+    "ao": 0.01,
+}
+
+interferometer_instruments = ["sma"]
+
+cases = [
+    "parametric",
+    "rectangular",
+    "voronoi_magnification",
+    "voronoi_brightness_image",
+]
+
+transformer_classes = [al.TransformerDFT, al.TransformerNUFFT]
+
+mask_radius = 3.0
+sub_size = 2
+
+benchmark_path = path.join("output", "benchmarks")
+benchmark_file = path.join(benchmark_path, f"likelihood__{al.__version__}.json")
+
+"""
+__Benchmark__
+
+The function `benchmark_from` times a likelihood evaluation (passed as a function without arguments) and records
+its peak memory use.
+
+The peak memory is measured using Python's `tracemalloc` module, which includes all arrays allocated by NumPy but
+not memory allocated by external C libraries (e.g. the NUFFT's FFTW plans).
+"""
+
+
+def benchmark_from(func, repeats):
+    """
+    Returns a dictionary of the run times and peak memory of the function `func`, which is called once to warm-up
+    and then `repeats` times.
+
+    Parameters
+    ----------
+    func : func
+        The function performing a likelihood evaluation, which takes no arguments and returns the figure of merit.
+    repeats : int
+        The number of times the function is called and timed.
+    """
+    figure_of_merit = func()
+
+    times = []
+
+    for _ in range(repeats):
+
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "figure_of_merit": float(figure_of_merit),
+        "repeats": repeats,
+        "time_min": float(np.min(times)),
+        "time_median": float(np.median(times)),
+        "time_mean": float(np.mean(times)),
+        "peak_memory_mb": peak_memory / 1024 ** 2,
+    }
+
+
+def source_galaxy_from(case, true_tracer, hyper_image):
+    """
+    Returns the source galaxy of a benchmark case, where the parametric source is the true source galaxy of the
+    simulation.
+    """
+    if case == "parametric":
+        return true_tracer.galaxies[-1]
+
+    if case == "rectangular":
+        pixelization = al.pix.Rectangular(shape=(30, 30))
+    elif case == "voronoi_magnification":
+        pixelization = al.pix.VoronoiMagnification(shape=(30, 30))
+    elif case == "voronoi_brightness_image":
+        pixelization = al.pix.VoronoiBrightnessImage(
+            pixels=900, weight_floor=0.0, weight_power=10.0
+        )
+    else:
+        raise ValueError(f"The benchmark case {case} is not recognised.")
+
+    return al.Galaxy(
+        redshift=true_tracer.galaxies[-1].redshift,
+        pixelization=pixelization,
+        regularization=al.reg.Constant(coefficient=1.0),
+        hyper_model_image=hyper_image,
+        hyper_galaxy_image=hyper_image,
+    )
+
+
+def dataset_is_simulated(dataset_path, file_names):
+
+    simulated = all(
+        path.exists(path.join(dataset_path, file_name)) for file_name in file_names
+    )
+
+    if not simulated:
+        print(
+            f"Skipping {dataset_path}, which has not been simulated (run its instrument simulator script)."
+        )
+
+    return simulated
+
+
+results = {
+    "autolens_version": al.__version__,
+    "python_version": platform.python_version(),
+    "numpy_version": np.__version__,
+    "machine": platform.machine(),
+    "processor": platform.processor(),
+    "benchmarks": {},
+}
+
+"""
+__Imaging__
+
+Benchmark every imaging instrument dataset.
+"""
+for dataset_instrument, pixel_scales in imaging_instruments.items():
+
+    dataset_path = path.join("dataset", "imaging", "instruments", dataset_instrument)
+
+    if not dataset_is_simulated(
+        dataset_path=dataset_path,
+        file_names=["image.fits", "psf.fits", "noise_map.fits", "true_tracer.pickle"],
+    ):
+        continue
+
+    imaging = al.Imaging.from_fits(
+        image_path=path.join(dataset_path, "image.fits"),
+        psf_path=path.join(dataset_path, "psf.fits"),
+        noise_map_path=path.join(dataset_path, "noise_map.fits"),
+        pixel_scales=pixel_scales,
+    )
+
+    mask = al.Mask2D.circular(
+        shape_native=imaging.shape_native,
+        pixel_scales=imaging.pixel_scales,
+        radius=mask_radius,
+    )
+
+    masked_imaging = al.MaskedImaging(
+        imaging=imaging,
+        mask=mask,
+        settings=al.SettingsMaskedImaging(grid_class=al.Grid2D, sub_size=sub_size),
+    )
+
+    true_tracer = al.Tracer.load(file_path=dataset_path, filename="true_tracer")
+    hyper_image = true_tracer.image_from_grid(grid=masked_imaging.grid).slim_binned
+
+    for case in cases:
+
+        tracer = al.Tracer.from_galaxies(
+            galaxies=true_tracer.galaxies[:-1]
+            + [
+                source_galaxy_from(
+                    case=case, true_tracer=true_tracer, hyper_image=hyper_image
+                )
+            ]
+        )
+
+        def func():
+            return al.FitImaging(
+                masked_imaging=masked_imaging, tracer=tracer
+            ).figure_of_merit
+
+        name = f"imaging__{dataset_instrument}__{case}"
+
+        results["benchmarks"][name] = benchmark_from(func=func, repeats=repeats)
+        results["benchmarks"][name]["image_pixels"] = int(mask.pixels_in_mask)
+
+        print(name, results["benchmarks"][name])
+
+"""
+__Interferometer__
+
+Benchmark every interferometer instrument dataset, using every transformer.
+"""
+real_space_mask = al.Mask2D.circular(
+    shape_native=(200, 200), pixel_scales=0.05, radius=mask_radius
+)
+
+for dataset_instrument in interferometer_instruments:
+
+    dataset_path = path.join(
+        "dataset", "interferometer", "instruments", dataset_instrument
+    )
+
+    if not dataset_is_simulated(
+        dataset_path=dataset_path,
+        file_names=[
+            "visibilities.fits",
+            "noise_map.fits",
+            "uv_wavelengths.fits",
+            "true_tracer.pickle",
+        ],
+    ):
+        continue
+
+    interferometer = al.Interferometer.from_fits(
+        visibilities_path=path.join(dataset_path, "visibilities.fits"),
+        noise_map_path=path.join(dataset_path, "noise_map.fits"),
+        uv_wavelengths_path=path.join(dataset_path, "uv_wavelengths.fits"),
+    )
+
+    visibilities_mask = np.full(
+        fill_value=False, shape=interferometer.visibilities.shape
+    )
+
+    true_tracer = al.Tracer.load(file_path=dataset_path, filename="true_tracer")
+
+    for transformer_class in transformer_classes:
+
+        masked_interferometer = al.MaskedInterferometer(
+            interferometer=interferometer,
+            visibilities_mask=visibilities_mask,
+            real_space_mask=real_space_mask,
+            settings=al.SettingsMaskedInterferometer(
+                grid_class=al.Grid2D,
+                sub_size=sub_size,
+                transformer_class=transformer_class,
+            ),
+        )
+
+        hyper_image = true_tracer.image_from_grid(
+            grid=masked_interferometer.grid
+        ).slim_binned
+
+        for case in cases:
+
+            tracer = al.Tracer.from_galaxies(
+                galaxies=true_tracer.galaxies[:-1]
+                + [
+                    source_galaxy_from(
+                        case=case, true_tracer=true_tracer, hyper_image=hyper_image
+                    )
+                ]
+            )
+
+            def func():
+                return al.FitInterferometer(
+                    masked_interferometer=masked_interferometer, tracer=tracer
+                ).figure_of_merit
+
+            name = f"interferometer__{dataset_instrument}__{case}__{transformer_class.__name__}"
+
+            results["benchmarks"][name] = benchmark_from(func=func, repeats=repeats)
+            results["benchmarks"][name]["visibilities"] = int(
+                interferometer.visibilities.shape[0]
+            )
+
+            print(name, results["benchmarks"][name])
+
+"""
+__Output__
+
+Output the results to the .json file.
+"""
+os.makedirs(benchmark_path, exist_ok=True)
+
+with open(benchmark_file, "w+") as f:
+    json.dump(results, f, indent=4)
+
+"""
+__Comparison__
+
+To compare against the benchmarks of a previous version of **PyAutoLens**, set `compare_version` to that version
+(whose .json file must be in the `output/benchmarks` folder). Any benchmark whose median run time or peak memory
+has increased by more than `regression_threshold` is reported as a regression.
+
+A change in the `figure_of_merit` of a benchmark is also reported, as this indicates the likelihood function itself
+has changed between versions and the run times may not be comparable.
+"""
+compare_version = None
+regression_threshold = 1.1
+
+if compare_version is not None:
+
+    with open(
+        path.join(benchmark_path, f"likelihood__{compare_version}.json"), "r"
+    ) as f:
+        results_compare = json.load(f)
+
+    for name, benchmark in results["benchmarks"].items():
+
+        if name not in results_compare["benchmarks"]:
+            continue
+
+        benchmark_compare = results_compare["benchmarks"][name]
+
+        time_ratio = benchmark["time_median"] / benchmark_compare["time_median"]
+        memory_ratio = benchmark["peak_memory_mb"] / max(
+            benchmark_compare["peak_memory_mb"], 1e-8
+        )
+
+        if time_ratio > regression_threshold:
+            print(f"REGRESSION: {name} run time has increased by a factor {time_ratio}")
+
+        if memory_ratio > regression_threshold:
+            print(
+                f"REGRESSION: {name} peak memory has increased by a factor {memory_ratio}"
+            )
+
+        if not np.isclose(
+            benchmark["figure_of_merit"], benchmark_compare["figure_of_merit"]
+        ):
+            print(
+                f"CHANGED: {name} figure of merit has changed from "
+                f"{benchmark_compare['figure_of_merit']} to {benchmark['figure_of_merit']}"
+            )
+
+"""
+Finish.
+"""
@@ -97,6 +97,9 @@ The interpolation performed by the `InputDeflections` can be computationally slo
 lens model we fit to the data we`d waste a lot of time. However, because our deflection angle map is fixed and the 
 `grid` and `blurring_grid` we interpolated it to are fixed, by passing the latter as a `preload_grid` we can skip
 this expensive repeated calculation and speed up the code significantly. Yay!
+
+The script `performance/input_deflections_interpolation.py` shows an `InputDeflections` which reuses the
+interpolation for every grid automatically, and can memory-map the deflection angle maps from their .fits files.
 """
 image_plane_grid = al.Grid2D.uniform(
     shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, sub_size=1
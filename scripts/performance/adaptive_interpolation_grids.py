@@ -0,0 +1,481 @@
+"""
+Performance: Adaptive Interpolation Grids
+=========================================
+
+The example `imaging/modeling/settings/interpolating_deflections.py` uses a `Grid2DInterpolate`, which computes the
+deflection angles of the mass profiles flagged `True` in `config/grids/interpolate.ini` (e.g. the cored power-law,
+`EllipticalNFW` and generalized NFW profiles) on a coarse uniform grid, and interpolates them to the native
+resolution sub-grid.
+
+A single `pixel_scales_interp` is used everywhere, however the interpolation is least accurate where the deflection
+angles change most rapidly. For the power-law and NFW profiles this is near the centre of the mass profile, where the
+deflection angles change direction over a few tenths of an arc-second. A uniform grid which is fine enough to be
+accurate in this region is unnecessarily fine everywhere else.
+
+This script shows how to use an adaptive interpolation grid, which:
+
+ - Uses a coarse `pixel_scales_interp` everywhere.
+ - Adds interpolation nodes at a finer `pixel_scales_refine` wherever interpolating the deflection angles of a
+   `refine_mass_profile` (e.g. the lens model inferred by a previous phase) from the coarse nodes is less accurate than
+   `refine_tolerance`.
+
+The refined region therefore includes the critical curves and mask edge only where the coarse nodes are inaccurate
+there. The deflection angles are smooth near the critical curves (it is their derivatives which give the high
+magnification), and the interpolation grid extends one coarse pixel beyond the mask edge, so refining these regions
+by distance alone adds nodes without reducing the error.
+
+The interpolation vertexes and weights of every grid are computed once per mask and stored, such that they are
+reused by every likelihood evaluation and by every phase which uses the same mask.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import numpy as np
+from os import path
+from scipy.spatial import cKDTree, Delaunay
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from autoarray import exc
+from cache_keys import profile_key_from
+
+"""
+__Interpolation Nodes__
+
+The function below returns the interpolation nodes of a mask at an input pixel scale, which are computed the same
+way as the `Grid2DInterpolate`: the mask is rescaled to the interpolation pixel scale and buffed by one pixel, so that
+nodes surround every pixel at the edge of the mask.
+"""
+
+
+def interpolation_nodes_from(mask, pixel_scales_interp):
+    """
+    Returns the (y,x) coordinates of the interpolation nodes of a mask at the input pixel scale.
+    """
+    mask = mask.mask_sub_1
+
+    rescaled_mask = mask.rescaled_mask_from_rescale_factor(
+        rescale_factor=mask.pixel_scale / pixel_scales_interp
+    )
+
+    mask_interp = al.Mask2D.manual(
+        mask=np.asarray(rescaled_mask.edge_buffed_mask),
+        pixel_scales=pixel_scales_interp,
+        origin=mask.origin,
+    )
+
+    return np.asarray(mask_interp.masked_grid_sub_1.slim)
+
+
+def adaptive_interpolation_nodes_from(
+    mask,
+    pixel_scales_interp,
+    pixel_scales_refine,
+    refine_mass_profile=None,
+    refine_tolerance=1e-3,
+):
+    """
+    Returns the (y,x) coordinates of the nodes of an adaptive interpolation grid, which are at `pixel_scales_interp`
+    everywhere and `pixel_scales_refine` wherever the coarse nodes interpolate the deflection angles of the
+    `refine_mass_profile` less accurately than the `refine_tolerance`.
+
+    Parameters
+    ----------
+    mask : al.Mask2D
+        The mask the interpolation grid covers.
+    pixel_scales_interp : float
+        The pixel scale of the coarse interpolation nodes used everywhere.
+    pixel_scales_refine : float
+        The pixel scale of the fine interpolation nodes used in the refined regions.
+    refine_mass_profile : al.mp.MassProfile
+        The mass profile (e.g. of a previous phase's lens model) whose interpolated deflection angles decide where
+        fine nodes are used. If `None`, only the coarse nodes are used.
+    refine_tolerance : float
+        Fine nodes are used where the interpolated y or x deflection angle differs from its true value by more than
+        this (in arc-seconds).
+    """
+    nodes_coarse = interpolation_nodes_from(
+        mask=mask, pixel_scales_interp=pixel_scales_interp
+    )
+
+    if refine_mass_profile is None:
+        return nodes_coarse
+
+    nodes_fine = interpolation_nodes_from(
+        mask=mask, pixel_scales_interp=pixel_scales_refine
+    )
+
+    """
+    The deflection angles are interpolated from the coarse nodes to every fine node, and compared to their true values.
+    Fine nodes outside the coarse nodes' triangulation are always used.
+    """
+    refine = Delaunay(nodes_coarse).find_simplex(nodes_fine) == -1
+
+    vtx, wts = interpolation_weights_from(
+        grid=nodes_fine[~refine], nodes=nodes_coarse
+    )
+
+    deflections_coarse = np.asarray(
+        refine_mass_profile.deflections_from_grid(
+            grid=al.Grid2DIrregular(grid=nodes_coarse)
+        )
+    )
+    deflections_fine = np.asarray(
+        refine_mass_profile.deflections_from_grid(
+            grid=al.Grid2DIrregular(grid=nodes_fine[~refine])
+        )
+    )
+
+    deflections_interp = np.einsum("njk,nj->nk", deflections_coarse[vtx], wts)
+
+    refine[~refine] = (
+        np.max(np.abs(deflections_interp - deflections_fine), axis=1)
+        > refine_tolerance
+    )
+
+    """
+    The fine nodes neighboring every refined node are also used, so that the coordinates at the boundary of the
+    refined region are not interpolated from long, thin triangles joining fine and coarse nodes.
+    """
+    if np.any(refine):
+
+        distances_to_refined, _ = cKDTree(nodes_fine[refine]).query(nodes_fine)
+
+        refine = distances_to_refined < 1.5 * pixel_scales_refine
+
+    """
+    Coarse and fine nodes at the same coordinates are removed, as duplicate nodes are discarded by the Delaunay
+    triangulation.
+    """
+    return np.unique(
+        np.round(np.vstack((nodes_coarse, nodes_fine[refine])), decimals=10), axis=0
+    )
+
+
+"""
+__Interpolation Weights__
+
+The vertexes and weights pairing every (y,x) coordinate of a grid with the three nodes of the Delaunay triangle it
+is in are computed as in the `Grid2DInterpolate`.
+
+They are stored in the dictionary below, using a key made from the mask of the grid and the settings of the
+adaptive grid, so they are computed once per mask and reused by every `MaskedImaging` created with that mask (e.g.
+in every phase of a pipeline).
+"""
+interpolation_weights_dict = {}
+
+
+def interpolation_weights_from(grid, nodes):
+    """
+    Returns the vertexes and weights which interpolate values computed on the interpolation nodes to every (y,x)
+    coordinate of the grid.
+    """
+    grid = np.asarray(grid)
+
+    tri = Delaunay(nodes)
+    simplex = tri.find_simplex(grid)
+
+    if np.any(simplex == -1):
+        raise exc.GridException(
+            "Coordinates of the grid are outside of the adaptive interpolation grid, which must therefore cover "
+            "a larger region (e.g. use a larger pixel_scales_interp)."
+        )
+
+    vertices = np.take(tri.simplices, simplex, axis=0)
+    temp = np.take(tri.transform, simplex, axis=0)
+    delta = grid - temp[:, 2]
+    bary = np.einsum("njk,nk->nj", temp[:, :2, :], delta)
+
+    return vertices, np.hstack((bary, 1 - bary.sum(axis=1, keepdims=True)))
+
+
+def grid_interpolate_adaptive_from(grid, settings):
+    """
+    Returns a `Grid2DInterpolate` whose interpolation grid, vertexes and weights are replaced with those of an
+    adaptive interpolation grid.
+
+    Because the returned grid is a `Grid2DInterpolate`, every **PyAutoLens** function evaluates and interpolates the
+    mass profiles flagged in `config/grids/interpolate.ini` using the adaptive interpolation nodes.
+    """
+    mask = grid.mask
+
+    key = (
+        mask.tobytes(),
+        mask.shape,
+        mask.pixel_scales,
+        mask.sub_size,
+        mask.origin,
+        settings.adaptive_interpolation_key,
+    )
+
+    if key not in interpolation_weights_dict:
+
+        nodes = adaptive_interpolation_nodes_from(
+            mask=mask,
+            pixel_scales_interp=settings.pixel_scales_interp,
+            pixel_scales_refine=settings.pixel_scales_refine,
+            refine_mass_profile=settings.refine_mass_profile,
+            refine_tolerance=settings.refine_tolerance,
+        )
+
+        vtx, wts = interpolation_weights_from(grid=grid.slim, nodes=nodes)
+
+        interpolation_weights_dict[key] = (nodes, vtx, wts)
+
+    grid.grid_interp, grid.vtx, grid.wts = interpolation_weights_dict[key]
+
+    return grid
+
+
+"""
+__Masked Imaging__
+
+The settings of the adaptive interpolation grid extend the `SettingsMaskedImaging`, where the `grid_class` must be
+the `Grid2DInterpolate` and `pixel_scales_interp` is the coarse interpolation pixel scale. The output path of a phase
+is therefore tagged in the same way as a phase using a `Grid2DInterpolate`.
+"""
+
+
+class SettingsMaskedImagingAdaptiveInterpolate(al.SettingsMaskedImaging):
+    def __init__(
+        self,
+        grid_class=al.Grid2DInterpolate,
+        grid_inversion_class=al.Grid2D,
+        sub_size=2,
+        sub_size_inversion=2,
+        fractional_accuracy=0.9999,
+        sub_steps=None,
+        pixel_scales_interp=0.1,
+        signal_to_noise_limit=None,
+        psf_shape_2d=None,
+        renormalize_psf=True,
+        pixel_scales_refine=0.05,
+        refine_mass_profile=None,
+        refine_tolerance=1e-3,
+    ):
+        """
+        The settings of a `MaskedImagingAdaptiveInterpolate`, which in addition to the `SettingsMaskedImaging`
+        describe where its interpolation grid is refined.
+
+        Parameters
+        ----------
+        pixel_scales_refine : float
+            The pixel scale of the interpolation nodes in the refined regions.
+        refine_mass_profile : al.mp.MassProfile
+            The mass profile (e.g. of a previous phase's lens model) whose deflection angles decide where the
+            interpolation grid is refined.
+        refine_tolerance : float
+            The interpolation grid is refined where the coarse nodes interpolate the deflection angles of the
+            `refine_mass_profile` less accurately than this (in arc-seconds).
+        """
+        if grid_class is not al.Grid2DInterpolate:
+            raise exc.GridException(
+                "The grid_class of the SettingsMaskedImagingAdaptiveInterpolate must be the Grid2DInterpolate"
+            )
+
+        super().__init__(
+            grid_class=grid_class,
+            grid_inversion_class=grid_inversion_class,
+            sub_size=sub_size,
+            sub_size_inversion=sub_size_inversion,
+            fractional_accuracy=fractional_accuracy,
+            sub_steps=sub_steps,
+            pixel_scales_interp=pixel_scales_interp,
+            signal_to_noise_limit=signal_to_noise_limit,
+            psf_shape_2d=psf_shape_2d,
+            renormalize_psf=renormalize_psf,
+        )
+
+        self.pixel_scales_refine = pixel_scales_refine
+        self.refine_mass_profile = refine_mass_profile
+        self.refine_tolerance = refine_tolerance
+
+    @property
+    def adaptive_interpolation_key(self):
+        return (
+            self.pixel_scales_interp,
+            self.pixel_scales_refine,
+            None
+            if self.refine_mass_profile is None
+            else profile_key_from(profile=self.refine_mass_profile),
+            self.refine_tolerance,
+        )
+
+
+class MaskedImagingAdaptiveInterpolate(al.MaskedImaging):
+    def __init__(
+        self, imaging, mask, settings=SettingsMaskedImagingAdaptiveInterpolate()
+    ):
+
+        super().__init__(imaging=imaging, mask=mask, settings=settings)
+
+        self.grid = grid_interpolate_adaptive_from(grid=self.grid, settings=settings)
+
+        if self.blurring_grid is not None:
+            self.blurring_grid = grid_interpolate_adaptive_from(
+                grid=self.blurring_grid, settings=settings
+            )
+
+
+"""
+__Phase__
+
+To use the `MaskedImagingAdaptiveInterpolate` in a model-fit, we extend the `PhaseImaging` so that its analysis is
+created using a `MaskedImagingAdaptiveInterpolate`.
+"""
+
+
+class PhaseImagingAdaptiveInterpolate(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = MaskedImagingAdaptiveInterpolate(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return self.Analysis(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the same dataset as the `interpolating_deflections.py` example.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Phase 1__
+
+Phase 1 fits an `EllipticalIsothermal` mass model, whose deflection angles are analytic and not interpolated. Its
+lens model decides where the adaptive interpolation grid of phase 2 is refined.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+phase1 = al.PhaseImaging(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "adaptive_interpolation_grids"),
+        name="phase[1]",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+phase1_result = phase1.run(dataset=imaging, mask=mask)
+
+"""
+__Settings__
+
+The settings use a coarse interpolation pixel scale of 0.1" (twice that of the `interpolating_deflections.py`
+example), refined to 0.05" wherever the coarse nodes interpolate the deflection angles of the phase 1 lens model less
+accurately than 0.001".
+"""
+settings_masked_imaging = SettingsMaskedImagingAdaptiveInterpolate(
+    pixel_scales_interp=0.1,
+    pixel_scales_refine=0.05,
+    refine_mass_profile=phase1_result.instance.galaxies.lens.mass,
+    refine_tolerance=1e-3,
+)
+
+"""
+Lets compare the precision of the adaptive interpolation grid with that of uniform interpolation grids, for the
+deflection angles of an `EllipticalCoredPowerLaw` whose Einstein radius is that of phase 1.
+
+The uniform 0.05" nodes lie on the (y,x) coordinates of the 0.1" data's sub-pixels (for a `sub_size` of 2), so its
+deflection angles are exact, but it uses as many nodes as there are sub-pixels. The adaptive grid uses these nodes
+only where the 0.1" nodes are inaccurate, so it is more accurate than every uniform grid with fewer nodes and uses
+fewer nodes than every uniform grid which is as accurate, which we assert.
+"""
+mass = al.mp.EllipticalCoredPowerLaw(
+    centre=phase1_result.instance.galaxies.lens.mass.centre,
+    elliptical_comps=phase1_result.instance.galaxies.lens.mass.elliptical_comps,
+    einstein_radius=phase1_result.instance.galaxies.lens.mass.einstein_radius,
+    slope=2.0,
+    core_radius=0.05,
+)
+
+masked_imaging = MaskedImagingAdaptiveInterpolate(
+    imaging=imaging, mask=mask, settings=settings_masked_imaging
+)
+
+grid = al.Grid2D.from_mask(mask=masked_imaging.mask)
+deflections = mass.deflections_from_grid(grid=grid)
+
+deflections_adaptive = mass.deflections_from_grid(grid=masked_imaging.grid)
+
+adaptive_nodes = masked_imaging.grid.grid_interp.shape[0]
+adaptive_error = np.max(np.abs(deflections_adaptive.slim - deflections.slim))
+
+print(f"Adaptive Interpolation Nodes = {adaptive_nodes}")
+print(f"Adaptive Maximum Deflection Error = {adaptive_error}")
+
+for pixel_scales_interp in [0.1, 0.05, 0.025]:
+
+    grid_interpolate = al.Grid2DInterpolate.from_mask(
+        mask=masked_imaging.mask, pixel_scales_interp=pixel_scales_interp
+    )
+
+    deflections_uniform = mass.deflections_from_grid(grid=grid_interpolate)
+
+    uniform_nodes = grid_interpolate.grid_interp.shape[0]
+    uniform_error = np.max(np.abs(deflections_uniform.slim - deflections.slim))
+
+    print(f"Uniform {pixel_scales_interp}\" Interpolation Nodes = {uniform_nodes}")
+    print(f"Uniform {pixel_scales_interp}\" Maximum Deflection Error = {uniform_error}")
+
+    assert uniform_nodes > adaptive_nodes or uniform_error > adaptive_error
+
+"""
+__Phase 2__
+
+Phase 2 fits an `EllipticalCoredPowerLaw` using the adaptive interpolation grid.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalCoredPowerLaw)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+lens.mass.centre = phase1_result.model.galaxies.lens.mass.centre
+lens.mass.elliptical_comps = phase1_result.model.galaxies.lens.mass.elliptical_comps
+
+settings = al.SettingsPhaseImaging(settings_masked_imaging=settings_masked_imaging)
+
+phase2 = PhaseImagingAdaptiveInterpolate(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "adaptive_interpolation_grids"),
+        name="phase[2]",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=settings,
+)
+
+phase2.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,395 @@
+"""
+Performance: Adaptive Sub Gridding
+==================================
+
+Every simulator in the workspace uses a `Grid2DIterate`, for example:
+
+ grid = al.Grid2DIterate.uniform(
+     shape_native=(800, 800), pixel_scales=0.01, fractional_accuracy=0.9999, sub_steps=[2, 4, 8, 16, 24]
+ )
+
+When a light profile's image is evaluated on this grid, the sub-size of each pixel is increased until the image
+converges to the input fractional accuracy. For large grids, like the 800 x 800 AO grid of
+`imaging/simulators/instruments/ao.py`, or when thousands of datasets are simulated, like the `simulate_function`
+of sensitivity mapping, this iteration dominates the run-time. At every sub-step a new `Mask2D` and `Grid2D` are
+created for the unconverged pixels and the results are compared pixel-by-pixel in the native 2D frame.
+
+This script shows an adaptive sub-gridding engine which:
+
+ - Evaluates the function at every sub-step as one batched array operation, on the sub-pixels of only the pixels
+   that have not yet converged, which are stored as a 1D array of pixel indexes.
+
+ - Returns a `sub_size_map`, the sub-size each pixel converged at, which can be output to a .fits file and passed
+   to later simulations of the same geometry so that every pixel is evaluated once at its converged sub-size,
+   skipping the iteration entirely.
+
+The convergence criteria is identical to that of the `Grid2DIterate`, such that the images computed by both are
+identical.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+import autolens as al
+import autolens.plot as aplt
+
+"""
+__Adaptive Sub Grid__
+
+The `AdaptiveSubGrid` is set up from a `Mask2D` and stores the (y,x) coordinates of the centre of every unmasked
+pixel. Sub-pixel coordinates are computed for an input set of pixels by adding the offsets of every sub-pixel from
+its pixel's centre, which are the same for every pixel.
+
+The function which is evaluated (e.g. `tracer.image_from_grid`) is passed the sub-pixel coordinates as a NumPy
+array of shape [total_sub_pixels, 2], which every **PyAutoLens** profile, `Galaxy` and `Tracer` supports.
+"""
+
+
+class AdaptiveSubGrid:
+    def __init__(
+        self,
+        mask,
+        fractional_accuracy=0.9999,
+        sub_steps=None,
+        sub_size_map=None,
+        sub_pixels_per_batch=2 ** 22,
+    ):
+        """
+        Evaluates functions on a grid of (y,x) coordinates using an adaptive sub-grid, where the sub-size of every
+        pixel is increased until the function converges to an input fractional accuracy.
+
+        Parameters
+        ----------
+        mask : al.Mask2D
+            The mask whose unmasked pixels the function is evaluated in.
+        fractional_accuracy : float
+            The fractional accuracy the function must be evaluated to in every pixel, as used by `Grid2DIterate`.
+        sub_steps : [int]
+            The sub-sizes the function is evaluated at, in ascending order.
+        sub_size_map : al.Array2D
+            The sub-size each pixel converged at in a previous evaluation, which if input is used instead of
+            iteratively computing the function.
+        sub_pixels_per_batch : int
+            The maximum number of sub-pixels passed to the function in one call, which limits the memory used for
+            large grids.
+        """
+        if sub_steps is None:
+            sub_steps = [2, 4, 8, 16]
+
+        self.mask = mask.mask_sub_1
+        self.fractional_accuracy = fractional_accuracy
+        self.sub_steps = sub_steps
+        self.sub_size_map = sub_size_map
+        self.sub_pixels_per_batch = sub_pixels_per_batch
+
+        self.pixel_centres = np.asarray(mask.masked_grid_sub_1.slim)
+
+    @classmethod
+    def from_grid_iterate(cls, grid, sub_size_map=None):
+        """
+        Returns the `AdaptiveSubGrid` with the same mask, fractional accuracy and sub-steps as a `Grid2DIterate`.
+        """
+        return cls(
+            mask=grid.mask,
+            fractional_accuracy=grid.fractional_accuracy,
+            sub_steps=grid.sub_steps,
+            sub_size_map=sub_size_map,
+        )
+
+    def sub_pixel_offsets_from(self, sub_size):
+        """
+        The (y,x) offsets of every sub-pixel from the centre of its pixel, ordered from the top-left sub-pixel.
+        """
+        pixel_scale_y, pixel_scale_x = self.mask.pixel_scales
+
+        offsets_y = 0.5 * pixel_scale_y - (np.arange(sub_size) + 0.5) * (
+            pixel_scale_y / sub_size
+        )
+        offsets_x = -0.5 * pixel_scale_x + (np.arange(sub_size) + 0.5) * (
+            pixel_scale_x / sub_size
+        )
+
+        offsets = np.zeros((sub_size, sub_size, 2))
+        offsets[:, :, 0] = offsets_y[:, None]
+        offsets[:, :, 1] = offsets_x[None, :]
+
+        return offsets.reshape(sub_size ** 2, 2)
+
+    def binned_values_from(self, func, pixel_indexes, sub_size):
+        """
+        Evaluate the function on the sub-grid of the input pixels and return its mean value in every pixel.
+        """
+        offsets = self.sub_pixel_offsets_from(sub_size=sub_size)
+
+        pixels_per_batch = max(self.sub_pixels_per_batch // sub_size ** 2, 1)
+
+        binned_values = np.zeros(pixel_indexes.shape[0])
+
+        for batch_start in range(0, pixel_indexes.shape[0], pixels_per_batch):
+
+            batch = slice(batch_start, batch_start + pixels_per_batch)
+
+            sub_grid = (
+                self.pixel_centres[pixel_indexes[batch]][:, None, :] + offsets[None, :, :]
+            ).reshape(-1, 2)
+
+            values = np.asarray(func(sub_grid))
+
+            binned_values[batch] = values.reshape(-1, sub_size ** 2).mean(axis=1)
+
+        return binned_values
+
+    def converged_from(self, values_lower_sub, values_higher_sub):
+        """
+        Returns a boolean array which is `True` for every pixel whose value at the higher sub-size is within the
+        fractional accuracy of its value at the lower sub-size. This uses the same criteria as the `Grid2DIterate`,
+        where a pixel whose lower sub-size value is not positive has not converged.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fractional_accuracy = values_lower_sub / values_higher_sub
+            fractional_accuracy = np.where(
+                fractional_accuracy > 1.0,
+                1.0 / fractional_accuracy,
+                fractional_accuracy,
+            )
+        fractional_accuracy = np.where(
+            values_lower_sub > 0.0, np.nan_to_num(fractional_accuracy), 0.0
+        )
+
+        return fractional_accuracy >= self.fractional_accuracy
+
+    def array_from_func(self, func):
+        """
+        Evaluate the function in every pixel of the mask, using the `sub_size_map` if it has been computed
+        previously or iteratively increasing the sub-size of unconverged pixels otherwise.
+
+        Parameters
+        ----------
+        func : func
+            A function that takes a NumPy array of (y,x) coordinates of shape [total_coordinates, 2] and returns an
+            array of values, for example `tracer.image_from_grid`.
+        """
+        if self.sub_size_map is not None:
+            return self.array_via_sub_size_map_from(func=func)
+
+        values_lower_sub = np.asarray(func(self.pixel_centres))
+
+        values = np.zeros(self.pixel_centres.shape[0])
+        sub_sizes = np.full(self.pixel_centres.shape[0], self.sub_steps[-1])
+
+        if not np.any(values_lower_sub):
+            sub_sizes[:] = 1
+            self.sub_size_map = self.array_from_values(values=sub_sizes)
+            return self.array_from_values(values=values_lower_sub)
+
+        unconverged_indexes = np.arange(self.pixel_centres.shape[0])
+
+        for sub_size in self.sub_steps[:-1]:
+
+            values_higher_sub = self.binned_values_from(
+                func=func, pixel_indexes=unconverged_indexes, sub_size=sub_size
+            )
+
+            converged = self.converged_from(
+                values_lower_sub=values_lower_sub, values_higher_sub=values_higher_sub
+            )
+
+            values[unconverged_indexes[converged]] = values_higher_sub[converged]
+            sub_sizes[unconverged_indexes[converged]] = sub_size
+
+            unconverged_indexes = unconverged_indexes[~converged]
+            values_lower_sub = values_higher_sub[~converged]
+
+            if unconverged_indexes.shape[0] == 0:
+                break
+
+        else:
+
+            values[unconverged_indexes] = self.binned_values_from(
+                func=func, pixel_indexes=unconverged_indexes, sub_size=self.sub_steps[-1]
+            )
+
+        self.sub_size_map = self.array_from_values(values=sub_sizes)
+
+        return self.array_from_values(values=values)
+
+    def array_via_sub_size_map_from(self, func):
+        """
+        Evaluate the function in every pixel at the sub-size stored in the `sub_size_map`, using one batched call for
+        every sub-size.
+        """
+        sub_sizes = np.asarray(self.sub_size_map.slim).astype("int")
+
+        values = np.zeros(self.pixel_centres.shape[0])
+
+        for sub_size in np.unique(sub_sizes):
+
+            pixel_indexes = np.where(sub_sizes == sub_size)[0]
+
+            values[pixel_indexes] = self.binned_values_from(
+                func=func, pixel_indexes=pixel_indexes, sub_size=sub_size
+            )
+
+        return self.array_from_values(values=values)
+
+    def array_from_values(self, values):
+        return al.Array2D.manual_mask(array=values, mask=self.mask)
+
+
+"""
+__Simulation__
+
+The `SimulatorImaging` evaluates the image on a grid padded by the PSF's shape, so that light outside the image is
+blurred into it, before trimming the image after convolution. The function below does the same using an
+`AdaptiveSubGrid` defined on the padded grid.
+"""
+
+
+def simulate_imaging_from(simulator, tracer, adaptive_sub_grid, name=None):
+    """
+    Simulate `Imaging` of a tracer, where its image is computed using an `AdaptiveSubGrid` that was set up using a
+    grid padded by the shape of the simulator's PSF.
+    """
+    image = adaptive_sub_grid.array_from_func(func=tracer.image_from_grid)
+
+    imaging = simulator.from_image(image=image, name=name)
+
+    return imaging.trimmed_after_convolution_from(
+        kernel_shape=simulator.psf.shape_native
+    )
+
+
+"""
+__AO Simulation__
+
+We now simulate the AO dataset of `imaging/simulators/instruments/ao.py`, first using the `Grid2DIterate` and then
+using the `AdaptiveSubGrid`.
+"""
+grid = al.Grid2DIterate.uniform(
+    shape_native=(800, 800),
+    pixel_scales=0.01,
+    fractional_accuracy=0.9999,
+    sub_steps=[2, 4, 8, 16, 24],
+)
+
+psf = al.Kernel2D.from_gaussian(
+    shape_native=(21, 21), sigma=0.025, pixel_scales=grid.pixel_scales, renormalize=True
+)
+
+simulator = al.SimulatorImaging(
+    exposure_time=1000.0,
+    psf=psf,
+    background_sky_level=1.0,
+    add_poisson_noise=True,
+    noise_seed=1,
+)
+
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.EllipticalSersic(
+        centre=(0.1, 0.1),
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=60.0),
+        intensity=0.3,
+        effective_radius=1.0,
+        sersic_index=2.5,
+    ),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+start = time.time()
+imaging = simulator.from_tracer_and_grid(tracer=tracer, grid=grid)
+print(f"Grid2DIterate simulation time = {time.time() - start} s")
+
+padded_grid = grid.padded_grid_from_kernel_shape(kernel_shape_native=psf.shape_native)
+
+adaptive_sub_grid = AdaptiveSubGrid.from_grid_iterate(grid=padded_grid)
+
+start = time.time()
+imaging_adaptive = simulate_imaging_from(
+    simulator=simulator, tracer=tracer, adaptive_sub_grid=adaptive_sub_grid
+)
+print(f"AdaptiveSubGrid simulation time = {time.time() - start} s")
+
+"""
+The two simulations use the same noise seed, so their images are identical.
+"""
+print(
+    "Maximum Image Difference = ",
+    np.max(np.abs(imaging.image.slim - imaging_adaptive.image.slim)),
+)
+
+"""
+The `sub_size_map` shows the sub-size every pixel converged at, which is 24 near the centre of the source and
+in the regions of high magnification, and 2 almost everywhere else.
+"""
+array_plotter = aplt.Array2DPlotter(array=adaptive_sub_grid.sub_size_map)
+array_plotter.figure()
+
+"""
+__Reusing The Sub Size Map__
+
+The `sub_size_map` can be output to a .fits file and passed to later simulations of the same geometry. For
+sensitivity mapping, where thousands of datasets are simulated which differ only by the subhalo that is added to
+the lens, each simulation then evaluates every pixel once at its converged sub-size.
+
+Reusing the `sub_size_map` assumes the function converges at the same sub-size as when the map was computed. The
+map should therefore be computed for a model whose image is representative of those which reuse it (e.g. the lens
+model without a subhalo) and it should not be reused for simulations whose source or lens geometry changes
+significantly.
+"""
+sub_size_map_path = path.join("dataset", "imaging", "instruments", "ao")
+
+adaptive_sub_grid.sub_size_map.output_to_fits(
+    file_path=path.join(sub_size_map_path, "sub_size_map.fits"), overwrite=True
+)
+
+sub_size_map = al.Array2D.from_fits(
+    file_path=path.join(sub_size_map_path, "sub_size_map.fits"),
+    pixel_scales=padded_grid.pixel_scales,
+)
+
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+    subhalo=al.mp.SphericalNFWMCRLudlow(
+        centre=(1.6, 0.0), mass_at_200=1.0e10, redshift_object=0.5, redshift_source=1.0
+    ),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+adaptive_sub_grid = AdaptiveSubGrid.from_grid_iterate(
+    grid=padded_grid, sub_size_map=sub_size_map
+)
+
+start = time.time()
+imaging_subhalo = simulate_imaging_from(
+    simulator=simulator, tracer=tracer, adaptive_sub_grid=adaptive_sub_grid
+)
+print(f"AdaptiveSubGrid (reused sub size map) simulation time = {time.time() - start} s")
+
+imaging_plotter = aplt.ImagingPlotter(imaging=imaging_subhalo)
+imaging_plotter.subplot_imaging()
+
+"""
+Finish.
+"""
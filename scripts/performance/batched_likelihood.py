@@ -0,0 +1,588 @@
+"""
+Performance: Batched Likelihood
+===============================
+
+Every call to the `log_likelihood_function` of a **PyAutoLens** `Analysis` evaluates one lens model, which means it
+creates a `Tracer`, a `FitImaging`, ray-traces the grid, evaluates the light profiles and convolves the model image
+with the PSF for that single model. For high resolution data (e.g. HST imaging at 0.05") a large fraction of each
+evaluation is Python overhead in creating these objects, as opposed to numerical work.
+
+Many non-linear searches propose a whole population of models at once, for example the walkers of `Emcee`. This
+script shows how an imaging `Analysis` can be extended with a `log_likelihood_batch` method, which takes a matrix of
+parameter vectors of shape [total_samples, total_parameters] and returns all of their log likelihoods in one call.
+
+The batched path evaluates every sample in one pass of array operations with a leading sample axis:
+
+ - The deflection angles of the lens galaxy's mass profiles are computed for every sample at once, giving the traced
+   source-plane grids of shape [total_samples, total_sub_pixels, 2], without creating a `Tracer`.
+
+ - The light profiles of every galaxy are evaluated on the image-plane or traced grids for every sample at once, and
+   binned from the sub-grid to the image pixels.
+
+ - The model images of all samples are convolved with the PSF in a single sparse matrix multiplication.
+
+ - The chi-squared of every sample is computed in one array operation and the noise normalization only once.
+
+The mass and light profiles are evaluated by array functions of their parameters, written for the profiles this
+script fits: the `EllipticalIsothermal`, `ExternalShear` and `EllipticalSersic`. They use the same expressions as the
+**PyAutoLens** profiles (including the relocation of coordinates near a profile's centre to its radial minimum).
+
+Models which cannot be evaluated this way (e.g. those with other profiles, an `Inversion`, hyper components or
+positions thresholds) fall back to the standard `log_likelihood_function`, so the batched path always gives the same
+log likelihoods as the standard one.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from autoconf import conf
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from inversion_operators import blurring_operators_from
+
+"""
+Load the HST strong lens dataset `instruments/hst`, which has a pixel scale of 0.05".
+"""
+dataset_name = "hst"
+dataset_path = path.join("dataset", "imaging", "instruments", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.05,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Settings__
+
+The `SettingsPhaseImaging` and `MaskedImaging` are set up as per usual.
+"""
+settings_masked_imaging = al.SettingsMaskedImaging(grid_class=al.Grid2D, sub_size=2)
+settings = al.SettingsPhaseImaging(settings_masked_imaging=settings_masked_imaging)
+
+masked_imaging = al.MaskedImaging(
+    imaging=imaging, mask=mask, settings=settings_masked_imaging
+)
+
+"""
+__Model__
+
+We fit an `EllipticalIsothermal` + `ExternalShear` lens and `EllipticalSersic` source. The model is composed as a
+`CollectionPriorModel` with a `galaxies` attribute, which is how a phase composes its model.
+"""
+lens = al.GalaxyModel(
+    redshift=0.5, mass=al.mp.EllipticalIsothermal, shear=al.mp.ExternalShear
+)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+model = af.CollectionPriorModel(
+    galaxies=af.CollectionPriorModel(lens=lens, source=source)
+)
+
+"""
+__Batched Profiles__
+
+The functions below evaluate a mass or light profile for every sample of a batch. Each takes a grid of (y,x)
+coordinates, which is either shared by every sample (shape [total_coordinates, 2], e.g. the image-plane grid) or is
+different for every sample (shape [total_samples, total_coordinates, 2], e.g. the traced source-plane grids), and the
+profile of every sample. The parameters of the profiles are stacked into arrays of shape [total_samples, 1], such that
+every expression broadcasts to shape [total_samples, total_coordinates].
+
+As in **PyAutoLens**, the coordinates are transformed to the reference frame of every profile (and coordinates within
+the profile's radial minimum of its centre are moved to that radius) and the deflection angles are rotated back.
+"""
+
+
+def parameter_from(profiles, name):
+    """
+    Returns the parameter of the input name of every profile, as an array of shape [total_samples, 1].
+    """
+    return np.array([getattr(profile, name) for profile in profiles])[:, None]
+
+
+def transformed_grid_from(grid, profiles):
+    """
+    Returns the (y,x) coordinates of a grid in the reference frame of every profile, as two arrays of shape
+    [total_samples, total_coordinates].
+    """
+    centres = np.array([profile.centre for profile in profiles])
+
+    y = grid[..., 0] - centres[:, 0:1]
+    x = grid[..., 1] - centres[:, 1:2]
+
+    radius = np.sqrt(y ** 2.0 + x ** 2.0)
+    theta = np.arctan2(y, x) - np.radians(parameter_from(profiles=profiles, name="phi"))
+
+    y = radius * np.sin(theta)
+    x = radius * np.cos(theta)
+
+    grid_radial_minimum = conf.instance["grids"]["radial_minimum"]["radial_minimum"][
+        profiles[0].__class__.__name__
+    ]
+
+    with np.errstate(all="ignore"):
+
+        grid_radial_scale = np.where(
+            radius < grid_radial_minimum, grid_radial_minimum / radius, 1.0
+        )
+
+    y = y * grid_radial_scale
+    x = x * grid_radial_scale
+
+    y[np.isnan(y)] = grid_radial_minimum
+    x[np.isnan(x)] = grid_radial_minimum
+
+    return y, x
+
+
+def rotated_from_profile(deflections_y, deflections_x, profiles):
+    """
+    Rotates the deflection angles of every profile from its reference frame back to the frame of the grid, returning
+    them as an array of shape [total_samples, total_coordinates, 2].
+    """
+    phi_radians = np.radians(parameter_from(profiles=profiles, name="phi"))
+
+    cos_phi = np.cos(phi_radians)
+    sin_phi = np.sin(phi_radians)
+
+    return np.stack(
+        (
+            deflections_x * sin_phi + deflections_y * cos_phi,
+            deflections_x * cos_phi - deflections_y * sin_phi,
+        ),
+        axis=-1,
+    )
+
+
+def deflections_isothermal_from(grid, profiles):
+
+    y, x = transformed_grid_from(grid=grid, profiles=profiles)
+
+    axis_ratio = parameter_from(profiles=profiles, name="axis_ratio")
+    einstein_radius_rescaled = parameter_from(
+        profiles=profiles, name="einstein_radius_rescaled"
+    )
+
+    factor = 2.0 * einstein_radius_rescaled * axis_ratio / np.sqrt(1 - axis_ratio ** 2)
+
+    psi = np.sqrt(axis_ratio ** 2.0 * x ** 2.0 + y ** 2.0)
+
+    return rotated_from_profile(
+        deflections_y=factor * np.arctanh(np.sqrt(1 - axis_ratio ** 2) * y / psi),
+        deflections_x=factor * np.arctan(np.sqrt(1 - axis_ratio ** 2) * x / psi),
+        profiles=profiles,
+    )
+
+
+def deflections_external_shear_from(grid, profiles):
+
+    y, x = transformed_grid_from(grid=grid, profiles=profiles)
+
+    magnitude = parameter_from(profiles=profiles, name="magnitude")
+
+    return rotated_from_profile(
+        deflections_y=-magnitude * y, deflections_x=magnitude * x, profiles=profiles
+    )
+
+
+def image_sersic_from(grid, profiles):
+
+    y, x = transformed_grid_from(grid=grid, profiles=profiles)
+
+    axis_ratio = parameter_from(profiles=profiles, name="axis_ratio")
+
+    grid_radii = np.sqrt(axis_ratio) * np.sqrt(x ** 2.0 + (y / axis_ratio) ** 2.0)
+
+    return parameter_from(profiles=profiles, name="intensity") * np.exp(
+        -parameter_from(profiles=profiles, name="sersic_constant")
+        * (
+            (grid_radii / parameter_from(profiles=profiles, name="effective_radius"))
+            ** (1.0 / parameter_from(profiles=profiles, name="sersic_index"))
+            - 1
+        )
+    )
+
+
+"""
+The batched function of every supported profile is paired with its class below. Only instances of exactly these
+classes are batched (e.g. not the `SphericalIsothermal`, whose reference frame is not rotated).
+"""
+batched_deflections_funcs = {
+    al.mp.EllipticalIsothermal: deflections_isothermal_from,
+    al.mp.ExternalShear: deflections_external_shear_from,
+}
+
+batched_image_funcs = {al.lp.EllipticalSersic: image_sersic_from}
+
+"""
+__Batched Analysis__
+
+We now extend the PyAutoLens imaging `Analysis` class (in the same way as the sensitivity mapping example) with a
+`log_likelihood_batch` method.
+
+The sparse PSF blurring operators of the `Convolver`'s image and blurring pixels are created by the shared
+`inversion_operators.py` module, such that blurring a batch of images is a single sparse matrix multiplication. This
+gives identical results to the `Convolver`'s `convolved_image_from_image_and_blurring_image` method.
+"""
+from astropy import cosmology as cosmo
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisBatched(a.Analysis):
+    def __init__(self, masked_imaging, model, settings, cosmology=cosmo.Planck15):
+        """
+        An imaging `Analysis` which, in addition to the standard `log_likelihood_function`, can compute the log
+        likelihoods of a batch of parameter vectors in one call.
+
+        Parameters
+        ----------
+        masked_imaging : al.MaskedImaging
+            The masked imaging data that every model in the batch is fitted to.
+        model : af.CollectionPriorModel
+            The model whose parameter vectors are passed to `log_likelihood_batch`.
+        settings : al.SettingsPhaseImaging
+            The settings controlling how the fit is performed.
+        """
+        super().__init__(
+            masked_imaging=masked_imaging, settings=settings, cosmology=cosmology
+        )
+
+        self.model = model
+
+        (
+            self.image_blurring_operator,
+            self.blurring_blurring_operator,
+        ) = blurring_operators_from(convolver=masked_imaging.convolver)
+
+        self.grid = np.asarray(masked_imaging.grid)
+        self.blurring_grid = np.asarray(masked_imaging.blurring_grid)
+        self.sub_length = masked_imaging.grid.mask.sub_length
+        self.sub_fraction = masked_imaging.grid.mask.sub_fraction
+
+        self.data_slim = np.asarray(masked_imaging.image.slim)
+        self.noise_map_slim = np.asarray(masked_imaging.noise_map.slim)
+        self.noise_normalization = np.sum(
+            np.log(2 * np.pi * self.noise_map_slim ** 2.0)
+        )
+
+    def batch_key_for_instance(self, instance):
+        """
+        Returns the key of the structure of an instance (the redshift and profile classes of every galaxy), which
+        instances evaluated in the same batch share. Instances which cannot be batched return `None`, and are computed
+        via the standard `log_likelihood_function`.
+
+        Only parametric models of one or two planes without hyper components are batched, whose mass profiles are all
+        in the first plane and whose profiles all have a batched function.
+        """
+        settings_lens = self.settings.settings_lens
+
+        if (
+            self.hyper_image_sky_for_instance(instance=instance) is not None
+            or self.hyper_background_noise_for_instance(instance=instance) is not None
+            or settings_lens.stochastic_likelihood_resamples is not None
+            or (
+                settings_lens.positions_threshold is not None
+                and self.masked_imaging.positions is not None
+            )
+            or (
+                settings_lens.einstein_radius_estimate is not None
+                and settings_lens.auto_einstein_radius_factor is not None
+            )
+        ):
+            return None
+
+        galaxies = list(instance.galaxies)
+
+        if any(
+            galaxy.has_pixelization or galaxy.has_hyper_galaxy for galaxy in galaxies
+        ):
+            return None
+
+        redshifts = sorted(set(galaxy.redshift for galaxy in galaxies))
+
+        if len(redshifts) > 2:
+            return None
+
+        for galaxy in galaxies:
+
+            if any(
+                type(profile) not in batched_image_funcs
+                for profile in galaxy.light_profiles
+            ) or any(
+                type(profile) not in batched_deflections_funcs
+                for profile in galaxy.mass_profiles
+            ):
+                return None
+
+            if galaxy.mass_profiles and galaxy.redshift != redshifts[0]:
+                return None
+
+        return tuple(
+            (
+                galaxy.redshift,
+                tuple(type(profile) for profile in galaxy.light_profiles),
+                tuple(type(profile) for profile in galaxy.mass_profiles),
+            )
+            for galaxy in galaxies
+        )
+
+    def images_from_instances(self, grid, instances):
+        """
+        Returns the image of every instance on a grid, of shape [total_samples, total_coordinates], where every
+        instance has the same batch key.
+
+        The deflection angles of the mass profiles of the first plane are computed for every instance at once and
+        subtracted from the grid to give the traced grid of the second plane, on which the light profiles of its
+        galaxies are evaluated.
+        """
+        galaxies_of_instances = [list(instance.galaxies) for instance in instances]
+        galaxies = galaxies_of_instances[0]
+
+        redshifts = sorted(set(galaxy.redshift for galaxy in galaxies))
+
+        deflections = np.zeros((len(instances),) + grid.shape)
+
+        for galaxy_index, galaxy in enumerate(galaxies):
+            for profile_index, mass_profile in enumerate(galaxy.mass_profiles):
+
+                deflections += batched_deflections_funcs[type(mass_profile)](
+                    grid=grid,
+                    profiles=[
+                        galaxies_of_instance[galaxy_index].mass_profiles[profile_index]
+                        for galaxies_of_instance in galaxies_of_instances
+                    ],
+                )
+
+        traced_grid = grid - deflections
+
+        images = np.zeros((len(instances), grid.shape[0]))
+
+        for galaxy_index, galaxy in enumerate(galaxies):
+
+            galaxy_grid = grid if galaxy.redshift == redshifts[0] else traced_grid
+
+            for profile_index, light_profile in enumerate(galaxy.light_profiles):
+
+                images += batched_image_funcs[type(light_profile)](
+                    grid=galaxy_grid,
+                    profiles=[
+                        galaxies_of_instance[galaxy_index].light_profiles[profile_index]
+                        for galaxies_of_instance in galaxies_of_instances
+                    ],
+                )
+
+        return images
+
+    def log_likelihood_batch(self, parameter_matrix):
+        """
+        Returns the log likelihood of every parameter vector in `parameter_matrix`, which has shape
+        [total_samples, total_parameters].
+
+        Parameter vectors outside the prior limits, or whose fit raises a `FitException` (e.g. because the positions
+        do not trace within the threshold), are given a log likelihood of -np.inf.
+        """
+        parameter_matrix = np.atleast_2d(parameter_matrix)
+        total_samples = parameter_matrix.shape[0]
+
+        log_likelihoods = np.full(total_samples, -np.inf)
+
+        batches = {}
+
+        for sample_index, vector in enumerate(parameter_matrix):
+
+            try:
+                instance = self.model.instance_from_vector(vector=vector)
+            except af.exc.PriorLimitException:
+                continue
+
+            instance = self.associate_hyper_images(instance=instance)
+
+            batch_key = self.batch_key_for_instance(instance=instance)
+
+            if batch_key is None:
+                try:
+                    log_likelihoods[sample_index] = self.log_likelihood_function(
+                        instance=instance
+                    )
+                except af.exc.FitException:
+                    pass
+                continue
+
+            batches.setdefault(batch_key, []).append((sample_index, instance))
+
+        """
+        The images of every batch are computed in one pass, binned from the sub-grid to the image pixels and blurred
+        in one sparse matrix multiplication, after which the chi-squared of every sample is computed at once.
+        """
+        for batch in batches.values():
+
+            sample_indexes = [sample_index for sample_index, _ in batch]
+            instances = [instance for _, instance in batch]
+
+            sub_images = self.images_from_instances(grid=self.grid, instances=instances)
+
+            images = self.sub_fraction * sub_images.reshape(
+                len(instances), -1, self.sub_length
+            ).sum(axis=2)
+
+            blurring_images = self.images_from_instances(
+                grid=self.blurring_grid, instances=instances
+            )
+
+            blurred_images = (
+                self.image_blurring_operator @ images.T
+                + self.blurring_blurring_operator @ blurring_images.T
+            ).T
+
+            chi_squareds = np.sum(
+                ((self.data_slim - blurred_images) / self.noise_map_slim) ** 2.0,
+                axis=1,
+            )
+
+            log_likelihoods[sample_indexes] = -0.5 * (
+                chi_squareds + self.noise_normalization
+            )
+
+        return log_likelihoods
+
+    def log_posterior_batch(self, parameter_matrix):
+        """
+        Returns the log posterior of every parameter vector in `parameter_matrix`, which is the function a sampler
+        like `emcee` samples (the log priors are summed over every parameter).
+        """
+        log_likelihoods = self.log_likelihood_batch(parameter_matrix=parameter_matrix)
+
+        log_priors = np.array(
+            [
+                np.sum(self.model.log_priors_from_vector(vector=vector))
+                if np.isfinite(log_likelihood)
+                else 0.0
+                for vector, log_likelihood in zip(
+                    np.atleast_2d(parameter_matrix), log_likelihoods
+                )
+            ]
+        )
+
+        return log_likelihoods + log_priors
+
+
+analysis = AnalysisBatched(masked_imaging=masked_imaging, model=model, settings=settings)
+
+"""
+__Validation__
+
+Lets check the batched log likelihoods are the same as those computed one-by-one by the standard
+`log_likelihood_function`, for a batch of parameter vectors drawn from the priors, and compare the time each takes.
+Both are called once before they are timed.
+"""
+total_samples = 10
+
+parameter_matrix = np.array(
+    [
+        model.random_vector_from_priors_within_limits(
+            lower_limit=0.45, upper_limit=0.55
+        )
+        for _ in range(total_samples)
+    ]
+)
+
+analysis.log_likelihood_batch(parameter_matrix=parameter_matrix[0:1])
+analysis.log_likelihood_function(
+    instance=model.instance_from_vector(vector=parameter_matrix[0])
+)
+
+start = time.time()
+log_likelihoods_batch = analysis.log_likelihood_batch(parameter_matrix=parameter_matrix)
+print(f"Batched time per sample = {(time.time() - start) / total_samples} s")
+
+start = time.time()
+log_likelihoods_single = np.asarray(
+    [
+        analysis.log_likelihood_function(
+            instance=model.instance_from_vector(vector=vector)
+        )
+        for vector in parameter_matrix
+    ]
+)
+print(f"Standard time per sample = {(time.time() - start) / total_samples} s")
+
+print("Batched Log Likelihoods:")
+print(log_likelihoods_batch)
+print("Standard Log Likelihoods:")
+print(log_likelihoods_single)
+
+assert np.allclose(log_likelihoods_batch, log_likelihoods_single, rtol=1e-8)
+
+"""
+__Emcee__
+
+`emcee` can pass all of its walkers to the log posterior function in one call, by setting `vectorize=True`. Every
+step of the sampler therefore makes one call to `log_posterior_batch`, with a [total_walkers, total_parameters]
+matrix.
+
+The walkers are initialized in a small ball around the prior medians, as the `Emcee` search of **PyAutoFit** does.
+"""
+import emcee
+
+total_walkers = 30
+total_steps = 500
+
+initial_positions = np.array(
+    [
+        model.random_vector_from_priors_within_limits(
+            lower_limit=0.49, upper_limit=0.51
+        )
+        for _ in range(total_walkers)
+    ]
+)
+
+sampler = emcee.EnsembleSampler(
+    nwalkers=total_walkers,
+    ndim=model.prior_count,
+    log_prob_fn=analysis.log_posterior_batch,
+    vectorize=True,
+)
+
+sampler.run_mcmc(initial_state=initial_positions, nsteps=total_steps, progress=True)
+
+"""
+The maximum log posterior model of the chains can be converted back to a model instance via the model.
+"""
+log_posteriors = sampler.get_log_prob(flat=True)
+samples = sampler.get_chain(flat=True)
+
+max_log_posterior_instance = model.instance_from_vector(
+    vector=samples[np.argmax(log_posteriors)]
+)
+
+print(max_log_posterior_instance.galaxies.lens.mass.einstein_radius)
+
+"""
+__Dynesty__
+
+The batched path only applies to non-linear searches which evaluate a population of models in one call.
+`DynestyStatic` with `sample="rwalk"` cannot do this. Every new live point is found by a random walk, a Markov chain
+whose next step is proposed from the last accepted step, so the steps of one walk must be evaluated one at a time.
+Dynesty runs its `queue_size` walks in parallel by passing its random walk function (not the likelihood) to the
+`map` of a pool, so each walk calls the likelihood with one parameter vector. Batching the walks would mean stepping
+all of them in lockstep, which needs a reimplementation of Dynesty's `sample_rwalk`. The `DynestyStatic` search of
+**PyAutoFit** also creates this pool itself, so it has no way to pass in a batched one.
+
+Finish.
+"""
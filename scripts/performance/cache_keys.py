@@ -0,0 +1,56 @@
+"""
+Cache Keys
+==========
+
+The cache keys shared by the `performance` scripts which store quantities that depend only on the mass model of a
+`Tracer` (e.g. `fixed_mass_ray_tracing_cache.py`, `incremental_ray_tracing.py` and `critical_curve_engine.py`), or
+on the (y,x) coordinates of a grid (e.g. `convergence_map.py` and `input_deflections_interpolation.py`).
+
+The cache key of a profile is its class name and the values of its parameters, which are read from the attributes
+of the profile instance. The `id` every model component is given by **PyAutoFit** is unique to each instance (even
+when its parameters are identical) and is therefore not part of the key.
+"""
+import hashlib
+import numpy as np
+
+
+def profile_key_from(profile):
+    """
+    Returns a hashable key of a mass profile or pixelization, which changes if any of its parameters change.
+    """
+    return (type(profile).__name__,) + tuple(
+        (name, tuple(np.ravel(value)))
+        for name, value in sorted(profile.__dict__.items())
+        if name != "id" and value is not None
+    )
+
+
+def plane_key_from(plane):
+    """
+    Returns a hashable key of a plane, which pairs its redshift with the parameters of every mass profile of its
+    galaxies.
+    """
+    return (
+        plane.redshift,
+        tuple(
+            profile_key_from(profile=mass_profile)
+            for galaxy in plane.galaxies
+            for mass_profile in galaxy.mass_profiles
+        ),
+    )
+
+
+def mass_key_from(tracer):
+    """
+    Returns a hashable key of the mass model of a `Tracer`, which is the key of every one of its planes.
+    """
+    return tuple(plane_key_from(plane=plane) for plane in tracer.planes)
+
+
+def grid_key_from(grid):
+    """
+    Returns a hashable key of a grid, which is the same for any two grids with identical (y,x) coordinates.
+    """
+    array = np.ascontiguousarray(grid, dtype="float64")
+
+    return array.shape, hashlib.sha1(array.tobytes()).hexdigest()
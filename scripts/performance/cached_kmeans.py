@@ -0,0 +1,253 @@
+"""
+Performance: Cached KMeans
+==========================
+
+The `VoronoiBrightnessImage` pixelization places its pixel centres in the image-plane by running a weighted KMeans
+clustering on the (y,x) coordinates of the image pixels, where every pixel is weighted by the hyper galaxy image (see
+`howtolens/chapter_5_hyper_mode/tutorial_2_brightness_adaption.py`). **PyAutoLens** runs a full KMeans (Lloyd's
+algorithm, using every image pixel every iteration) every time a tracer with a `VoronoiBrightnessImage` is fitted.
+
+The clustering depends only on:
+
+ - The image-plane grid and hyper galaxy image, which are the same for every fit of a hyper phase.
+ - The `pixels`, `weight_floor` and `weight_power` of the pixelization.
+ - The KMeans seed of the `SettingsPixelization`.
+
+Every fit that repeats these inputs therefore computes the same pixel centres again. For example, the inversion
+phases of the hyper pipelines and `chapter_5_hyper_mode` fit the lens mass model with the pixelization parameters
+fixed, and visualization and the results of every phase refit the maximum likelihood model.
+
+This script shows a `VoronoiBrightnessImageCached` pixelization, which stores the image-plane pixel centres of every
+clustering keyed by a hash of the grid and hyper galaxy image, the pixelization's parameters and the seed, and reuses
+them whenever these inputs are repeated. The clustering of inputs which are not stored is the same full KMeans as the
+`VoronoiBrightnessImage`, so the pixel centres (and therefore the likelihood of every fit) are identical.
+
+A mini-batch KMeans, which updates the pixel centres using random batches of the image pixels, is faster but places
+the pixel centres far less accurately for the number of pixels (~1000) and iterations used by the hyper pipelines,
+lowering the log evidence of the fits by hundreds. It is therefore not used.
+
+If the `SettingsPixelization` is stochastic, the seed is random and the clustering is never reused.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import hashlib
+import time
+import numpy as np
+from collections import OrderedDict
+from os import path
+import autofit as af
+import autolens as al
+
+"""
+__Cache__
+
+The sparse grids are stored in the `sparse_grids` dictionary. A non-linear search which varies the `weight_floor` and
+`weight_power` creates a new key every fit, so only the most recent `max_sparse_grids` are stored.
+"""
+sparse_grids = OrderedDict()
+
+max_sparse_grids = 100
+
+
+def array_key_from(array):
+    """
+    Returns a hashable key of an array, which is the same for any two arrays with identical values.
+    """
+    array = np.ascontiguousarray(array, dtype="float64")
+
+    return array.shape, hashlib.sha1(array.tobytes()).hexdigest()
+
+
+"""
+__Pixelization__
+
+The `VoronoiBrightnessImageCached` is used in a `Galaxy` or `GalaxyModel` in place of the `VoronoiBrightnessImage`
+and has the same parameters.
+"""
+
+
+class VoronoiBrightnessImageCached(al.pix.VoronoiBrightnessImage):
+    def sparse_grid_from_grid(
+        self, grid, hyper_image, settings=al.SettingsPixelization()
+    ):
+
+        if settings.is_stochastic:
+            return super().sparse_grid_from_grid(
+                grid=grid, hyper_image=hyper_image, settings=settings
+            )
+
+        key = (
+            array_key_from(array=grid.slim_binned),
+            array_key_from(array=hyper_image),
+            self.pixels,
+            self.weight_floor,
+            self.weight_power,
+            settings.kmeans_seed,
+        )
+
+        if key in sparse_grids:
+            sparse_grids.move_to_end(key)
+            return sparse_grids[key]
+
+        sparse_grid = super().sparse_grid_from_grid(
+            grid=grid, hyper_image=hyper_image, settings=settings
+        )
+
+        sparse_grids[key] = sparse_grid
+
+        if len(sparse_grids) > max_sparse_grids:
+            sparse_grids.popitem(last=False)
+
+        return sparse_grid
+
+
+"""
+__Dataset__
+
+We use the `mass_sie__source_sersic` dataset.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+masked_imaging = al.MaskedImaging(imaging=imaging, mask=mask)
+
+"""
+__Hyper Image__
+
+As in `chapter_5_hyper_mode`, we fit the true lens model of the dataset with a `VoronoiMagnification` source and use
+its model image as the hyper galaxy image.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification(shape=(30, 30)),
+    regularization=al.reg.Constant(coefficient=3.3),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+
+hyper_image = fit.model_image.slim_binned
+
+"""
+__Comparison__
+
+We now fit the dataset with a `VoronoiBrightnessImage` and `VoronoiBrightnessImageCached` source, and compare their
+run times and log evidences. The first fit of the `VoronoiBrightnessImageCached` performs the clustering, which every
+subsequent fit reuses.
+
+Both pixelizations perform the same clustering, so their log evidences are identical.
+"""
+log_evidences = {}
+
+for name, pixelization_class in [
+    ("Standard", al.pix.VoronoiBrightnessImage),
+    ("Cached", VoronoiBrightnessImageCached),
+]:
+
+    source_galaxy = al.Galaxy(
+        redshift=1.0,
+        pixelization=pixelization_class(
+            pixels=1000, weight_floor=0.0, weight_power=10.0
+        ),
+        regularization=al.reg.Constant(coefficient=0.5),
+        hyper_model_image=hyper_image,
+        hyper_galaxy_image=hyper_image,
+    )
+
+    tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+    start = time.time()
+    fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+    fit.log_evidence
+    print(f"{name} first FitImaging time = {time.time() - start} s")
+
+    repeats = 5
+
+    start = time.time()
+    for _ in range(repeats):
+        fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+        fit.log_evidence
+    print(f"{name} FitImaging time = {(time.time() - start) / repeats} s")
+    print(f"{name} log evidence = {fit.log_evidence}")
+
+    log_evidences[name] = fit.log_evidence
+
+assert log_evidences["Cached"] == log_evidences["Standard"]
+
+"""
+__Phases__
+
+We now fit the dataset with two phases, as in the hyper pipelines. The first phase fits the lens mass with a
+`VoronoiMagnification` source, and its model image is the hyper galaxy image of the second phase. The second phase
+fits the lens mass with the `VoronoiBrightnessImageCached` source pixelization parameters fixed, in the same way as the
+inversion phases of the hyper pipelines, such that every fit reuses the same clustering.
+"""
+phase1 = al.PhaseImaging(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "cached_kmeans"),
+        name="phase_1__source_inversion_magnification",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal),
+        source=al.GalaxyModel(
+            redshift=1.0,
+            pixelization=al.pix.VoronoiMagnification,
+            regularization=al.reg.Constant,
+        ),
+    ),
+)
+
+phase1_result = phase1.run(dataset=imaging, mask=mask)
+
+results = af.ResultsCollection()
+results.add("phase_1__source_inversion_magnification", phase1_result)
+
+phase2 = al.PhaseImaging(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "cached_kmeans"),
+        name="phase_2__source_inversion_brightness",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=al.GalaxyModel(redshift=0.5, mass=phase1_result.model.galaxies.lens.mass),
+        source=al.GalaxyModel(
+            redshift=1.0,
+            pixelization=VoronoiBrightnessImageCached(
+                pixels=1000, weight_floor=0.0, weight_power=10.0
+            ),
+            regularization=al.reg.Constant,
+        ),
+    ),
+)
+
+phase2.run(dataset=imaging, mask=mask, results=results)
+
+"""
+Finish.
+"""
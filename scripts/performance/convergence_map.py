@@ -0,0 +1,329 @@
+"""
+Performance: Convergence Map
+============================
+
+**PyAutoLens**'s mass profiles are analytic, and the `InputDeflections` mass profile (see
+`misc/input_deflections_model.py`) requires the deflection angles of a mass distribution to have been computed
+already. There is therefore no way to ray-trace a pixelized mass distribution, for example the surface density of a
+galaxy or cluster cut out of an N-body simulation.
+
+The deflection angles and lensing potential of a convergence map are convolutions of the convergence with the
+kernels of a unit point mass:
+
+ alpha(theta) = (1 / pi) * int kappa(theta') (theta - theta') / |theta - theta'|^2 d^2 theta'
+
+ psi(theta) = (1 / pi) * int kappa(theta') ln |theta - theta'| d^2 theta'
+
+This script shows a `ConvergenceMap` mass profile, which computes these convolutions using zero-padded FFTs when it is
+created, giving the deflection angles and potential at the centre of every pixel of the map. The kernels are the
+exact deflection angles and potential of a uniform square pixel (as opposed to a point mass at the pixel centre),
+which removes the singularity of the kernels at the pixel itself.
+
+The deflection angles of any other grid are interpolated from these maps (using bicubic splines), and are stored for
+the most recent grids they are computed for, such that a model-fit which ray-traces the same grids every likelihood evaluation
+only interpolates them once. The `ConvergenceMap` can be used in a `Galaxy` and `Tracer` like any other mass profile.
+
+Zero padding means the mass outside the map is zero, therefore the map should extend beyond the region that is
+ray-traced by enough that the mass outside it is negligible.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from scipy import fft
+from scipy import interpolate
+import autolens as al
+import autolens.plot as aplt
+from autoarray.structures.grids import grid_decorators
+from autogalaxy import exc
+from cache_keys import grid_key_from
+
+"""
+__Kernels__
+
+The kernels are the integrals of the deflection angle and potential kernels over every pixel of a lattice of offsets
+between pixel centres, which have analytic solutions. For the x deflection angle:
+
+ int int x / (x^2 + y^2) dx dy = x * arctan(y / x) + (y / 2) * ln(x^2 + y^2)
+
+and for the potential:
+
+ int int ln(r) dx dy = x * y * ln(r) - 3 * x * y / 2 + (x^2 / 2) * arctan(y / x) + (y^2 / 2) * arctan(x / y)
+
+The integral over a pixel is the sum of these functions over its 4 corners (with alternating signs). The corners of
+every pixel lie at half-integer multiples of the pixel scale, so the functions are never evaluated at x = 0 or y = 0.
+
+The y deflection angle kernel is that of the x deflection angle with y and x swapped.
+"""
+
+
+def deflection_integral_from(x, y):
+    return x * np.arctan(y / x) + 0.5 * y * np.log(x ** 2 + y ** 2)
+
+
+def potential_integral_from(x, y):
+    return (
+        0.5 * x * y * np.log(x ** 2 + y ** 2)
+        - 1.5 * x * y
+        + 0.5 * x ** 2 * np.arctan(y / x)
+        + 0.5 * y ** 2 * np.arctan(x / y)
+    )
+
+
+def pixel_integrals_from(integral_func, shape_native, pixel_scales):
+    """
+    Returns the integral of a function over every pixel of a lattice of offsets with shape
+    [2 * shape_native[0] - 1, 2 * shape_native[1] - 1], whose central pixel is at zero offset.
+
+    The rows of the lattice run from positive to negative y, in the same way as an `Array2D`.
+    """
+    corners_y = pixel_scales[0] * (np.arange(2 * shape_native[0]) - shape_native[0] + 0.5)
+    corners_x = pixel_scales[1] * (np.arange(2 * shape_native[1]) - shape_native[1] + 0.5)
+
+    integrals = integral_func(corners_x[None, :], corners_y[:, None])
+
+    pixel_integrals = (
+        integrals[1:, 1:]
+        - integrals[:-1, 1:]
+        - integrals[1:, :-1]
+        + integrals[:-1, :-1]
+    )
+
+    return pixel_integrals[::-1, :]
+
+
+def convolved_from(array, kernel):
+    """
+    Returns the convolution of an array of shape [total_y_pixels, total_x_pixels] with a kernel of shape
+    [2 * total_y_pixels - 1, 2 * total_x_pixels - 1] at every pixel of the array, using FFTs which are zero-padded
+    such that the convolution is not periodic.
+    """
+    fft_shape = tuple(
+        fft.next_fast_len(array_size + kernel_size - 1, real=True)
+        for array_size, kernel_size in zip(array.shape, kernel.shape)
+    )
+
+    convolved = fft.irfft2(
+        fft.rfft2(array, s=fft_shape) * fft.rfft2(kernel, s=fft_shape), s=fft_shape
+    )
+
+    return convolved[
+        array.shape[0] - 1 : 2 * array.shape[0] - 1,
+        array.shape[1] - 1 : 2 * array.shape[1] - 1,
+    ]
+
+
+"""
+__Mass Profile__
+
+The `ConvergenceMap` is created from an `Array2D` of the convergence, whose `pixel_scales` and `origin` give the
+(y,x) coordinates of every pixel. The deflection angle and potential maps are stored as `RectBivariateSpline`'s,
+which interpolate them to any (y,x) coordinates within the map.
+
+Coordinates outside the map raise an exception, in the same way as the `InputDeflections`.
+"""
+
+
+class ConvergenceMap(al.mp.MassProfile):
+    def __init__(self, convergence):
+        """
+        A mass profile whose convergence is a pixelized map, whose deflection angles and potential are computed using
+        FFTs.
+
+        Parameters
+        ----------
+        convergence : al.Array2D
+            The convergence map, which is zero outside its extent.
+        """
+        super().__init__()
+
+        self.convergence = convergence
+
+        pixel_scales = convergence.pixel_scales
+        convergence_native = np.asarray(convergence.native)
+        shape_native = convergence_native.shape
+
+        self.centre = convergence.origin
+
+        self.ys = convergence.origin[0] + pixel_scales[0] * (
+            0.5 * (shape_native[0] - 1) - np.arange(shape_native[0])
+        )
+        self.xs = convergence.origin[1] + pixel_scales[1] * (
+            np.arange(shape_native[1]) - 0.5 * (shape_native[1] - 1)
+        )
+
+        deflections_x_kernel = pixel_integrals_from(
+            integral_func=deflection_integral_from,
+            shape_native=shape_native,
+            pixel_scales=pixel_scales,
+        )
+        deflections_y_kernel = pixel_integrals_from(
+            integral_func=lambda x, y: deflection_integral_from(x=y, y=x),
+            shape_native=shape_native,
+            pixel_scales=pixel_scales,
+        )
+        potential_kernel = pixel_integrals_from(
+            integral_func=potential_integral_from,
+            shape_native=shape_native,
+            pixel_scales=pixel_scales,
+        )
+
+        maps = {
+            "deflections_y": convolved_from(
+                array=convergence_native, kernel=deflections_y_kernel / np.pi
+            ),
+            "deflections_x": convolved_from(
+                array=convergence_native, kernel=deflections_x_kernel / np.pi
+            ),
+            "potential": convolved_from(
+                array=convergence_native, kernel=potential_kernel / np.pi
+            ),
+            "convergence": convergence_native,
+        }
+
+        """
+        `RectBivariateSpline` requires increasing coordinates, so the rows of every map are reversed.
+        """
+        self.interpolators = {
+            name: interpolate.RectBivariateSpline(
+                self.ys[::-1], self.xs, values[::-1, :]
+            )
+            for name, values in maps.items()
+        }
+
+        self.interpolated = {}
+        self.total_cached_interpolations = 10
+
+    def values_from(self, name, grid):
+        """
+        Returns a map interpolated to every (y,x) coordinate of a grid, which are stored for the most recent 10
+        grids and maps.
+        """
+        key = (name, grid_key_from(grid=grid))
+
+        if key in self.interpolated:
+            return self.interpolated[key]
+
+        grid = np.asarray(grid)
+
+        if (
+            np.any(grid[:, 0] < self.ys[-1])
+            or np.any(grid[:, 0] > self.ys[0])
+            or np.any(grid[:, 1] < self.xs[0])
+            or np.any(grid[:, 1] > self.xs[-1])
+        ):
+            raise exc.ProfileException(
+                "The grid input into the ConvergenceMap has (y,x) coordinates extending beyond the convergence map. "
+                ""
+                "Update the convergence map to cover larger radii or reduce the input grid."
+            )
+
+        values = self.interpolators[name].ev(grid[:, 0], grid[:, 1])
+
+        if len(self.interpolated) >= self.total_cached_interpolations:
+            del self.interpolated[next(iter(self.interpolated))]
+
+        self.interpolated[key] = values
+
+        return values
+
+    @grid_decorators.grid_like_to_structure
+    def convergence_from_grid(self, grid):
+        return self.values_from(name="convergence", grid=grid)
+
+    @grid_decorators.grid_like_to_structure
+    def potential_from_grid(self, grid):
+        return self.values_from(name="potential", grid=grid)
+
+    @grid_decorators.grid_like_to_structure
+    def deflections_from_grid(self, grid):
+        return np.stack(
+            (
+                self.values_from(name="deflections_y", grid=grid),
+                self.values_from(name="deflections_x", grid=grid),
+            ),
+            axis=-1,
+        )
+
+
+"""
+__Convergence Map__
+
+To test the `ConvergenceMap` we create the convergence map of an `EllipticalIsothermal` and `SphericalNFW`, on a
+grid of 800 x 800 pixels with a `pixel_scale` of 0.05", which extends well beyond the 6" x 6" region we ray-trace
+below. In practise, the convergence map would be loaded from a .fits file, for example:
+
+ convergence = al.Array2D.from_fits(file_path="convergence.fits", pixel_scales=0.05)
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+    dark=al.mp.SphericalNFW(centre=(0.0, 0.0), kappa_s=0.05, scale_radius=5.0),
+)
+
+convergence_grid = al.Grid2D.uniform(shape_native=(800, 800), pixel_scales=0.05)
+
+convergence = lens_galaxy.convergence_from_grid(grid=convergence_grid)
+
+start = time.time()
+convergence_map = ConvergenceMap(convergence=convergence)
+print(f"ConvergenceMap creation time = {time.time() - start} s")
+
+"""
+Lets compare the deflection angles of the `ConvergenceMap` to those of the lens galaxy. These are not identical,
+because the mass of the lens galaxy outside the map is not included (the `EllipticalIsothermal` has infinite mass),
+and because the convergence of every pixel is its value at the pixel centre.
+"""
+grid = al.Grid2D.uniform(shape_native=(120, 120), pixel_scales=0.05, sub_size=2)
+
+start = time.time()
+deflections_map = convergence_map.deflections_from_grid(grid=grid)
+print(f"ConvergenceMap first deflections time = {time.time() - start} s")
+
+start = time.time()
+deflections_map = convergence_map.deflections_from_grid(grid=grid)
+print(f"ConvergenceMap stored deflections time = {time.time() - start} s")
+
+start = time.time()
+deflections = lens_galaxy.deflections_from_grid(grid=grid)
+print(f"Galaxy deflections time = {time.time() - start} s")
+
+print(
+    "Maximum difference between deflection angles = ",
+    np.max(np.abs(np.asarray(deflections_map) - np.asarray(deflections))),
+)
+
+"""
+__Ray Tracing__
+
+The `ConvergenceMap` is used in a `Galaxy` and `Tracer` like any other mass profile.
+"""
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.EllipticalSersic(
+        centre=(0.0, 0.0),
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=60.0),
+        intensity=0.3,
+        effective_radius=0.3,
+        sersic_index=2.5,
+    ),
+)
+
+tracer = al.Tracer.from_galaxies(
+    galaxies=[al.Galaxy(redshift=0.5, mass=convergence_map), source_galaxy]
+)
+
+tracer_plotter = aplt.TracerPlotter(tracer=tracer, grid=grid)
+tracer_plotter.subplot_tracer()
+
+"""
+Finish.
+"""
@@ -0,0 +1,616 @@
+"""
+Performance: Cosmology Distance Cache
+=====================================
+
+The functions of `al.util.cosmology` (e.g. `angular_diameter_distance_to_earth_in_kpc_from`,
+`critical_surface_density_between_redshifts_from` and `kpc_per_arcsec_from`) call **astropy**'s cosmology methods
+every time they are used, which numerically integrate the Hubble parameter for every distance. They are called:
+
+ - By the `Tracer`, to compute the scaling factor of the deflection angles between every pair of planes, every time
+   it traces a grid.
+
+ - By the `*MCRLudlow` and `*MCRDuffy` mass profiles, to convert their `mass_at_200` to the parameters of the NFW
+   profile, every time a profile is created.
+
+When the redshifts are fixed these calculations repeat the same integrals in every likelihood evaluation. When a
+redshift is a free parameter (for example the subhalo redshift in the multi-plane phase of the SLaM subhalo
+pipeline) every integral is new, and the **astropy** calls sit in the hot path of the model-fit.
+
+This script shows a `DistanceCache`, which replaces the functions of `al.util.cosmology` for the whole process with
+functions which:
+
+ - Store every distance and density they compute, keyed by the cosmology and redshift(s), such that it is
+   computed by **astropy** only once.
+
+ - Optionally, compute distances by cubic interpolation of a table of the comoving distance (and critical density)
+   of every cosmology, which is computed by **astropy** once over a range of redshifts. This is used for continuous
+   redshift parameters, where stored distances are rarely reused.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import math
+import time
+import numpy as np
+from collections import OrderedDict
+from astropy import constants
+from astropy import cosmology as cosmo
+from scipy import interpolate
+import autolens as al
+from autogalaxy.profiles.mass_profiles import dark_mass_profiles
+from autogalaxy.util import cosmology_util
+
+"""
+__Cosmology Keys__
+
+Distances are stored for every cosmology separately. The key of a cosmology is its `repr`, which includes its name
+and the values of all its parameters, so two instances of the same cosmology share their distances. **astropy**
+cosmologies are immutable, so the key of an instance is computed once and stored using its `id` (alongside the
+instance, so an `id` reused by Python is never paired with the wrong key).
+"""
+cosmology_keys = {}
+
+
+def cosmology_key_from(cosmology):
+    """
+    Returns a hashable key of an **astropy** cosmology, which is the same for any two instances with identical
+    parameters.
+    """
+    entry = cosmology_keys.get(id(cosmology))
+
+    if entry is not None and entry[0] is cosmology:
+        return entry[1]
+
+    key = repr(cosmology)
+
+    cosmology_keys[id(cosmology)] = (cosmology, key)
+
+    return key
+
+
+"""
+__Tables__
+
+A `CosmologyTable` interpolates the line-of-sight comoving distance D_C(z) and the logarithm of the critical density
+of a cosmology, which are computed by **astropy** at every redshift of a uniform grid. Every distance used by
+**PyAutoLens** follows from the comoving distance:
+
+ - The transverse comoving distance D_M between two redshifts is the difference of their comoving distances,
+   corrected for the curvature of the cosmology (this is the calculation **astropy** performs).
+
+ - The angular diameter distance between two redshifts is D_M / (1 + z_1), and to a redshift is the same with
+   z_0 = 0.
+
+The comoving distance is smooth in redshift, and for the default 2001 redshifts between 0 and 5 the interpolated
+distances have a fractional error below 1e-8.
+"""
+
+
+class CosmologyTable:
+    def __init__(self, cosmology, redshift_max=5.0, total_redshifts=2001):
+        """
+        Tables of the comoving distance (in kpc) and critical density (in solMass / kpc^3) of a cosmology, which are
+        interpolated to compute distances between any redshifts in the range 0 -> `redshift_max`.
+        """
+        self.redshift_max = redshift_max
+
+        redshifts = np.linspace(0.0, redshift_max, total_redshifts)
+
+        self.comoving_distance_interp = interpolate.CubicSpline(
+            redshifts, cosmology.comoving_distance(redshifts).to("kpc").value
+        )
+        self.log_critical_density_interp = interpolate.CubicSpline(
+            redshifts,
+            np.log(cosmology.critical_density(redshifts).to("solMass / kpc^3").value),
+        )
+
+        self.hubble_distance = cosmology.hubble_distance.to("kpc").value
+        self.curvature = cosmology.Ok0
+
+    def contains(self, *redshifts):
+        return all(0.0 <= redshift <= self.redshift_max for redshift in redshifts)
+
+    def transverse_comoving_distance_from(self, comoving_distance):
+
+        if self.curvature == 0.0:
+            return comoving_distance
+
+        sqrt_curvature = math.sqrt(abs(self.curvature))
+        x = sqrt_curvature * comoving_distance / self.hubble_distance
+
+        if self.curvature > 0.0:
+            return self.hubble_distance * math.sinh(x) / sqrt_curvature
+        return self.hubble_distance * math.sin(x) / sqrt_curvature
+
+    def angular_diameter_distance_between_redshifts_from(self, redshift_0, redshift_1):
+
+        comoving_distance = float(self.comoving_distance_interp(redshift_1)) - float(
+            self.comoving_distance_interp(redshift_0)
+        )
+
+        return self.transverse_comoving_distance_from(
+            comoving_distance=comoving_distance
+        ) / (1.0 + redshift_1)
+
+    def critical_density_from(self, redshift):
+        return math.exp(float(self.log_critical_density_interp(redshift)))
+
+
+"""
+__Distance Cache__
+
+The `DistanceCache` provides the functions of `al.util.cosmology`, with the same names and inputs, computed from
+three quantities:
+
+ - The angular diameter distance between two redshifts (which, with redshift_0 = 0, is the distance to Earth).
+ - The critical density of the Universe at a redshift.
+ - The `concentration` of a halo, for the `*MCRLudlow` mass profiles.
+
+If `tabulate=True`, the distances and densities of any redshifts within the table of the cosmology are interpolated,
+otherwise (or if a redshift is outside the table) they are computed by **astropy** and stored.
+
+The concentration of the `*MCRLudlow` profiles is computed by **colossus** and is always stored, as it depends on the
+`mass_at_200` (which is almost always a free parameter when the redshift is) it is only reused for fixed halos.
+
+Calling `enable` replaces the functions of `al.util.cosmology`, and the mass-concentration conversions of the
+`*MCRLudlow` and `*MCRDuffy` profiles, for the whole process (including the processes of a parallel non-linear
+search, which are created after it is called). Calling `disable` restores them.
+"""
+
+critical_surface_density_constant = (
+    constants.c.to("kpc / s") ** 2.0
+    / (4 * math.pi * constants.G.to("kpc3 / (solMass s2)"))
+).value
+
+arcsec_per_radian = 180.0 * 3600.0 / math.pi
+
+cosmology_util_function_names = [
+    "arcsec_per_kpc_from",
+    "kpc_per_arcsec_from",
+    "angular_diameter_distance_to_earth_in_kpc_from",
+    "angular_diameter_distance_between_redshifts_in_kpc_from",
+    "cosmic_average_density_from",
+    "cosmic_average_density_solar_mass_per_kpc3_from",
+    "critical_surface_density_between_redshifts_from",
+    "critical_surface_density_between_redshifts_solar_mass_per_kpc2_from",
+    "scaling_factor_between_redshifts_from",
+]
+
+dark_mass_profiles_function_names = [
+    "kappa_s_and_scale_radius_for_duffy",
+    "kappa_s_and_scale_radius_for_ludlow",
+]
+
+
+class DistanceCache:
+    def __init__(
+        self,
+        tabulate=False,
+        redshift_max=5.0,
+        total_redshifts=2001,
+        max_concentrations=10000,
+    ):
+        """
+        Stores every cosmological distance, density and halo concentration computed by **PyAutoLens**, and optionally
+        interpolates distances and densities from a table of every cosmology.
+
+        Parameters
+        ----------
+        tabulate : bool
+            If `True`, distances and densities are interpolated from a `CosmologyTable`.
+        redshift_max : float
+            The highest redshift of the table of every cosmology.
+        total_redshifts : int
+            The number of redshifts of the table of every cosmology.
+        max_concentrations : int
+            The maximum number of halo concentrations stored, after which the least recently used is removed.
+        """
+        self.tabulate = tabulate
+        self.redshift_max = redshift_max
+        self.total_redshifts = total_redshifts
+        self.max_concentrations = max_concentrations
+
+        self.distances = {}
+        self.critical_densities = {}
+        self.concentrations = OrderedDict()
+        self.tables = {}
+
+        self.originals = None
+
+    def table_from(self, cosmology):
+
+        key = cosmology_key_from(cosmology=cosmology)
+
+        if key not in self.tables:
+            self.tables[key] = CosmologyTable(
+                cosmology=cosmology,
+                redshift_max=self.redshift_max,
+                total_redshifts=self.total_redshifts,
+            )
+
+        return self.tables[key]
+
+    def angular_diameter_distance_between_redshifts_in_kpc_from(
+        self, redshift_0, redshift_1, cosmology=cosmo.Planck15
+    ):
+
+        if self.tabulate:
+            table = self.table_from(cosmology=cosmology)
+            if table.contains(redshift_0, redshift_1):
+                return table.angular_diameter_distance_between_redshifts_from(
+                    redshift_0=redshift_0, redshift_1=redshift_1
+                )
+
+        key = (cosmology_key_from(cosmology=cosmology), redshift_0, redshift_1)
+
+        if key not in self.distances:
+            self.distances[key] = (
+                cosmology.angular_diameter_distance_z1z2(redshift_0, redshift_1)
+                .to("kpc")
+                .value
+            )
+
+        return self.distances[key]
+
+    def angular_diameter_distance_to_earth_in_kpc_from(
+        self, redshift, cosmology=cosmo.Planck15
+    ):
+        return self.angular_diameter_distance_between_redshifts_in_kpc_from(
+            redshift_0=0.0, redshift_1=redshift, cosmology=cosmology
+        )
+
+    def kpc_per_arcsec_from(self, redshift, cosmology=cosmo.Planck15):
+        return (
+            self.angular_diameter_distance_to_earth_in_kpc_from(
+                redshift=redshift, cosmology=cosmology
+            )
+            / arcsec_per_radian
+        )
+
+    def arcsec_per_kpc_from(self, redshift, cosmology=cosmo.Planck15):
+        return 1.0 / self.kpc_per_arcsec_from(redshift=redshift, cosmology=cosmology)
+
+    def cosmic_average_density_solar_mass_per_kpc3_from(
+        self, redshift, cosmology=cosmo.Planck15
+    ):
+
+        if self.tabulate:
+            table = self.table_from(cosmology=cosmology)
+            if table.contains(redshift):
+                return table.critical_density_from(redshift=redshift)
+
+        key = (cosmology_key_from(cosmology=cosmology), redshift)
+
+        if key not in self.critical_densities:
+            self.critical_densities[key] = (
+                cosmology.critical_density(z=redshift).to("solMass / kpc^3").value
+            )
+
+        return self.critical_densities[key]
+
+    def cosmic_average_density_from(self, redshift, cosmology=cosmo.Planck15):
+
+        cosmic_average_density_kpc = self.cosmic_average_density_solar_mass_per_kpc3_from(
+            redshift=redshift, cosmology=cosmology
+        )
+
+        kpc_per_arcsec = self.kpc_per_arcsec_from(redshift=redshift, cosmology=cosmology)
+
+        return cosmic_average_density_kpc * kpc_per_arcsec ** 3.0
+
+    def critical_surface_density_between_redshifts_solar_mass_per_kpc2_from(
+        self, redshift_0, redshift_1, cosmology=cosmo.Planck15
+    ):
+
+        angular_diameter_distance_of_redshift_0_to_earth_kpc = self.angular_diameter_distance_to_earth_in_kpc_from(
+            redshift=redshift_0, cosmology=cosmology
+        )
+
+        angular_diameter_distance_of_redshift_1_to_earth_kpc = self.angular_diameter_distance_to_earth_in_kpc_from(
+            redshift=redshift_1, cosmology=cosmology
+        )
+
+        angular_diameter_distance_between_redshifts_kpc = self.angular_diameter_distance_between_redshifts_in_kpc_from(
+            redshift_0=redshift_0, redshift_1=redshift_1, cosmology=cosmology
+        )
+
+        return (
+            critical_surface_density_constant
+            * angular_diameter_distance_of_redshift_1_to_earth_kpc
+            / (
+                angular_diameter_distance_between_redshifts_kpc
+                * angular_diameter_distance_of_redshift_0_to_earth_kpc
+            )
+        )
+
+    def critical_surface_density_between_redshifts_from(
+        self, redshift_0, redshift_1, cosmology=cosmo.Planck15
+    ):
+
+        critical_surface_density_kpc = self.critical_surface_density_between_redshifts_solar_mass_per_kpc2_from(
+            redshift_0=redshift_0, redshift_1=redshift_1, cosmology=cosmology
+        )
+
+        kpc_per_arcsec = self.kpc_per_arcsec_from(
+            redshift=redshift_0, cosmology=cosmology
+        )
+
+        return critical_surface_density_kpc * kpc_per_arcsec ** 2.0
+
+    def scaling_factor_between_redshifts_from(
+        self, redshift_0, redshift_1, redshift_final, cosmology=cosmo.Planck15
+    ):
+
+        angular_diameter_distance_between_redshifts_0_and_1 = self.angular_diameter_distance_between_redshifts_in_kpc_from(
+            redshift_0=redshift_0, redshift_1=redshift_1, cosmology=cosmology
+        )
+
+        angular_diameter_distance_to_redshift_final = self.angular_diameter_distance_to_earth_in_kpc_from(
+            redshift=redshift_final, cosmology=cosmology
+        )
+
+        angular_diameter_distance_of_redshift_1_to_earth = self.angular_diameter_distance_to_earth_in_kpc_from(
+            redshift=redshift_1, cosmology=cosmology
+        )
+
+        angular_diameter_distance_between_redshift_0_and_final = self.angular_diameter_distance_between_redshifts_in_kpc_from(
+            redshift_0=redshift_0, redshift_1=redshift_final, cosmology=cosmology
+        )
+
+        return (
+            angular_diameter_distance_between_redshifts_0_and_1
+            * angular_diameter_distance_to_redshift_final
+        ) / (
+            angular_diameter_distance_of_redshift_1_to_earth
+            * angular_diameter_distance_between_redshift_0_and_final
+        )
+
+    def concentration_ludlow_from(self, mass_at_200, redshift_object):
+        """
+        Returns the concentration of a halo using the Ludlow et al. (2016) mass-concentration relation, computed by
+        **colossus** in the same way as `kappa_s_and_scale_radius_for_ludlow`.
+        """
+        key = (mass_at_200, redshift_object)
+
+        if key in self.concentrations:
+            self.concentrations.move_to_end(key)
+            return self.concentrations[key]
+
+        col_cosmo = dark_mass_profiles.col_cosmology.setCosmology("planck15")
+
+        self.concentrations[key] = dark_mass_profiles.col_concentration(
+            mass_at_200 * col_cosmo.h, "200c", redshift_object, model="ludlow16"
+        )
+
+        if len(self.concentrations) > self.max_concentrations:
+            self.concentrations.popitem(last=False)
+
+        return self.concentrations[key]
+
+    def kappa_s_and_scale_radius_from(
+        self, mass_at_200, concentration, redshift_object, redshift_source
+    ):
+        """
+        Converts the `mass_at_200` and concentration of a halo to the `kappa_s` and `scale_radius` of its NFW profile,
+        using the Planck15 cosmology (as done by the `*MCRLudlow` and `*MCRDuffy` mass profiles).
+        """
+        cosmology = cosmo.Planck15
+
+        cosmic_average_density = self.cosmic_average_density_solar_mass_per_kpc3_from(
+            redshift=redshift_object, cosmology=cosmology
+        )
+
+        critical_surface_density = self.critical_surface_density_between_redshifts_solar_mass_per_kpc2_from(
+            redshift_0=redshift_object, redshift_1=redshift_source, cosmology=cosmology
+        )
+
+        kpc_per_arcsec = self.kpc_per_arcsec_from(
+            redshift=redshift_object, cosmology=cosmology
+        )
+
+        radius_at_200 = (
+            mass_at_200 / (200.0 * cosmic_average_density * (4.0 * np.pi / 3.0))
+        ) ** (1.0 / 3.0)
+
+        de_c = (
+            200.0
+            / 3.0
+            * (
+                concentration ** 3
+                / (np.log(1.0 + concentration) - concentration / (1.0 + concentration))
+            )
+        )
+
+        scale_radius_kpc = radius_at_200 / concentration
+        rho_s = cosmic_average_density * de_c
+        kappa_s = rho_s * scale_radius_kpc / critical_surface_density
+        scale_radius = scale_radius_kpc / kpc_per_arcsec
+
+        return kappa_s, scale_radius, radius_at_200
+
+    def kappa_s_and_scale_radius_for_ludlow(
+        self, mass_at_200, redshift_object, redshift_source
+    ):
+
+        concentration = self.concentration_ludlow_from(
+            mass_at_200=mass_at_200, redshift_object=redshift_object
+        )
+
+        return self.kappa_s_and_scale_radius_from(
+            mass_at_200=mass_at_200,
+            concentration=concentration,
+            redshift_object=redshift_object,
+            redshift_source=redshift_source,
+        )
+
+    def kappa_s_and_scale_radius_for_duffy(
+        self, mass_at_200, redshift_object, redshift_source
+    ):
+        """
+        The Duffy et al. (2008) mass-concentration relation uses the `radius_at_200` (in kpc) of the halo.
+        """
+        coefficient = 5.71 * (1.0 + redshift_object) ** (-0.47)
+        concentration = coefficient * (mass_at_200 / 2.952465309e12) ** (-0.084)
+
+        return self.kappa_s_and_scale_radius_from(
+            mass_at_200=mass_at_200,
+            concentration=concentration,
+            redshift_object=redshift_object,
+            redshift_source=redshift_source,
+        )
+
+    def enable(self):
+        """
+        Replace the functions of `al.util.cosmology` and the mass-concentration conversions of the dark mass profiles
+        with those of this cache, for the whole process.
+        """
+        if self.originals is not None:
+            return
+
+        self.originals = []
+
+        for module, names in (
+            (cosmology_util, cosmology_util_function_names),
+            (dark_mass_profiles, dark_mass_profiles_function_names),
+        ):
+            for name in names:
+                self.originals.append((module, name, getattr(module, name)))
+                setattr(module, name, getattr(self, name))
+
+    def disable(self):
+        """
+        Restore the functions replaced by `enable`.
+        """
+        if self.originals is None:
+            return
+
+        for module, name, original in self.originals:
+            setattr(module, name, original)
+
+        self.originals = None
+
+
+"""
+__Accuracy__
+
+Lets check the cached and tabulated distances are identical to those computed by **astropy**, for random redshifts
+of a subhalo between the lens and source galaxy.
+"""
+cosmology = cosmo.Planck15
+
+distance_cache = DistanceCache()
+distance_cache_tabulated = DistanceCache(tabulate=True)
+
+redshifts = np.random.uniform(low=0.5, high=1.0, size=100)
+
+for name in [
+    "critical_surface_density_between_redshifts_from",
+    "scaling_factor_between_redshifts_from",
+]:
+
+    kwargs_list = [
+        {"redshift_0": 0.5, "redshift_1": redshift, "cosmology": cosmology}
+        for redshift in redshifts
+    ]
+
+    if name == "scaling_factor_between_redshifts_from":
+        for kwargs in kwargs_list:
+            kwargs["redshift_final"] = 1.0
+
+    values = np.array(
+        [getattr(cosmology_util, name)(**kwargs) for kwargs in kwargs_list]
+    )
+    values_cached = np.array(
+        [getattr(distance_cache, name)(**kwargs) for kwargs in kwargs_list]
+    )
+    values_tabulated = np.array(
+        [getattr(distance_cache_tabulated, name)(**kwargs) for kwargs in kwargs_list]
+    )
+
+    print(name)
+    print(
+        "Maximum fractional error (cached) = ",
+        np.max(np.abs(values_cached - values) / np.abs(values)),
+    )
+    print(
+        "Maximum fractional error (tabulated) = ",
+        np.max(np.abs(values_tabulated - values) / np.abs(values)),
+    )
+
+"""
+__Run Time__
+
+We now compare how long it takes to create a `SphericalNFWMCRLudlow` subhalo and trace a grid through a three plane
+`Tracer` for random subhalo redshifts, which is what every likelihood evaluation of the multi-plane subhalo phase
+does.
+"""
+grid = al.Grid2D.uniform(shape_native=(100, 100), pixel_scales=0.05)
+
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(redshift=1.0, bulge=al.lp.EllipticalSersic())
+
+
+def traced_grids_for_redshift(redshift):
+
+    subhalo = al.Galaxy(
+        redshift=redshift,
+        mass=al.mp.SphericalNFWMCRLudlow(
+            centre=(1.6, 0.0),
+            mass_at_200=1.0e9,
+            redshift_object=redshift,
+            redshift_source=1.0,
+        ),
+    )
+
+    tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, subhalo, source_galaxy])
+
+    return tracer.traced_grids_of_planes_from_grid(grid=grid)
+
+
+redshifts = np.random.uniform(low=0.5, high=1.0, size=10)
+
+start = time.time()
+traced_grids = [traced_grids_for_redshift(redshift=redshift) for redshift in redshifts]
+print(f"Standard time = {(time.time() - start) / len(redshifts)} s")
+
+for cache in [distance_cache, distance_cache_tabulated]:
+
+    cache.enable()
+
+    start = time.time()
+    traced_grids_cache = [
+        traced_grids_for_redshift(redshift=redshift) for redshift in redshifts
+    ]
+    print(
+        f"Distance cache (tabulate={cache.tabulate}) time = {(time.time() - start) / len(redshifts)} s"
+    )
+    print(
+        "Maximum difference between traced source-plane grids = ",
+        max(
+            np.max(np.abs(grids_cache[-1] - grids[-1]))
+            for grids_cache, grids in zip(traced_grids_cache, traced_grids)
+        ),
+    )
+
+    cache.disable()
+
+"""
+To use a `DistanceCache` in a model-fit, create it and call `enable` at the beginning of the script (before the
+phases or pipelines are run), for example in the SLaM subhalo runners:
+
+    distance_cache = DistanceCache(tabulate=True)
+    distance_cache.enable()
+
+Finish.
+"""
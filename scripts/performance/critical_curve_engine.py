@@ -0,0 +1,623 @@
+"""
+Performance: Critical Curve Engine
+==================================
+
+When the `critical_curves` and `caustics` of `config/visualize/include.ini` are on, every figure of the image-plane
+and source-plane plots them, and they are computed at every visualization update of a phase (every
+`iterations_per_update`). By default, a `Tracer` computes its critical curves by:
+
+ 1) Computing its deflection angles on a uniform grid with a `pixel_scale` of 0.05" covering the mask.
+ 2) Computing the Jacobian of the lens mapping by differentiating these deflection angles, and its tangential and
+    radial eigen values.
+ 3) Contouring each eigen value map at zero using marching squares.
+
+The tangential and radial critical curves are computed separately, and the caustics recompute the critical curves,
+so the deflection angles of the full grid are computed four times every time the critical curves and caustics
+are plotted. Furthermore, almost all of these deflection angles are far from any critical curve.
+
+This script shows a `CriticalCurveEngine`, which:
+
+ - Computes the eigen values on a coarse grid (4 times the `pixel_scale` by default) and refines the grid to the
+   `pixel_scale` only in the coarse cells where an eigen value changes sign (and their neighbours), such that
+   the deflection angles are only computed at full resolution near the critical curves.
+
+ - Computes the tangential and radial critical curves and caustics together, and stores them using a key made from
+   the mass model of the `Tracer`, such that a visualization update whose maximum likelihood model has not changed
+   reuses them.
+
+ - Has a `preview` mode, which contours the coarse grid without refinement, for the visualization performed during
+   a model-fit. The critical curves of the final visualization of a phase are computed at full resolution.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from skimage import measure
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from cache_keys import mass_key_from
+
+"""
+__Cache Keys__
+
+The critical curves of a `Tracer` depend only on its mass model, so the key of a set of critical curves is the key
+of its mass model (computed by the `mass_key_from` function of the `cache_keys.py` module, in the same way as the
+`performance/fixed_mass_ray_tracing_cache.py` script), the area of the grid they are computed on and the resolution
+they are computed at.
+"""
+
+
+"""
+__Eigen Values__
+
+The eigen values are computed on a lattice of (y,x) nodes from the deflection angles of the nodes, using central
+differences (which is what the `np.gradient` used by **PyAutoLens** computes for every pixel not on the edge of the
+grid). The lattice therefore includes a border of one node on every side, whose eigen values are not computed.
+
+Nodes whose deflection angles are not computed are NaN, and so are the eigen values of their neighbours.
+"""
+
+
+def eigen_values_from(deflections, pixel_scale):
+    """
+    Returns the tangential and radial eigen values of the Jacobian at every node of a lattice, excluding its border,
+    from the deflection angles of every node (an ndarray of shape [total_y_nodes, total_x_nodes, 2]).
+
+    The rows of the lattice run from positive to negative y, in the same way as a `Grid2D`.
+    """
+    deflections_dx = (deflections[1:-1, 2:] - deflections[1:-1, :-2]) / (
+        2.0 * pixel_scale
+    )
+    deflections_dy = (deflections[:-2, 1:-1] - deflections[2:, 1:-1]) / (
+        2.0 * pixel_scale
+    )
+
+    a11 = 1.0 - deflections_dx[:, :, 1]
+    a12 = -1.0 * deflections_dy[:, :, 1]
+    a21 = -1.0 * deflections_dx[:, :, 0]
+    a22 = 1.0 - deflections_dy[:, :, 0]
+
+    convergence = 1.0 - 0.5 * (a11 + a22)
+    shear = np.sqrt((0.5 * (a22 - a11)) ** 2 + (0.5 * (a12 + a21)) ** 2)
+
+    return 1.0 - convergence - shear, 1.0 - convergence + shear
+
+
+def linear_interpolation_matrix_from(total_coarse_nodes, refinement_factor):
+    """
+    Returns the matrix which linearly interpolates the values of the nodes of a 1D coarse lattice to the nodes of a
+    lattice `refinement_factor` times finer.
+    """
+    total_fine_nodes = (total_coarse_nodes - 1) * refinement_factor + 1
+
+    positions = np.arange(total_fine_nodes) / refinement_factor
+    lower = np.minimum(positions.astype("int"), total_coarse_nodes - 2)
+    weights = positions - lower
+
+    matrix = np.zeros((total_fine_nodes, total_coarse_nodes))
+    matrix[np.arange(total_fine_nodes), lower] = 1.0 - weights
+    matrix[np.arange(total_fine_nodes), lower + 1] = weights
+
+    return matrix
+
+
+def sign_change_cells_from(values):
+    """
+    Returns a bool ndarray which is `True` for every cell of a lattice whose 4 corner nodes do not all have the same
+    sign.
+    """
+    positive = values > 0.0
+
+    corners = [
+        positive[:-1, :-1],
+        positive[:-1, 1:],
+        positive[1:, :-1],
+        positive[1:, 1:],
+    ]
+
+    return np.any(corners, axis=0) & ~np.all(corners, axis=0)
+
+
+"""
+__Engine__
+
+The `CriticalCurveEngine` computes the critical curves and caustics of a `Tracer` over the same area as
+**PyAutoLens** (the zoomed extent of the grid's mask) and returns them in the same structures.
+
+Of the contours of every eigen value map, the longest is returned as the critical curve (**PyAutoLens** returns the
+first contour found by marching squares).
+"""
+
+
+class CriticalCurveEngine:
+    def __init__(
+        self,
+        pixel_scale=0.05,
+        refinement_factor=4,
+        preview=False,
+        total_cached_curves=10,
+    ):
+        """
+        Computes and stores the critical curves and caustics of `Tracer`'s.
+
+        Parameters
+        ----------
+        pixel_scale : float
+            The resolution of the grid the critical curves are computed on.
+        refinement_factor : int
+            The factor by which the coarse grid used to find the critical curves is lower resolution than the
+            `pixel_scale`.
+        preview : bool
+            If `True`, the critical curves are computed on the coarse grid without refinement.
+        total_cached_curves : int
+            The number of sets of critical curves which are stored, where the oldest are removed first.
+        """
+        self.pixel_scale = pixel_scale
+        self.refinement_factor = refinement_factor
+        self.preview = preview
+        self.total_cached_curves = total_cached_curves
+
+        self.curves = {}
+
+    def coarse_lattice_from(self, grid):
+        """
+        Returns the (y,x) coordinates of the top-left node of the coarse lattice covering the zoomed extent of a
+        grid's mask and its number of nodes, excluding the border used to compute the eigen values.
+        """
+        coarse_pixel_scale = self.pixel_scale * self.refinement_factor
+
+        zoom_shape_native = grid.mask.zoom_shape_native
+        origin = tuple(float(value) for value in grid.mask.zoom_offset_scaled)
+
+        shape = tuple(
+            int(np.ceil(zoom_shape_native[i] * grid.pixel_scale / coarse_pixel_scale))
+            + 1
+            for i in range(2)
+        )
+
+        top_left = (
+            origin[0] + 0.5 * (shape[0] - 1) * coarse_pixel_scale,
+            origin[1] - 0.5 * (shape[1] - 1) * coarse_pixel_scale,
+        )
+
+        return top_left, shape
+
+    def deflections_from(self, tracer, top_left, pixel_scale, nodes):
+        """
+        Returns the deflection angles of the nodes of a lattice (including its border) which are `True` in the bool
+        ndarray `nodes`, with all other nodes NaN.
+        """
+        indexes = np.argwhere(nodes)
+
+        grid = np.stack(
+            (
+                top_left[0] - (indexes[:, 0] - 1) * pixel_scale,
+                top_left[1] + (indexes[:, 1] - 1) * pixel_scale,
+            ),
+            axis=-1,
+        )
+
+        deflections = np.full(nodes.shape + (2,), np.nan)
+        deflections[nodes] = np.asarray(
+            tracer.deflections_from_grid(grid=al.Grid2DIrregular(grid=grid))
+        )
+
+        return deflections
+
+    def refined_eigen_values_from(self, tracer, top_left, coarse_eigen_values):
+        """
+        Returns the eigen values of the fine lattice, which are computed at the nodes of every coarse cell where an
+        eigen value changes sign (and its neighbouring cells) and linearly interpolated from the coarse lattice
+        everywhere else.
+        """
+        factor = self.refinement_factor
+
+        cells = np.zeros(coarse_eigen_values[0].shape, dtype="bool")[:-1, :-1]
+
+        for eigen_values in coarse_eigen_values:
+            cells |= sign_change_cells_from(values=eigen_values)
+
+        dilated_cells = cells.copy()
+        dilated_cells[1:, :] |= cells[:-1, :]
+        dilated_cells[:-1, :] |= cells[1:, :]
+        dilated_cells[:, 1:] |= dilated_cells[:, :-1].copy()
+        dilated_cells[:, :-1] |= dilated_cells[:, 1:].copy()
+
+        fine_shape = tuple(total * factor + 1 for total in cells.shape)
+
+        refined_nodes = np.zeros(fine_shape, dtype="bool")
+
+        for i, j in np.argwhere(dilated_cells):
+            refined_nodes[
+                i * factor : (i + 1) * factor + 1, j * factor : (j + 1) * factor + 1
+            ] = True
+
+        evaluated_nodes = np.zeros(
+            (fine_shape[0] + 2, fine_shape[1] + 2), dtype="bool"
+        )
+
+        for dy, dx in ((0, 1), (1, 0), (1, 1), (1, 2), (2, 1)):
+            evaluated_nodes[
+                dy : dy + fine_shape[0], dx : dx + fine_shape[1]
+            ] |= refined_nodes
+
+        deflections = self.deflections_from(
+            tracer=tracer,
+            top_left=top_left,
+            pixel_scale=self.pixel_scale,
+            nodes=evaluated_nodes,
+        )
+
+        fine_eigen_values = eigen_values_from(
+            deflections=deflections, pixel_scale=self.pixel_scale
+        )
+
+        interpolation_y = linear_interpolation_matrix_from(
+            total_coarse_nodes=coarse_eigen_values[0].shape[0],
+            refinement_factor=factor,
+        )
+        interpolation_x = linear_interpolation_matrix_from(
+            total_coarse_nodes=coarse_eigen_values[0].shape[1],
+            refinement_factor=factor,
+        )
+
+        refined_eigen_values = []
+
+        for eigen_values, fine_values in zip(coarse_eigen_values, fine_eigen_values):
+
+            values = interpolation_y @ eigen_values @ interpolation_x.T
+            values[refined_nodes] = fine_values[refined_nodes]
+
+            refined_eigen_values.append(values)
+
+        return refined_eigen_values
+
+    def critical_curve_from(self, eigen_values, top_left, pixel_scale):
+        """
+        Returns the longest zero contour of an eigen value map as a `Grid2DIrregular`, or an empty list if it has no
+        zero contours.
+        """
+        contours = measure.find_contours(eigen_values, 0)
+
+        if len(contours) == 0:
+            return []
+
+        contour = max(contours, key=len)
+
+        return al.Grid2DIrregular(
+            grid=np.stack(
+                (
+                    top_left[0] - contour[:, 0] * pixel_scale,
+                    top_left[1] + contour[:, 1] * pixel_scale,
+                ),
+                axis=-1,
+            )
+        )
+
+    def caustic_from(self, tracer, critical_curve):
+
+        if len(critical_curve) == 0:
+            return []
+
+        return critical_curve - tracer.deflections_from_grid(grid=critical_curve)
+
+    def curves_from(self, tracer, grid):
+        """
+        Returns a dictionary of the tangential and radial critical curves and caustics of a `Tracer`, computed over
+        the zoomed extent of a grid's mask.
+        """
+        top_left, shape = self.coarse_lattice_from(grid=grid)
+
+        key = (mass_key_from(tracer=tracer), top_left, shape, self.preview)
+
+        if key in self.curves:
+            return self.curves[key]
+
+        coarse_pixel_scale = self.pixel_scale * self.refinement_factor
+
+        deflections = self.deflections_from(
+            tracer=tracer,
+            top_left=top_left,
+            pixel_scale=coarse_pixel_scale,
+            nodes=np.ones((shape[0] + 2, shape[1] + 2), dtype="bool"),
+        )
+
+        eigen_values = eigen_values_from(
+            deflections=deflections, pixel_scale=coarse_pixel_scale
+        )
+
+        if self.preview:
+            pixel_scale = coarse_pixel_scale
+        else:
+            pixel_scale = self.pixel_scale
+            eigen_values = self.refined_eigen_values_from(
+                tracer=tracer, top_left=top_left, coarse_eigen_values=eigen_values
+            )
+
+        tangential_critical_curve, radial_critical_curve = [
+            self.critical_curve_from(
+                eigen_values=values, top_left=top_left, pixel_scale=pixel_scale
+            )
+            for values in eigen_values
+        ]
+
+        curves = {
+            "tangential_critical_curve": tangential_critical_curve,
+            "radial_critical_curve": radial_critical_curve,
+            "tangential_caustic": self.caustic_from(
+                tracer=tracer, critical_curve=tangential_critical_curve
+            ),
+            "radial_caustic": self.caustic_from(
+                tracer=tracer, critical_curve=radial_critical_curve
+            ),
+        }
+
+        if len(self.curves) >= self.total_cached_curves:
+            del self.curves[next(iter(self.curves))]
+
+        self.curves[key] = curves
+
+        return curves
+
+
+"""
+__Tracer__
+
+The `TracerCriticalCurves` extends the `Tracer`, overwriting the methods which compute its critical curves and
+caustics such that they use a `CriticalCurveEngine`. The `pixel_scale` inputs of these methods are not used, as the
+resolution is set by the engine.
+"""
+
+
+class TracerCriticalCurves(al.Tracer):
+    def __init__(self, planes, cosmology, critical_curve_engine):
+        """
+        A `Tracer` whose critical curves and caustics are computed by a `CriticalCurveEngine`.
+        """
+        super().__init__(planes=planes, cosmology=cosmology)
+
+        self.critical_curve_engine = critical_curve_engine
+
+    def tangential_critical_curve_from_grid(self, grid, pixel_scale=0.05):
+        return self.critical_curve_engine.curves_from(tracer=self, grid=grid)[
+            "tangential_critical_curve"
+        ]
+
+    def radial_critical_curve_from_grid(self, grid, pixel_scale=0.05):
+        return self.critical_curve_engine.curves_from(tracer=self, grid=grid)[
+            "radial_critical_curve"
+        ]
+
+    def tangential_caustic_from_grid(self, grid, pixel_scale=0.05):
+        return self.critical_curve_engine.curves_from(tracer=self, grid=grid)[
+            "tangential_caustic"
+        ]
+
+    def radial_caustic_from_grid(self, grid, pixel_scale=0.05):
+        return self.critical_curve_engine.curves_from(tracer=self, grid=grid)[
+            "radial_caustic"
+        ]
+
+    def critical_curves_from_grid(self, grid, pixel_scale=0.05):
+
+        try:
+            return al.Grid2DIrregular(
+                [
+                    self.tangential_critical_curve_from_grid(grid=grid),
+                    self.radial_critical_curve_from_grid(grid=grid),
+                ]
+            )
+        except (IndexError, ValueError):
+            return []
+
+    def caustics_from_grid(self, grid, pixel_scale=0.05):
+
+        try:
+            return al.Grid2DIrregular(
+                [
+                    self.tangential_caustic_from_grid(grid=grid),
+                    self.radial_caustic_from_grid(grid=grid),
+                ]
+            )
+        except (IndexError, ValueError):
+            return []
+
+
+"""
+__Analysis__
+
+The `AnalysisCriticalCurves` creates a `TracerCriticalCurves` for every model instance, which share the
+`CriticalCurveEngine` of the phase. The engine is put in `preview` mode for the visualization performed during the
+model-fit.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisCriticalCurves(a.Analysis):
+    def __init__(self, masked_imaging, settings, cosmology, results=None):
+
+        super().__init__(
+            masked_imaging=masked_imaging,
+            settings=settings,
+            cosmology=cosmology,
+            results=results,
+        )
+
+        self.critical_curve_engine = CriticalCurveEngine()
+
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerCriticalCurves(
+            planes=tracer.planes,
+            cosmology=tracer.cosmology,
+            critical_curve_engine=self.critical_curve_engine,
+        )
+
+    def visualize(self, paths, instance, during_analysis):
+
+        self.critical_curve_engine.preview = during_analysis
+
+        super().visualize(
+            paths=paths, instance=instance, during_analysis=during_analysis
+        )
+
+
+"""
+__Phase__
+
+The `PhaseImagingCriticalCurves` uses the `AnalysisCriticalCurves`, and can be used in place of the `PhaseImaging`
+in any pipeline.
+"""
+
+
+class PhaseImagingCriticalCurves(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisCriticalCurves(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Comparison__
+
+Lets compare the critical curves and caustics of the engine to those of **PyAutoLens**, and how long each takes
+to compute them, for the tracer used in `plot/visuals_2d/CriticalCurvesLine.py`.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0), einstein_radius=1.6, elliptical_comps=(0.2, 0.2)
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.SphericalSersic(
+        centre=(0.1, 0.1), intensity=0.3, effective_radius=1.0, sersic_index=2.5
+    ),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+grid = al.Grid2D.uniform(shape_native=(100, 100), pixel_scales=0.05)
+
+start = time.time()
+critical_curves = tracer.critical_curves_from_grid(grid=grid)
+caustics = tracer.caustics_from_grid(grid=grid)
+print(f"Tracer critical curves and caustics time = {time.time() - start} s")
+
+for preview in [False, True]:
+
+    tracer_engine = TracerCriticalCurves(
+        planes=tracer.planes,
+        cosmology=tracer.cosmology,
+        critical_curve_engine=CriticalCurveEngine(preview=preview),
+    )
+
+    start = time.time()
+    critical_curves_engine = tracer_engine.critical_curves_from_grid(grid=grid)
+    caustics_engine = tracer_engine.caustics_from_grid(grid=grid)
+    print(
+        f"Engine (preview={preview}) critical curves and caustics time = {time.time() - start} s"
+    )
+
+    start = time.time()
+    tracer_engine.critical_curves_from_grid(grid=grid)
+    tracer_engine.caustics_from_grid(grid=grid)
+    print(
+        f"Engine (preview={preview}) cached critical curves and caustics time = {time.time() - start} s"
+    )
+
+    """
+    The second call returns the curves stored by the first, as opposed to computing them again.
+    """
+    curves = tracer_engine.critical_curve_engine.curves_from(
+        tracer=tracer_engine, grid=grid
+    )
+
+    assert len(tracer_engine.critical_curve_engine.curves) == 1
+    assert (
+        tracer_engine.critical_curve_engine.curves_from(tracer=tracer_engine, grid=grid)
+        is curves
+    )
+
+    """
+    The two tangential critical curves are made of different points, so we measure the difference between them by
+    how far each point of the engine's curve is from the closest point of **PyAutoLens**'s curve.
+    """
+    distances = np.sqrt(
+        np.sum(
+            (
+                np.asarray(critical_curves_engine[0])[:, None, :]
+                - np.asarray(critical_curves[0])[None, :, :]
+            )
+            ** 2,
+            axis=-1,
+        )
+    )
+    print(
+        "Maximum distance between tangential critical curves = ",
+        np.max(np.min(distances, axis=1)),
+    )
+
+    tracer_plotter = aplt.TracerPlotter(
+        tracer=tracer_engine,
+        grid=grid,
+        include_2d=aplt.Include2D(critical_curves=True, caustics=True),
+    )
+    tracer_plotter.subplot_tracer()
+
+"""
+__Model-Fit__
+
+The `PhaseImagingCriticalCurves` computes preview critical curves at every visualization update of the phase.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+phase = PhaseImagingCriticalCurves(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "critical_curve_engine"),
+        name="phase_critical_curve_engine",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal),
+        source=al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic),
+    ),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,455 @@
+"""
+Performance: Einstein Radius Root Finding
+=========================================
+
+The script `misc/einstein_radii_and_mass.py` computes the Einstein radius and mass of a lens using
+`einstein_radius_from_grid`, which computes the tangential eigen value of the lens on a uniform grid with a
+`pixel_scale` of 0.05", contours it using marching squares and computes the area within the tangential critical
+curve. This is slow (the deflection angles of every pixel in the grid are computed) and its accuracy depends on the
+grid's resolution.
+
+Computing the Einstein radius of every sample of a model-fit, in order to estimate its posterior (as the
+`database/tutorial_5_derived.py` tutorial does for the axis-ratio), therefore takes a long time.
+
+This script shows how the Einstein radius can be computed without a grid, by root-finding the radius of the tangential
+critical curve along rays from the lens centre:
+
+ 1) The tangential eigen value is computed at a small number of radii along every ray, and the outermost radius where
+    it changes from negative to positive brackets the tangential critical curve.
+
+ 2) The radius of the tangential critical curve along every ray is found by the Illinois (regula falsi) method, where
+    every iteration computes the eigen values of all rays using one call of the deflection angle function.
+
+ 3) The area within the tangential critical curve is integrated over the angle of every ray, which for a periodic
+    function converges quickly with the number of rays.
+
+Functions are then provided which compute the Einstein radius or mass of a batch of model parameter vectors, and the
+posterior of the Einstein radius or mass from the `Samples` of a model-fit, using the weight of every sample.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import math
+import time
+import numpy as np
+from os import path
+from astropy import cosmology as cosmo
+import autofit as af
+import autolens as al
+from autofit.non_linear.samples import quantile
+from autogalaxy import exc
+
+"""
+__Eigen Values__
+
+The tangential eigen value at a set of (y,x) coordinates is computed from the Hessian of the lensing potential, which
+is the derivative of the deflection angles estimated using central differences with a small `buffer`. The deflection
+angles of the 4 shifted grids are computed using one call of `deflections_from_grid`.
+"""
+
+
+def tangential_eigen_values_from(lensing_obj, grid, buffer=1.0e-4):
+    """
+    Returns the tangential eigen values of the lens mapping of a lensing object (e.g. a `Galaxy` or `MassProfile`) at
+    every (y,x) coordinate of a 2D ndarray of shape [total_coordinates, 2].
+    """
+    shifts = np.array(
+        [[buffer, 0.0], [-buffer, 0.0], [0.0, buffer], [0.0, -buffer]]
+    )
+
+    shifted_grid = (grid[None, :, :] + shifts[:, None, :]).reshape(-1, 2)
+
+    deflections = np.asarray(
+        lensing_obj.deflections_from_grid(grid=al.Grid2DIrregular(grid=shifted_grid))
+    ).reshape(4, -1, 2)
+
+    deflections_dy = 0.5 * (deflections[0] - deflections[1]) / buffer
+    deflections_dx = 0.5 * (deflections[2] - deflections[3]) / buffer
+
+    hessian_yy = deflections_dy[:, 0]
+    hessian_xx = deflections_dx[:, 1]
+    hessian_xy = 0.5 * (deflections_dy[:, 1] + deflections_dx[:, 0])
+
+    convergence = 0.5 * (hessian_yy + hessian_xx)
+    shear = np.sqrt((0.5 * (hessian_xx - hessian_yy)) ** 2 + hessian_xy ** 2)
+
+    return 1.0 - convergence - shear
+
+
+"""
+__Root Finding__
+
+The rays start at the `centre` of the lensing object, which by default is the centre of its first mass profile with a
+centre. The tangential critical curve must be star-shaped about this centre (every ray crosses it once), which is the
+case for the mass models fitted by **PyAutoLens**.
+"""
+
+
+def centre_from(lensing_obj):
+    """
+    Returns the centre of a `MassProfile`, or of the first mass profile of a `Galaxy` which has a centre.
+    """
+    if hasattr(lensing_obj, "mass_profiles"):
+        for mass_profile in lensing_obj.mass_profiles:
+            if hasattr(mass_profile, "centre"):
+                return mass_profile.centre
+
+    return lensing_obj.centre
+
+
+def tangential_critical_curve_radii_from(
+    lensing_obj,
+    centre,
+    angles,
+    radius_min=1.0e-3,
+    radius_max=10.0,
+    total_radii=40,
+    tolerance=1.0e-8,
+    max_iterations=100,
+):
+    """
+    Returns the radius of the tangential critical curve of a lensing object along rays from its centre at every input
+    angle (counter-clockwise from the positive x-axis), which is NaN for any ray which does not cross the curve
+    between `radius_min` and `radius_max`.
+    """
+    directions = np.stack((np.sin(angles), np.cos(angles)), axis=-1)
+
+    def eigen_values_from(radii):
+        return tangential_eigen_values_from(
+            lensing_obj=lensing_obj,
+            grid=np.asarray(centre) + radii[:, None] * directions,
+        )
+
+    radii = np.geomspace(radius_min, radius_max, total_radii)
+
+    eigen_values = tangential_eigen_values_from(
+        lensing_obj=lensing_obj,
+        grid=(
+            np.asarray(centre) + radii[None, :, None] * directions[:, None, :]
+        ).reshape(-1, 2),
+    ).reshape(len(angles), total_radii)
+
+    crossings = (eigen_values[:, :-1] <= 0.0) & (eigen_values[:, 1:] > 0.0)
+
+    has_crossing = np.any(crossings, axis=1)
+
+    if not np.any(has_crossing):
+        return np.full(len(angles), np.nan)
+
+    indexes = total_radii - 2 - np.argmax(crossings[:, ::-1], axis=1)
+
+    rays = np.arange(len(angles))
+
+    lower = radii[indexes]
+    upper = radii[indexes + 1]
+    eigen_values_lower = eigen_values[rays, indexes]
+    eigen_values_upper = eigen_values[rays, indexes + 1]
+
+    for iteration in range(max_iterations):
+
+        radii_new = upper - eigen_values_upper * (upper - lower) / (
+            eigen_values_upper - eigen_values_lower
+        )
+
+        eigen_values_new = eigen_values_from(radii=radii_new)
+
+        sign_change = eigen_values_new * eigen_values_upper < 0.0
+
+        lower = np.where(sign_change, upper, lower)
+        eigen_values_lower = np.where(
+            sign_change, eigen_values_upper, 0.5 * eigen_values_lower
+        )
+
+        step = np.abs(radii_new - upper)
+
+        upper = radii_new
+        eigen_values_upper = eigen_values_new
+
+        if np.max(step[has_crossing]) < tolerance:
+            break
+
+    return np.where(has_crossing, upper, np.nan)
+
+
+def einstein_radius_from(lensing_obj, centre=None, total_angles=64, **kwargs):
+    """
+    Returns the Einstein radius of a lensing object, defined as the radius of the circle whose area is the area within
+    its tangential critical curve.
+
+    A `ProfileException` is raised if any ray does not cross the tangential critical curve (e.g. the lens is not
+    strong enough to have one), as the area within it cannot be computed.
+    """
+    if centre is None:
+        centre = centre_from(lensing_obj=lensing_obj)
+
+    angles = np.linspace(0.0, 2.0 * np.pi, total_angles, endpoint=False)
+
+    radii = tangential_critical_curve_radii_from(
+        lensing_obj=lensing_obj, centre=centre, angles=angles, **kwargs
+    )
+
+    if np.any(np.isnan(radii)):
+        raise exc.ProfileException(
+            f"The tangential critical curve was not found along {np.sum(np.isnan(radii))} of {total_angles} rays "
+            f"from the centre {centre}."
+        )
+
+    area = 0.5 * np.sum(radii ** 2) * 2.0 * np.pi / total_angles
+
+    return math.sqrt(area / np.pi)
+
+
+def einstein_mass_angular_from(lensing_obj, centre=None, total_angles=64, **kwargs):
+    return (
+        np.pi
+        * einstein_radius_from(
+            lensing_obj=lensing_obj, centre=centre, total_angles=total_angles, **kwargs
+        )
+        ** 2
+    )
+
+
+"""
+__Batches__
+
+A batch of lens models is input as a list of parameter vectors (e.g. the `parameters` of the `Samples` of a
+model-fit) with the model they are a vector of. The Einstein radius or mass is computed for the galaxy of every model
+instance with the input name (e.g. `lens` for the `galaxies` of a phase's model).
+
+The Einstein mass in solar masses is the angular Einstein mass multiplied by the critical surface density between
+the lens galaxy's redshift and the source redshift.
+
+The Einstein radius and mass of a model whose tangential critical curve is not found are returned as NaN.
+"""
+
+
+def einstein_radii_from_vectors(model, vectors, galaxy_name="lens", **kwargs):
+    """
+    Returns the Einstein radius of the galaxy `galaxy_name` of the model instance of every parameter vector.
+    """
+    einstein_radii = []
+
+    for vector in vectors:
+
+        galaxy = getattr(model.instance_from_vector(vector=vector).galaxies, galaxy_name)
+
+        try:
+            einstein_radii.append(einstein_radius_from(lensing_obj=galaxy, **kwargs))
+        except exc.ProfileException:
+            einstein_radii.append(np.nan)
+
+    return np.array(einstein_radii)
+
+
+def einstein_masses_from_vectors(
+    model,
+    vectors,
+    redshift_source,
+    galaxy_name="lens",
+    cosmology=cosmo.Planck15,
+    **kwargs
+):
+    """
+    Returns the Einstein mass in solar masses of the galaxy `galaxy_name` of the model instance of every parameter
+    vector, for a source at `redshift_source`.
+    """
+    einstein_masses = []
+
+    for vector in vectors:
+
+        galaxy = getattr(model.instance_from_vector(vector=vector).galaxies, galaxy_name)
+
+        critical_surface_density = al.util.cosmology.critical_surface_density_between_redshifts_from(
+            redshift_0=galaxy.redshift, redshift_1=redshift_source, cosmology=cosmology
+        )
+
+        try:
+            einstein_masses.append(
+                critical_surface_density
+                * einstein_mass_angular_from(lensing_obj=galaxy, **kwargs)
+            )
+        except exc.ProfileException:
+            einstein_masses.append(np.nan)
+
+    return np.array(einstein_masses)
+
+
+"""
+__Posteriors__
+
+A `DerivedPosterior` is the value of a derived quantity for every sample of a model-fit, with the sample weights,
+from which its median and errors are estimated using weighted quantiles (in the same way as the `Samples` estimate
+the errors of every parameter).
+
+Samples whose weight is below `minimum_weight` times the largest weight contribute negligibly to the posterior and
+are skipped, which for nested sampling is the majority of samples.
+
+Samples whose derived value is NaN (e.g. a lens model without a tangential critical curve) are removed and the
+weights of the remaining samples renormalized, such that the posterior is of the samples where the quantity is
+defined. The fraction of the total weight removed is stored as `removed_weight`, and a `ProfileException` is raised
+if every sample is removed.
+"""
+
+
+class DerivedPosterior:
+    def __init__(self, values, weights):
+        """
+        The posterior of a derived quantity, given by its value for every sample of a model-fit and the weight of
+        every sample.
+        """
+        values = np.asarray(values)
+        weights = np.asarray(weights)
+
+        defined = ~np.isnan(values)
+
+        if not np.any(defined):
+            raise exc.ProfileException(
+                "The derived quantity is NaN for every sample, so it has no posterior."
+            )
+
+        self.removed_weight = float(np.sum(weights[~defined]) / np.sum(weights))
+
+        self.values = values[defined]
+        self.weights = weights[defined] / np.sum(weights[defined])
+
+    @property
+    def median(self):
+        return quantile(x=self.values, q=0.5, weights=self.weights)[0]
+
+    def values_at_sigma(self, sigma):
+        """
+        The lower and upper values of the quantity at an input sigma value of its posterior (e.g. the 15.9% and 84.1%
+        quantiles for sigma = 1.0).
+        """
+        limit = math.erf(0.5 * sigma * math.sqrt(2))
+
+        return (
+            quantile(x=self.values, q=1.0 - limit, weights=self.weights)[0],
+            quantile(x=self.values, q=limit, weights=self.weights)[0],
+        )
+
+    def errors_at_sigma(self, sigma):
+        lower, upper = self.values_at_sigma(sigma=sigma)
+        return self.median - lower, upper - self.median
+
+
+def vectors_and_weights_from(samples, minimum_weight=1.0e-8):
+    """
+    Returns the parameter vectors and weights of every sample whose weight is above `minimum_weight` times the
+    largest weight.
+    """
+    weights = np.asarray(samples.weights)
+
+    indexes = np.where(weights > minimum_weight * np.max(weights))[0]
+
+    parameters = samples.parameters
+
+    return [parameters[index] for index in indexes], weights[indexes]
+
+
+def einstein_radius_posterior_from(
+    samples, galaxy_name="lens", minimum_weight=1.0e-8, **kwargs
+):
+    """
+    Returns the posterior of the Einstein radius of the galaxy `galaxy_name` from the `Samples` of a model-fit.
+    """
+    vectors, weights = vectors_and_weights_from(
+        samples=samples, minimum_weight=minimum_weight
+    )
+
+    return DerivedPosterior(
+        values=einstein_radii_from_vectors(
+            model=samples.model, vectors=vectors, galaxy_name=galaxy_name, **kwargs
+        ),
+        weights=weights,
+    )
+
+
+def einstein_mass_posterior_from(
+    samples,
+    redshift_source,
+    galaxy_name="lens",
+    cosmology=cosmo.Planck15,
+    minimum_weight=1.0e-8,
+    **kwargs
+):
+    """
+    Returns the posterior of the Einstein mass in solar masses of the galaxy `galaxy_name` from the `Samples` of a
+    model-fit, for a source at `redshift_source`.
+    """
+    vectors, weights = vectors_and_weights_from(
+        samples=samples, minimum_weight=minimum_weight
+    )
+
+    return DerivedPosterior(
+        values=einstein_masses_from_vectors(
+            model=samples.model,
+            vectors=vectors,
+            redshift_source=redshift_source,
+            galaxy_name=galaxy_name,
+            cosmology=cosmology,
+            **kwargs
+        ),
+        weights=weights,
+    )
+
+
+"""
+__Comparison__
+
+Lets compare the Einstein radius of the `EllipticalIsothermal` used in `misc/einstein_radii_and_mass.py` computed
+via root finding to that computed using a grid, and how long each takes.
+"""
+sie = al.mp.EllipticalIsothermal(einstein_radius=2.0, elliptical_comps=(0.0, 0.333333))
+
+grid = al.Grid2D.uniform(shape_native=(100, 100), pixel_scales=0.1)
+
+start = time.time()
+einstein_radius_grid = sie.einstein_radius_from_grid(grid=grid)
+print(f"Einstein radius via grid = {einstein_radius_grid} ({time.time() - start} s)")
+
+start = time.time()
+einstein_radius = einstein_radius_from(lensing_obj=sie)
+print(f"Einstein radius via root finding = {einstein_radius} ({time.time() - start} s)")
+
+"""
+__Posteriors__
+
+We now compute the Einstein radius and mass posterior of every lens fitted in the `database` tutorials, where the
+source galaxy is at redshift 1.0.
+"""
+agg = af.Aggregator(directory=path.join("output", "database"))
+agg_filter = agg.filter(agg.directory.contains("phase_runner"))
+
+for samples in agg_filter.values("samples"):
+
+    start = time.time()
+
+    einstein_radius_posterior = einstein_radius_posterior_from(samples=samples)
+    einstein_mass_posterior = einstein_mass_posterior_from(
+        samples=samples, redshift_source=1.0
+    )
+
+    print(f"Posterior time = {time.time() - start} s")
+
+    print(
+        "Einstein Radius (arcsec) = ",
+        einstein_radius_posterior.median,
+        einstein_radius_posterior.errors_at_sigma(sigma=3.0),
+    )
+    print(
+        "Einstein Mass (solMass) = ",
+        "{:.4e}".format(einstein_mass_posterior.median),
+        einstein_mass_posterior.errors_at_sigma(sigma=3.0),
+    )
+    print(
+        "Weight of samples without a tangential critical curve = ",
+        einstein_radius_posterior.removed_weight,
+    )
+
+"""
+Finish.
+"""
@@ -0,0 +1,482 @@
+"""
+Performance: FFT Convolution
+============================
+
+The `Convolver` of a `MaskedImaging` blurs model images with the PSF in real-space, by precomputing the 'frame' of
+image pixels every pixel's light is blurred into. The run-time of this convolution (and the memory used to store
+the frames) grows with the number of pixels in the PSF, therefore for large PSFs (e.g. 41 x 41 or above) on high
+resolution data (e.g. `hst_up` at 0.03" or `ao` at 0.01") convolution dominates the likelihood evaluation.
+
+For large PSFs it is faster to perform the convolution using a Fast Fourier Transform (FFT). This script shows how
+to set up a `ConvolverFFT`, which has the same API as the `Convolver` and therefore can be used in a `FitImaging`
+and `Inversion` without any other changes. The `ConvolverFFT`:
+
+ - Crops the convolution to the bounding box of the mask and its blurring region, so the FFT is performed on the
+   smallest array possible.
+
+ - Computes the Fourier transform of the PSF once, when the dataset is set up, and reuses it for every likelihood
+   evaluation.
+
+ - Preallocates the padded work buffer used by the FFT once, as opposed to allocating it every call.
+
+The `SettingsMaskedImagingFFT` add a `convolution_method` input, which can be `real_space`, `fft` or `auto`. For
+`auto`, a simple estimate of the cost of each method is used to choose between them for each dataset, so that small
+PSFs on low resolution data continue to use the real-space `Convolver`.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import copy
+import time
+import numpy as np
+from os import path
+from scipy import fft
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from autoarray import exc
+
+"""
+__ConvolverFFT__
+
+The `ConvolverFFT` below performs the same calculation as the `Convolver`: the light in every unmasked image
+pixel and blurring pixel is blurred into the unmasked image pixels. The results of the two are identical to
+numerical precision.
+
+The FFT is performed on the bounding box of the image and blurring pixels, padded by the PSF, whose shape is
+returned by the `fft_shape_from` function.
+"""
+
+
+def fft_shape_from(mask, blurring_mask, kernel_shape_native):
+    """
+    Returns the (y,x) pixel origin and shape of the bounding box of the unmasked pixels of a mask and its blurring
+    mask, and the shape of the padded array the FFT of this region with a PSF of the input shape is performed on.
+    """
+    all_pixels = np.argwhere(
+        np.invert(np.logical_and(np.asarray(mask), np.asarray(blurring_mask)))
+    )
+
+    region_origin = np.min(all_pixels, axis=0)
+    region_shape = tuple(np.max(all_pixels, axis=0) - region_origin + 1)
+
+    fft_shape = tuple(
+        fft.next_fast_len(region_size + kernel_size - 1, real=True)
+        for region_size, kernel_size in zip(region_shape, kernel_shape_native)
+    )
+
+    return region_origin, region_shape, fft_shape
+
+
+class ConvolverFFT:
+    def __init__(self, mask, kernel):
+        """
+        Convolves masked images and mapping matrices with a PSF via FFTs, with the same API as the `Convolver`.
+
+        Parameters
+        ----------
+        mask : Mask2D
+            The mask within which the convolved signal is calculated.
+        kernel : Kernel2D
+            The PSF the images are convolved with, which must have odd dimensions.
+        """
+        if kernel.shape_native[0] % 2 == 0 or kernel.shape_native[1] % 2 == 0:
+            raise exc.ConvolverException("PSF kernel must be odd")
+
+        self.mask = mask
+        self.kernel = kernel
+
+        self.blurring_mask = mask.blurring_mask_from_kernel_shape(
+            kernel_shape_native=kernel.shape_native
+        )
+
+        image_pixels = np.argwhere(np.invert(np.asarray(mask)))
+        blurring_pixels = np.argwhere(np.invert(np.asarray(self.blurring_mask)))
+
+        self.pixels_in_mask = image_pixels.shape[0]
+        self.pixels_in_blurring_mask = blurring_pixels.shape[0]
+
+        """
+        The convolution is only performed over the bounding box of the image and blurring pixels.
+        """
+        region_origin, self.region_shape, self.fft_shape = fft_shape_from(
+            mask=mask,
+            blurring_mask=self.blurring_mask,
+            kernel_shape_native=kernel.shape_native,
+        )
+
+        half_kernel = (kernel.shape_native[0] // 2, kernel.shape_native[1] // 2)
+
+        self.image_indexes = tuple((image_pixels - region_origin).T)
+        self.blurring_indexes = tuple((blurring_pixels - region_origin).T)
+        self.blurred_indexes = tuple(
+            (image_pixels - region_origin + np.asarray(half_kernel)).T
+        )
+
+        self.kernel_fft = fft.rfft2(np.asarray(kernel.native), s=self.fft_shape)
+
+        self.work_buffer = np.zeros(self.fft_shape)
+
+    def convolved_image_from_image_and_blurring_image(self, image, blurring_image):
+        """
+        For a given image and blurring image, convolve the two using the PSF.
+
+        Parameters
+        -----------
+        image : Array2D
+            The image values which are to be blurred with the PSF.
+        blurring_image : Array2D
+            The blurring image values whose light blurs into the image after PSF convolution.
+        """
+        self.work_buffer[self.image_indexes] = image.slim_binned
+        self.work_buffer[self.blurring_indexes] = blurring_image.slim_binned
+
+        convolved_image = fft.irfft2(
+            fft.rfft2(self.work_buffer) * self.kernel_fft, s=self.fft_shape
+        )[self.blurred_indexes]
+
+        self.work_buffer[self.image_indexes] = 0.0
+        self.work_buffer[self.blurring_indexes] = 0.0
+
+        return al.Array2D(
+            array=convolved_image, mask=self.mask.mask_sub_1, store_slim=True
+        )
+
+    def convolve_mapping_matrix(self, mapping_matrix, columns_per_batch=64):
+        """
+        Convolve every column of an inversion's mapping matrix with the PSF, where the columns are transformed in
+        batches to bound the memory used by the FFT.
+
+        Parameters
+        -----------
+        mapping_matrix : np.ndarray
+            The 2D mapping matrix describing how every inversion pixel maps to a pixel on the data pixel.
+        columns_per_batch : int
+            The number of columns of the mapping matrix which are convolved in one FFT.
+        """
+        blurred_mapping_matrix = np.zeros(mapping_matrix.shape)
+
+        for column_start in range(0, mapping_matrix.shape[1], columns_per_batch):
+
+            column_end = min(column_start + columns_per_batch, mapping_matrix.shape[1])
+
+            buffer = np.zeros((column_end - column_start,) + self.fft_shape)
+            buffer[(slice(None),) + self.image_indexes] = mapping_matrix[
+                :, column_start:column_end
+            ].T
+
+            blurred_columns = fft.irfft2(
+                fft.rfft2(buffer, axes=(1, 2)) * self.kernel_fft,
+                s=self.fft_shape,
+                axes=(1, 2),
+            )
+
+            blurred_mapping_matrix[:, column_start:column_end] = blurred_columns[
+                (slice(None),) + self.blurred_indexes
+            ].T
+
+        return blurred_mapping_matrix
+
+
+"""
+__Settings__
+
+The `SettingsMaskedImagingFFT` extend the `SettingsMaskedImaging` with the `convolution_method`. The
+`use_fft_from` method decides which method is used for a given mask and PSF, where for `auto` it compares:
+
+ - The real-space cost, which is every image and blurring pixel multiplied by the number of PSF pixels.
+ - The FFT cost, which for the forward and inverse transforms scales as N log2(N) for an FFT of N pixels, where N is
+   the number of pixels of the padded bounding box the `ConvolverFFT` transforms (see `fft_shape_from`).
+
+The convolution method does not change the likelihood (other than at numerical precision), thus it is not included
+in the phase's output path tag.
+"""
+
+
+class SettingsMaskedImagingFFT(al.SettingsMaskedImaging):
+    def __init__(
+        self,
+        grid_class=al.Grid2D,
+        grid_inversion_class=al.Grid2D,
+        sub_size=2,
+        sub_size_inversion=2,
+        fractional_accuracy=0.9999,
+        sub_steps=None,
+        pixel_scales_interp=None,
+        signal_to_noise_limit=None,
+        psf_shape_2d=None,
+        renormalize_psf=True,
+        convolution_method="auto",
+        fft_cost_factor=4.0,
+    ):
+        """
+        The settings of a `MaskedImagingFFT`, which in addition to the `SettingsMaskedImaging` choose how the PSF
+        convolution is performed.
+
+        Parameters
+        ----------
+        convolution_method : str
+            Whether the PSF convolution is performed in `real_space`, via an `fft` or the method is chosen for each
+            dataset (`auto`).
+        fft_cost_factor : float
+            The relative cost of one FFT operation compared to one real-space multiply-add, which is used when the
+            convolution method is `auto`.
+        """
+        super().__init__(
+            grid_class=grid_class,
+            grid_inversion_class=grid_inversion_class,
+            sub_size=sub_size,
+            sub_size_inversion=sub_size_inversion,
+            fractional_accuracy=fractional_accuracy,
+            sub_steps=sub_steps,
+            pixel_scales_interp=pixel_scales_interp,
+            signal_to_noise_limit=signal_to_noise_limit,
+            psf_shape_2d=psf_shape_2d,
+            renormalize_psf=renormalize_psf,
+        )
+
+        if convolution_method not in ("auto", "real_space", "fft"):
+            raise exc.ConvolverException(
+                "The convolution_method of the SettingsMaskedImagingFFT must be one of "
+                "{auto, real_space, fft}"
+            )
+
+        self.convolution_method = convolution_method
+        self.fft_cost_factor = fft_cost_factor
+
+    def use_fft_from(self, mask, psf):
+
+        if psf is None or self.convolution_method == "real_space":
+            return False
+
+        if self.convolution_method == "fft":
+            return True
+
+        kernel_shape_native = (
+            psf.shape_native if self.psf_shape_2d is None else self.psf_shape_2d
+        )
+
+        blurring_mask = mask.blurring_mask_from_kernel_shape(
+            kernel_shape_native=kernel_shape_native
+        )
+
+        total_pixels = mask.pixels_in_mask + blurring_mask.pixels_in_mask
+
+        real_space_cost = total_pixels * kernel_shape_native[0] * kernel_shape_native[1]
+
+        _, _, fft_shape = fft_shape_from(
+            mask=mask,
+            blurring_mask=blurring_mask,
+            kernel_shape_native=kernel_shape_native,
+        )
+
+        fft_size = fft_shape[0] * fft_shape[1]
+        fft_cost = self.fft_cost_factor * fft_size * np.log2(fft_size)
+
+        return real_space_cost > fft_cost
+
+
+"""
+__MaskedImagingFFT__
+
+The `MaskedImagingFFT` uses the `ConvolverFFT` when the settings choose the FFT. In this case the real-space
+`Convolver` is never created, which for large PSFs also saves the memory used to store its frames.
+"""
+
+
+class MaskedImagingFFT(al.MaskedImaging):
+    def __init__(self, imaging, mask, settings=SettingsMaskedImagingFFT()):
+
+        if not settings.use_fft_from(mask=mask, psf=imaging.psf):
+
+            super().__init__(imaging=imaging, mask=mask, settings=settings)
+            return
+
+        """
+        The imaging is passed to the parent class without its PSF, so that it does not create the real-space
+        `Convolver`, and the PSF is then restored.
+        """
+        imaging_no_psf = copy.copy(imaging)
+        imaging_no_psf.psf = None
+
+        super().__init__(imaging=imaging_no_psf, mask=mask, settings=settings)
+
+        self.dataset.psf = imaging.psf
+
+        self.psf = settings.psf_reshaped_and_renormalized_from_psf(
+            psf=copy.deepcopy(imaging.psf)
+        )
+
+        self.convolver = ConvolverFFT(mask=self.mask, kernel=self.psf)
+        self.blurring_grid = self.grid.blurring_grid_from_kernel_shape(
+            kernel_shape_native=self.psf.shape_native
+        )
+
+
+"""
+__Phase__
+
+To use the `MaskedImagingFFT` in a model-fit, we extend the `PhaseImaging` so that its analysis is created using a
+`MaskedImagingFFT`.
+"""
+
+
+class PhaseImagingFFT(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = MaskedImagingFFT(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return self.Analysis(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We load the `hst_up` dataset, which has a pixel scale of 0.03", and replace its PSF with a 41 x 41 PSF, which
+corresponds to the regime where FFT convolution is beneficial.
+"""
+dataset_name = "hst_up"
+dataset_path = path.join("dataset", "imaging", "instruments", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.03,
+)
+
+psf = al.Kernel2D.from_gaussian(
+    shape_native=(41, 41), sigma=0.1, pixel_scales=imaging.pixel_scales, renormalize=True
+)
+
+imaging = al.Imaging(image=imaging.image, noise_map=imaging.noise_map, psf=psf)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Validation__
+
+We fit the same `Tracer` using a real-space and FFT convolution, checking both give the same log likelihood and
+comparing their run times.
+"""
+masked_imaging_real_space = MaskedImagingFFT(
+    imaging=imaging,
+    mask=mask,
+    settings=SettingsMaskedImagingFFT(convolution_method="real_space"),
+)
+
+masked_imaging_fft = MaskedImagingFFT(
+    imaging=imaging, mask=mask, settings=SettingsMaskedImagingFFT(convolution_method="fft")
+)
+
+print(
+    "Auto convolution method uses FFT = ",
+    SettingsMaskedImagingFFT(convolution_method="auto").use_fft_from(
+        mask=mask, psf=imaging.psf
+    ),
+)
+
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0), einstein_radius=1.6, elliptical_comps=(0.1, 0.0)
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.EllipticalSersic(
+        centre=(0.1, 0.1),
+        elliptical_comps=(0.0, 0.1),
+        intensity=0.3,
+        effective_radius=1.0,
+        sersic_index=2.5,
+    ),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+repeats = 10
+
+for name, masked_imaging in [
+    ("Real Space", masked_imaging_real_space),
+    ("FFT", masked_imaging_fft),
+]:
+
+    start = time.time()
+    for i in range(repeats):
+        fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+    run_time = (time.time() - start) / repeats
+
+    print(f"{name} Log Likelihood = {fit.log_likelihood}, Time per fit = {run_time}")
+
+"""
+The `ConvolverFFT` can also be used by an `Inversion`, as it blurs the mapping matrix via the same
+`convolve_mapping_matrix` method as the `Convolver`.
+"""
+source_galaxy_inversion = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.Rectangular(shape=(30, 30)),
+    regularization=al.reg.Constant(coefficient=1.0),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy_inversion])
+
+for name, masked_imaging in [
+    ("Real Space", masked_imaging_real_space),
+    ("FFT", masked_imaging_fft),
+]:
+
+    fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+
+    print(f"{name} Inversion Log Evidence = {fit.log_evidence}")
+
+"""
+__Search__
+
+We now perform a model-fit using the `PhaseImagingFFT`, where the `auto` convolution method chooses the FFT for this
+dataset.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+settings = al.SettingsPhaseImaging(
+    settings_masked_imaging=SettingsMaskedImagingFFT(convolution_method="auto")
+)
+
+search = af.DynestyStatic(
+    path_prefix=path.join("performance", dataset_name),
+    name="phase_fft_convolution",
+    n_live_points=50,
+)
+
+phase = PhaseImagingFFT(
+    search=search,
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=settings,
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
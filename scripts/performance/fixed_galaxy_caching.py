@@ -0,0 +1,440 @@
+"""
+Performance: Fixed Galaxy Caching
+=================================
+
+When phases are chained, components of the lens model are often passed from a previous phase as fixed `instance`s,
+as opposed to free `model`s. For example:
+
+ - In `imaging/modeling/chaining/lens_light_to_total_mass.py` the lens light is fixed to the result of phase 1 when
+   the lens mass and source are fitted in phase 2.
+
+ - In the SLaM subhalo pipeline with `SetupSubhalo(source_is_model=False)` the source is fixed to the result of the
+   previous pipeline.
+
+The light of these galaxies is identical for every model the non-linear search fits, yet by default its image is
+evaluated and convolved with the PSF in every likelihood evaluation. For lens light models in the SLaM pipelines
+this is a large fraction of the run-time.
+
+This script shows how a phase can detect the galaxies in its model whose light profiles have no free parameters and
+cache, for the whole phase:
+
+ - The blurred image of every fixed galaxy whose traced grid does not change, which is the case when the galaxy is
+   in the image-plane or when every galaxy with mass at a lower redshift is also fixed.
+
+ - The traced grid and blurring grid of every plane, when the mass of every galaxy in the model is fixed.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import inspect
+import numpy as np
+from os import path
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+
+"""
+__Fixed Galaxies__
+
+The functions below inspect a galaxy in the model and return whether its light profiles (or mass profiles) have no
+free parameters. A galaxy is fixed if:
+
+ - It was passed to the model as a `Galaxy` instance.
+ - It is a `GalaxyModel` whose redshift and light (or mass) profiles were all passed as instances.
+"""
+
+
+def profiles_are_fixed_from(galaxy_model, profile_class):
+    """
+    Returns `True` if every profile of type `profile_class` in a galaxy of the model has no free parameters.
+
+    Parameters
+    ----------
+    galaxy_model : al.GalaxyModel or al.Galaxy
+        A galaxy in the model, which is an instance if all of its parameters are fixed.
+    profile_class : type
+        The profile type that is checked, e.g. `al.lp.LightProfile` or `al.mp.MassProfile`.
+    """
+    if not isinstance(galaxy_model, af.AbstractPriorModel):
+        return True
+
+    if len(galaxy_model.direct_prior_tuples) > 0:
+        return False
+
+    for name, prior_model in galaxy_model.direct_prior_model_tuples:
+
+        cls = getattr(prior_model, "cls", None)
+
+        if not inspect.isclass(cls):
+            continue
+
+        if issubclass(cls, (profile_class, al.Redshift)):
+            if prior_model.prior_count > 0:
+                return False
+
+    return True
+
+
+def fixed_galaxy_names_from(model, profile_class):
+    """
+    Returns the names of all galaxies in the model whose profiles of type `profile_class` have no free parameters.
+    """
+    return [
+        name
+        for name, galaxy_model in model.galaxies.items()
+        if profiles_are_fixed_from(
+            galaxy_model=galaxy_model, profile_class=profile_class
+        )
+    ]
+
+
+"""
+__Tracer__
+
+The `TracerFixedGalaxies` extends the `Tracer`, overwriting the `blurred_image_from_grid_and_convolver` method used
+by the `FitImaging`. Its cache is a dictionary owned by the `Analysis`, therefore it persists over every likelihood
+evaluation of the phase.
+"""
+
+
+class TracerFixedGalaxies(al.Tracer):
+    def __init__(
+        self, planes, cosmology, fixed_light_galaxy_dict, fixed_mass_galaxies, cache
+    ):
+        """
+        A `Tracer` which caches the blurred images of galaxies whose light is fixed and the traced grids of its planes
+        when all mass is fixed.
+
+        Parameters
+        ----------
+        fixed_light_galaxy_dict : {str: al.Galaxy}
+            The galaxies whose light profiles are fixed, paired with their name in the model.
+        fixed_mass_galaxies : [al.Galaxy]
+            The galaxies whose mass profiles are fixed.
+        cache : dict
+            The dictionary the cached blurred images and traced grids are stored in.
+        """
+        super().__init__(planes=planes, cosmology=cosmology)
+
+        self.fixed_light_galaxy_dict = fixed_light_galaxy_dict
+        self.fixed_mass_galaxy_ids = [id(galaxy) for galaxy in fixed_mass_galaxies]
+        self.cache = cache
+
+    def plane_index_of_galaxy(self, galaxy):
+        for plane_index, plane in enumerate(self.planes):
+            if any(galaxy is plane_galaxy for plane_galaxy in plane.galaxies):
+                return plane_index
+
+    def mass_is_fixed_below_plane_index(self, plane_index):
+        return all(
+            id(galaxy) in self.fixed_mass_galaxy_ids
+            for plane in self.planes[:plane_index]
+            for galaxy in plane.galaxies
+            if galaxy.has_mass_profile
+        )
+
+    @property
+    def has_fixed_mass(self):
+        return self.mass_is_fixed_below_plane_index(plane_index=self.total_planes)
+
+    @property
+    def cached_galaxy_dict(self):
+        """
+        The fixed light galaxies whose traced grids do not change, and therefore whose blurred images are cached.
+        """
+        return {
+            name: galaxy
+            for name, galaxy in self.fixed_light_galaxy_dict.items()
+            if galaxy.has_light_profile
+            and self.mass_is_fixed_below_plane_index(
+                plane_index=self.plane_index_of_galaxy(galaxy=galaxy)
+            )
+        }
+
+    def traced_grids_of_planes_cached_from(self, grid, name, plane_index_limit=None):
+        """
+        Returns the traced grids of every plane, which are cached under `name` if all mass in the tracer is fixed.
+        """
+        if not self.has_fixed_mass:
+            return self.traced_grids_of_planes_from_grid(
+                grid=grid, plane_index_limit=plane_index_limit
+            )
+
+        if name not in self.cache:
+            self.cache[name] = self.traced_grids_of_planes_from_grid(grid=grid)
+
+        return self.cache[name]
+
+    def blurred_image_from_grid_and_convolver(self, grid, convolver, blurring_grid):
+
+        if not self.has_light_profile:
+            return np.zeros(shape=grid.shape_slim)
+
+        cached_galaxy_dict = self.cached_galaxy_dict
+
+        cached_galaxy_ids = [id(galaxy) for galaxy in cached_galaxy_dict.values()]
+
+        for name, galaxy in cached_galaxy_dict.items():
+
+            if ("blurred_image", name) not in self.cache:
+
+                plane_index = self.plane_index_of_galaxy(galaxy=galaxy)
+
+                traced_grid = self.traced_grids_of_planes_from_grid(
+                    grid=grid, plane_index_limit=plane_index
+                )[plane_index]
+                traced_blurring_grid = self.traced_grids_of_planes_from_grid(
+                    grid=blurring_grid, plane_index_limit=plane_index
+                )[plane_index]
+
+                self.cache[
+                    ("blurred_image", name)
+                ] = convolver.convolved_image_from_image_and_blurring_image(
+                    image=galaxy.image_from_grid(grid=traced_grid),
+                    blurring_image=galaxy.image_from_grid(grid=traced_blurring_grid),
+                )
+
+        blurred_images = [
+            self.cache[("blurred_image", name)] for name in cached_galaxy_dict.keys()
+        ]
+
+        """
+        The galaxies whose light is not cached are evaluated and convolved as normal, where the traced grids are only
+        computed up to the highest plane which contains one of these galaxies.
+        """
+        galaxy_plane_index_tuples = [
+            (galaxy, plane_index)
+            for plane_index, plane in enumerate(self.planes)
+            for galaxy in plane.galaxies
+            if galaxy.has_light_profile and id(galaxy) not in cached_galaxy_ids
+        ]
+
+        if len(galaxy_plane_index_tuples) > 0:
+
+            plane_index_limit = max(
+                plane_index for galaxy, plane_index in galaxy_plane_index_tuples
+            )
+
+            traced_grids_of_planes = self.traced_grids_of_planes_cached_from(
+                grid=grid, name="traced_grids", plane_index_limit=plane_index_limit
+            )
+            traced_blurring_grids_of_planes = self.traced_grids_of_planes_cached_from(
+                grid=blurring_grid,
+                name="traced_blurring_grids",
+                plane_index_limit=plane_index_limit,
+            )
+
+            image = sum(
+                galaxy.image_from_grid(grid=traced_grids_of_planes[plane_index])
+                for galaxy, plane_index in galaxy_plane_index_tuples
+            )
+            blurring_image = sum(
+                galaxy.image_from_grid(grid=traced_blurring_grids_of_planes[plane_index])
+                for galaxy, plane_index in galaxy_plane_index_tuples
+            )
+
+            blurred_images.append(
+                convolver.convolved_image_from_image_and_blurring_image(
+                    image=image, blurring_image=blurring_image
+                )
+            )
+
+        return sum(blurred_images[1:], blurred_images[0])
+
+
+"""
+__Analysis__
+
+The `AnalysisFixedGalaxies` creates a `TracerFixedGalaxies` for every model instance, passing it the galaxies of
+the instance that are fixed and the cache shared by the whole phase.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisFixedGalaxies(a.Analysis):
+    def __init__(
+        self,
+        masked_imaging,
+        settings,
+        cosmology,
+        fixed_light_galaxy_names,
+        fixed_mass_galaxy_names,
+        results=None,
+    ):
+
+        super().__init__(
+            masked_imaging=masked_imaging,
+            settings=settings,
+            cosmology=cosmology,
+            results=results,
+        )
+
+        self.fixed_light_galaxy_names = fixed_light_galaxy_names
+        self.fixed_mass_galaxy_names = fixed_mass_galaxy_names
+        self.fixed_galaxy_cache = {}
+
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerFixedGalaxies(
+            planes=tracer.planes,
+            cosmology=tracer.cosmology,
+            fixed_light_galaxy_dict={
+                name: getattr(instance.galaxies, name)
+                for name in self.fixed_light_galaxy_names
+            },
+            fixed_mass_galaxies=[
+                getattr(instance.galaxies, name)
+                for name in self.fixed_mass_galaxy_names
+            ],
+            cache=self.fixed_galaxy_cache,
+        )
+
+
+"""
+__Phase__
+
+The `PhaseImagingFixedGalaxies` inspects its model for fixed galaxies when the analysis is created, which is after
+the model has been populated with the results of previous phases.
+"""
+
+
+class PhaseImagingFixedGalaxies(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisFixedGalaxies(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            fixed_light_galaxy_names=fixed_galaxy_names_from(
+                model=self.model, profile_class=al.lp.LightProfile
+            ),
+            fixed_mass_galaxy_names=fixed_galaxy_names_from(
+                model=self.model, profile_class=al.mp.MassProfile
+            ),
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `light_sersic_exp__mass_sie__source_sersic` dataset, which includes the lens galaxy's light, and chain
+two phases as in the `lens_light_to_total_mass.py` example.
+"""
+dataset_name = "light_sersic_exp__mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "with_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Phase 1__
+
+Phase 1 fits the lens galaxy's light, which has free parameters and is therefore not cached.
+"""
+bulge = af.PriorModel(al.lp.EllipticalSersic)
+disk = af.PriorModel(al.lp.EllipticalExponential)
+
+bulge.centre = disk.centre
+
+lens = al.GalaxyModel(redshift=0.5, bulge=bulge, disk=disk)
+
+settings = al.SettingsPhaseImaging()
+
+phase1 = PhaseImagingFixedGalaxies(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "fixed_galaxy_caching"),
+        name="phase[1]",
+        n_live_points=50,
+    ),
+    settings=settings,
+    galaxies=af.CollectionPriorModel(lens=lens),
+)
+
+phase1_result = phase1.run(dataset=imaging, mask=mask)
+
+"""
+__Phase 2__
+
+Phase 2 fixes the lens light to the result of phase 1 and fits the lens mass and source. The lens's light profiles
+have no free parameters and it is in the image-plane, so its blurred image is computed once and reused for every
+likelihood evaluation of the phase.
+"""
+mass = af.PriorModel(al.mp.EllipticalIsothermal)
+
+mass.centre = phase1_result.model.galaxies.lens.bulge.centre
+
+lens = al.GalaxyModel(
+    redshift=0.5,
+    bulge=phase1_result.instance.galaxies.lens.bulge,
+    disk=phase1_result.instance.galaxies.lens.disk,
+    mass=mass,
+)
+
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+phase2 = PhaseImagingFixedGalaxies(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "fixed_galaxy_caching"),
+        name="phase[2]",
+        n_live_points=50,
+    ),
+    settings=settings,
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+"""
+Before running phase 2, lets check the cached and standard likelihoods are identical, for a random model. Calling
+`make_analysis` directly shows which galaxies were detected as fixed.
+"""
+analysis = phase2.make_analysis(dataset=imaging, mask=mask)
+
+print("Galaxies with fixed light = ", analysis.fixed_light_galaxy_names)
+print("Galaxies with fixed mass = ", analysis.fixed_mass_galaxy_names)
+
+instance = phase2.model.random_instance()
+
+tracer_cached = analysis.tracer_for_instance(instance=instance)
+tracer = al.Tracer.from_galaxies(galaxies=instance.galaxies)
+
+for _ in range(2):
+    fit_cached = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer_cached)
+
+fit = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer)
+
+print("Cached Log Likelihood = ", fit_cached.log_likelihood)
+print("Standard Log Likelihood = ", fit.log_likelihood)
+
+phase2.run(dataset=imaging, mask=mask)
+
+"""
+The `PhaseImagingFixedGalaxies` can be used in any pipeline in place of the `PhaseImaging`, for example in the
+`GridPhase` of the SLaM subhalo pipeline (by passing it as the `phase_class` of `af.as_grid_search`), where the
+source is fixed when `source_is_model=False`.
+
+Finish.
+"""
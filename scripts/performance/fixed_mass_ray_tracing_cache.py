@@ -0,0 +1,399 @@
+"""
+Performance: Fixed Mass Ray Tracing Cache
+=========================================
+
+Many phases fit lens models where the mass model is fixed and only the source changes, for example:
+
+ - Phases 1 and 3 of the SLaM source inversion pipeline, which fix the lens mass to the result of a previous phase
+   and fit the source `Pixelization` and `Regularization`.
+
+ - The SLaM subhalo pipeline with `SetupSubhalo(mass_is_model=False)`.
+
+For these phases the traced grids of every plane are identical for every model the non-linear search fits, yet by
+default `Tracer.traced_grids_of_planes_from_grid` recomputes the deflection angles of every mass profile in every
+likelihood evaluation. When a `Pixelization` is used, the source-plane `Mapper` is also recomputed, even if the
+pixelization's parameters are fixed as well.
+
+This script shows how the `Tracer` can cache its ray-tracing calculations using a key made from the parameters of
+every mass profile in the lens model (and the redshifts of their galaxies). The cache reuses:
+
+ - The traced sub-grids of every plane, for the `grid` and `grid_inversion` of the `MaskedImaging`.
+ - The traced blurring grids, used to compute the light which is blurred into the mask by the PSF.
+ - The `Mapper`'s of every plane with a `Pixelization`, if the parameters of the pixelization are also unchanged.
+
+The cache is cleared automatically whenever any mass parameter changes, therefore it can be used in phases where the
+mass model is free, it simply does not speed these phases up.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from cache_keys import mass_key_from, profile_key_from
+
+"""
+__Cache Keys__
+
+The cache key of a profile is its class name and the values of its parameters, which are read from the attributes
+of the profile instance (see the `cache_keys.py` module, which is shared by the `performance` scripts that cache
+quantities of the mass model).
+"""
+
+
+"""
+__Tracer__
+
+The `TracerMassCache` extends the `Tracer`, overwriting the two methods which perform ray-tracing:
+
+ - `traced_grids_of_planes_from_grid`, which is used by the `FitImaging` to trace the `grid`, `blurring_grid` and
+   `grid_inversion`.
+
+ - `mappers_of_planes_from_grid`, which is used by an `Inversion` to pair every traced sub-pixel with a source
+   pixel.
+
+Its cache is a dictionary owned by the `Analysis`, therefore it persists over every likelihood evaluation of the
+phase.
+
+Traced grids are cached using the `id` of the grid that is traced. The grids of the `MaskedImaging` are the same
+objects for the whole phase, but a cache entry also stores the grid it traced so that a temporary grid whose `id` is
+reused by Python can never be paired with the wrong traced grid.
+"""
+
+
+class TracerMassCache(al.Tracer):
+    def __init__(self, planes, cosmology, cache):
+        """
+        A `Tracer` which caches its traced grids and mappers, using a key made from the parameters of its mass model.
+
+        Parameters
+        ----------
+        cache : dict
+            The dictionary the traced grids and mappers are stored in.
+        """
+        super().__init__(planes=planes, cosmology=cosmology)
+
+        self.cache = cache
+
+    @property
+    def mass_cache(self):
+        """
+        The entries of the cache for the mass model of this tracer, which are cleared if any mass parameter is
+        different to those of the tracer which last used the cache.
+        """
+        mass_key = mass_key_from(tracer=self)
+
+        if self.cache.get("mass_key") != mass_key:
+            self.cache["mass_key"] = mass_key
+            self.cache["traced_grids"] = {}
+            self.cache["mappers"] = None
+
+        return self.cache
+
+    def traced_grids_of_planes_from_grid(self, grid, plane_index_limit=None):
+
+        traced_grids_dict = self.mass_cache["traced_grids"]
+
+        key = (id(grid), plane_index_limit)
+
+        if key in traced_grids_dict:
+            cached_grid, traced_grids = traced_grids_dict[key]
+            if cached_grid is grid:
+                return [traced_grid.copy() for traced_grid in traced_grids]
+
+        traced_grids = super().traced_grids_of_planes_from_grid(
+            grid=grid, plane_index_limit=plane_index_limit
+        )
+
+        traced_grids_dict[key] = (
+            grid,
+            [traced_grid.copy() for traced_grid in traced_grids],
+        )
+
+        return traced_grids
+
+    def mappers_key_from(self, settings_pixelization):
+        """
+        Returns a hashable key of the pixelizations of the tracer and the settings used to create their mappers.
+        """
+        return (
+            tuple(
+                profile_key_from(profile=pixelization)
+                if pixelization is not None
+                else None
+                for pixelization in self.pixelizations_of_planes
+            ),
+            settings_pixelization.use_border,
+            settings_pixelization.pixel_limit,
+            settings_pixelization.kmeans_seed,
+        )
+
+    def mappers_of_planes_from_grid(
+        self, grid, settings_pixelization=al.SettingsPixelization()
+    ):
+        """
+        Returns the mappers of every plane, which are reused if the mass model, pixelizations, grid and hyper images
+        are identical to those which last computed them.
+
+        Only the mappers of the last set of pixelizations are stored, as a phase where the pixelization parameters
+        vary would otherwise fill the memory with mappers that are never reused. Stochastic pixelizations are never
+        cached.
+        """
+        if settings_pixelization.is_stochastic:
+            return super().mappers_of_planes_from_grid(
+                grid=grid, settings_pixelization=settings_pixelization
+            )
+
+        mass_cache = self.mass_cache
+
+        key = self.mappers_key_from(settings_pixelization=settings_pixelization)
+        objects = [
+            grid,
+            settings_pixelization.preload_sparse_grids_of_planes,
+        ] + self.hyper_galaxy_images_of_planes_with_pixelization
+
+        if mass_cache["mappers"] is not None:
+
+            cached_key, cached_objects, mappers_of_planes = mass_cache["mappers"]
+
+            if cached_key == key and all(
+                cached_object is obj
+                for cached_object, obj in zip(cached_objects, objects)
+            ):
+                return mappers_of_planes
+
+        mappers_of_planes = super().mappers_of_planes_from_grid(
+            grid=grid, settings_pixelization=settings_pixelization
+        )
+
+        mass_cache["mappers"] = (key, objects, mappers_of_planes)
+
+        return mappers_of_planes
+
+    @property
+    def hyper_galaxy_images_of_planes_with_pixelization(self):
+        return [
+            plane.hyper_galaxy_image_of_galaxy_with_pixelization
+            for plane in self.planes
+        ]
+
+
+"""
+__Analysis__
+
+The `AnalysisMassCache` creates a `TracerMassCache` for every model instance, passing it the cache shared by the
+whole phase.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisMassCache(a.Analysis):
+    def __init__(self, masked_imaging, settings, cosmology, results=None):
+
+        super().__init__(
+            masked_imaging=masked_imaging,
+            settings=settings,
+            cosmology=cosmology,
+            results=results,
+        )
+
+        self.mass_cache = {}
+
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerMassCache(
+            planes=tracer.planes, cosmology=tracer.cosmology, cache=self.mass_cache
+        )
+
+
+"""
+__Phase__
+
+The `PhaseImagingMassCache` uses the `AnalysisMassCache`, and can be used in place of the `PhaseImaging` in any
+pipeline.
+"""
+
+
+class PhaseImagingMassCache(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisMassCache(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `mass_sie__source_sersic` dataset and chain two phases, in the same way as phases 1 of the SLaM source
+parametric and source inversion pipelines.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Phase 1__
+
+Phase 1 fits the lens mass with a parametric source. The mass parameters change in every likelihood evaluation, so
+the cache is cleared every time and the phase runs at the same speed as a `PhaseImaging`.
+"""
+lens = al.GalaxyModel(
+    redshift=0.5, mass=al.mp.EllipticalIsothermal, shear=al.mp.ExternalShear
+)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+settings = al.SettingsPhaseImaging()
+
+phase1 = PhaseImagingMassCache(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "fixed_mass_ray_tracing_cache"),
+        name="phase[1]",
+        n_live_points=50,
+    ),
+    settings=settings,
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+phase1_result = phase1.run(dataset=imaging, mask=mask)
+
+"""
+__Phase 2__
+
+Phase 2 fixes the lens mass to the result of phase 1 and fits the source using a `VoronoiMagnification`
+pixelization. The traced grids are computed once for the whole phase, and the mapper is reused whenever the
+non-linear search samples a model with the same pixelization shape (e.g. models which only change the
+regularization coefficient).
+"""
+lens = al.GalaxyModel(
+    redshift=0.5,
+    mass=phase1_result.instance.galaxies.lens.mass,
+    shear=phase1_result.instance.galaxies.lens.shear,
+)
+
+source = al.GalaxyModel(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification,
+    regularization=al.reg.Constant,
+)
+
+phase2 = PhaseImagingMassCache(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "fixed_mass_ray_tracing_cache"),
+        name="phase[2]",
+        n_live_points=30,
+    ),
+    settings=settings,
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+"""
+Before running phase 2, lets check the cached and standard likelihoods are identical and compare how long each takes,
+for a random model.
+"""
+analysis = phase2.make_analysis(dataset=imaging, mask=mask)
+
+instance = phase2.model.random_instance()
+
+tracer_cached = analysis.tracer_for_instance(instance=instance)
+tracer = al.Tracer.from_galaxies(galaxies=instance.galaxies)
+
+repeats = 10
+
+fit_cached = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer_cached)
+
+first_log_likelihood = fit_cached.log_likelihood
+
+start = time.time()
+for _ in range(repeats):
+    fit_cached = al.FitImaging(
+        masked_imaging=analysis.masked_imaging, tracer=tracer_cached
+    )
+print(f"Cached FitImaging time = {(time.time() - start) / repeats} s")
+
+start = time.time()
+for _ in range(repeats):
+    fit = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer)
+print(f"Standard FitImaging time = {(time.time() - start) / repeats} s")
+
+print("Cached Log Likelihood = ", fit_cached.log_likelihood)
+print("Standard Log Likelihood = ", fit.log_likelihood)
+
+"""
+The border relocation of the inversion moves the coordinates of the traced grids it is given in-place, so the cache
+stores and returns copies of the traced grids. Every fit using the cache therefore has the same likelihood as the
+first fit, which computed the traced grids, and as the standard `Tracer`.
+"""
+assert fit_cached.log_likelihood == first_log_likelihood
+assert np.isclose(fit_cached.log_likelihood, fit.log_likelihood, rtol=1e-10)
+
+"""
+The cache is keyed on the values of the mass parameters, so if we change the lens's mass model the cached traced
+grids are discarded and the likelihood is again identical to that of the standard `Tracer`.
+"""
+lens_perturbed = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=instance.galaxies.lens.mass.centre,
+        elliptical_comps=instance.galaxies.lens.mass.elliptical_comps,
+        einstein_radius=instance.galaxies.lens.mass.einstein_radius + 0.05,
+    ),
+    shear=instance.galaxies.lens.shear,
+)
+
+tracer_cached = TracerMassCache(
+    planes=al.Tracer.from_galaxies(
+        galaxies=[lens_perturbed, instance.galaxies.source]
+    ).planes,
+    cosmology=tracer.cosmology,
+    cache=analysis.mass_cache,
+)
+tracer = al.Tracer.from_galaxies(galaxies=[lens_perturbed, instance.galaxies.source])
+
+fit_cached = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer_cached)
+fit = al.FitImaging(masked_imaging=analysis.masked_imaging, tracer=tracer)
+
+print("Perturbed Mass Cached Log Likelihood = ", fit_cached.log_likelihood)
+print("Perturbed Mass Standard Log Likelihood = ", fit.log_likelihood)
+
+phase2.run(dataset=imaging, mask=mask)
+
+"""
+The `PhaseImagingMassCache` can be used in any pipeline in place of the `PhaseImaging`, for example in phases 1 and
+3 of the SLaM source inversion pipeline, or in the `GridPhase` of the SLaM subhalo pipeline when the lens mass is
+fixed (by passing it as the `phase_class` of `af.as_grid_search`).
+
+Finish.
+"""
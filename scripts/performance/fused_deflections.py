@@ -0,0 +1,465 @@
+"""
+Performance: Fused Deflections
+==============================
+
+The most common lens models fitted with **PyAutoLens** are an `EllipticalIsothermal` or `EllipticalPowerLaw` with an
+`ExternalShear` (the default of `SetupMassTotal(with_shear=True)` in the SLaM pipelines). To compute the deflection
+angles of the lens plane, the `Plane` sums the deflection angles of every `Galaxy`, which sums those of every mass
+profile, and every mass profile:
+
+ 1) Shifts and rotates the grid to its reference frame, creating a new `Grid2D`.
+ 2) Moves coordinates near its centre to the radial minimum, creating another `Grid2D`.
+ 3) Computes its deflection angles using NumPy functions over the whole grid, creating a temporary array for every
+    step of the calculation.
+ 4) Rotates the deflection angles back to the original reference frame, creating a new array which is summed with
+    the deflection angles of the other mass profiles.
+
+For these analytic profiles the arithmetic is cheap, so allocating and passing over these arrays takes as long as
+the calculation itself.
+
+This script shows a `PlaneFused`, whose deflection angles are computed by a single numba function which loops over
+the (y,x) coordinates of the grid once, and for every coordinate adds the deflection angles of every mass profile of
+every galaxy in the plane to a single output array. The following mass profiles are computed in this way (every
+other mass profile is computed by **PyAutoLens** and added to the output):
+
+ - `EllipticalIsothermal` and `SphericalIsothermal`.
+ - `EllipticalPowerLaw` and `SphericalPowerLaw`.
+ - `ExternalShear`.
+
+A `TracerFused` is made of `PlaneFused`'s, and the `PhaseImagingFused` uses it for every model it fits.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from autoconf import conf
+import autofit as af
+import autolens as al
+from autoarray import decorator_util
+from autoarray.structures.grids import grid_decorators
+
+"""
+__Kernels__
+
+Every mass profile is described by an integer `profile_type` and a row of an ndarray `parameters` of shape
+[total_profiles, 9], whose first 5 entries are the same for every profile:
+
+ (centre_y, centre_x, cos_phi, sin_phi, radial_minimum)
+
+and whose last 4 entries are constants of the profile's deflection angles which do not depend on the grid (and are
+computed once by `parameters_from` below):
+
+ - 0: `EllipticalIsothermal`, with (factor, sqrt(1 - axis_ratio^2), axis_ratio, 0.0).
+ - 1: `EllipticalPowerLaw`, with (amplitude, axis_ratio, slope - 1, (1 - axis_ratio) / (1 + axis_ratio)).
+ - 2: `ExternalShear`, with (magnitude, 0.0, 0.0, 0.0).
+
+The `SphericalIsothermal` and `SphericalPowerLaw` use the power-law expression with an `axis_ratio` of 1.0 (the
+`EllipticalIsothermal` expression is singular for an `axis_ratio` of 1.0).
+
+The power-law deflection angles use the hypergeometric function of Tessore & Metcalf 2015
+(https://arxiv.org/abs/1507.01819), which is computed by summing its series until a term is below 1e-12 (as opposed
+to using `scipy.special.hyp2f1`, which cannot be called by numba).
+"""
+isothermal = 0
+power_law = 1
+shear = 2
+
+
+@decorator_util.jit()
+def relocated_from(y, x, radial_minimum):
+    """
+    Returns the (y,x) coordinates of a point relative to a profile centre, after moving it to the radial minimum if it
+    is closer to the centre.
+    """
+    radius = np.sqrt(y ** 2 + x ** 2)
+
+    if radius == 0.0:
+        return radial_minimum, radial_minimum
+    elif radius < radial_minimum:
+        return y * radial_minimum / radius, x * radial_minimum / radius
+
+    return y, x
+
+
+@decorator_util.jit()
+def hyp2f1_series_from(slope, z_squared_factor):
+    """
+    Returns the hypergeometric function 2F1(1, slope / 2, 2 - slope / 2, z_squared_factor) of the power-law deflection
+    angles by summing its series.
+    """
+    term = 1.0 + 0.0j
+    total = 1.0 + 0.0j
+
+    for n in range(1, 1000):
+
+        term *= (
+            (0.5 * slope + n - 1.0) / (2.0 - 0.5 * slope + n - 1.0) * z_squared_factor
+        )
+        total += term
+
+        if abs(term) < 1.0e-12:
+            break
+
+    return total
+
+
+@decorator_util.jit()
+def deflections_fused_into(grid, profile_types, parameters, deflections):
+    """
+    Adds the deflection angles of every mass profile at every (y,x) coordinate of a grid to an array of deflection
+    angles of shape [total_coordinates, 2].
+    """
+    for i in range(grid.shape[0]):
+        for j in range(profile_types.shape[0]):
+
+            cos_phi = parameters[j, 2]
+            sin_phi = parameters[j, 3]
+
+            y_shifted = grid[i, 0] - parameters[j, 0]
+            x_shifted = grid[i, 1] - parameters[j, 1]
+
+            y, x = relocated_from(
+                y=y_shifted * cos_phi - x_shifted * sin_phi,
+                x=x_shifted * cos_phi + y_shifted * sin_phi,
+                radial_minimum=parameters[j, 4],
+            )
+
+            if profile_types[j] == isothermal:
+
+                psi = np.sqrt(parameters[j, 7] ** 2 * x ** 2 + y ** 2)
+
+                deflection_y = parameters[j, 5] * np.arctanh(parameters[j, 6] * y / psi)
+                deflection_x = parameters[j, 5] * np.arctan(parameters[j, 6] * x / psi)
+
+            elif profile_types[j] == power_law:
+
+                axis_ratio = parameters[j, 6]
+                slope = parameters[j, 7]
+
+                radius = np.sqrt(axis_ratio ** 2 * x ** 2 + y ** 2)
+
+                z = (axis_ratio * x + 1j * y) / radius
+
+                complex_angle = (
+                    parameters[j, 5]
+                    * radius ** (1.0 - slope)
+                    * z
+                    * hyp2f1_series_from(
+                        slope=slope, z_squared_factor=-parameters[j, 8] * z ** 2
+                    )
+                )
+
+                deflection_y = complex_angle.imag
+                deflection_x = complex_angle.real
+
+            else:
+
+                deflection_y = -parameters[j, 5] * y
+                deflection_x = parameters[j, 5] * x
+
+            deflections[i, 0] += deflection_x * sin_phi + deflection_y * cos_phi
+            deflections[i, 1] += deflection_x * cos_phi - deflection_y * sin_phi
+
+    return deflections
+
+
+"""
+__Parameters__
+
+The profile type and parameters of a mass profile are computed from its attributes using the same expressions as
+its `deflections_from_grid` method. Only the exact classes below are fused, so that subclasses which change how the
+deflection angles are computed are left to **PyAutoLens**.
+"""
+fused_profile_types = {
+    al.mp.EllipticalIsothermal: isothermal,
+    al.mp.SphericalIsothermal: power_law,
+    al.mp.EllipticalPowerLaw: power_law,
+    al.mp.SphericalPowerLaw: power_law,
+    al.mp.ExternalShear: shear,
+}
+
+
+def parameters_from(profile):
+    """
+    Returns the profile type and row of parameters of a mass profile which is fused.
+    """
+    profile_type = fused_profile_types[type(profile)]
+
+    radial_minimum = conf.instance["grids"]["radial_minimum"]["radial_minimum"][
+        type(profile).__name__
+    ]
+
+    if profile_type == shear:
+        centre = (0.0, 0.0)
+    else:
+        centre = profile.centre
+
+    if type(profile).__name__.startswith("Spherical"):
+        cos_phi, sin_phi, axis_ratio = 1.0, 0.0, 1.0
+    else:
+        cos_phi, sin_phi = profile.cos_phi, profile.sin_phi
+        axis_ratio = profile.axis_ratio
+
+    if profile_type == isothermal:
+
+        constants = (
+            2.0
+            * profile.einstein_radius_rescaled
+            * axis_ratio
+            / np.sqrt(1 - axis_ratio ** 2),
+            np.sqrt(1 - axis_ratio ** 2),
+            axis_ratio,
+            0.0,
+        )
+
+    elif profile_type == power_law:
+
+        slope = profile.slope - 1.0
+
+        einstein_radius = (
+            2.0 / (axis_ratio ** -0.5 + axis_ratio ** 0.5)
+        ) * profile.einstein_radius
+
+        b = einstein_radius * np.sqrt(axis_ratio)
+
+        amplitude = (
+            2.0
+            * b
+            / (1.0 + axis_ratio)
+            * b ** (slope - 1.0)
+            * ((1.0 + axis_ratio) / 2.0) ** (slope - 1.0)
+        )
+
+        constants = (
+            amplitude,
+            axis_ratio,
+            slope,
+            (1.0 - axis_ratio) / (1.0 + axis_ratio),
+        )
+
+    else:
+
+        constants = (profile.magnitude, 0.0, 0.0, 0.0)
+
+    return (
+        profile_type,
+        (centre[0], centre[1], cos_phi, sin_phi, radial_minimum) + constants,
+    )
+
+
+"""
+__Plane__
+
+The `PlaneFused` computes the profile types and parameters of its fused mass profiles once, when it is created. Its
+`deflections_from_grid` method creates the output array, passes it to the numba function and adds the deflection
+angles of any mass profiles which are not fused.
+"""
+
+
+class PlaneFused(al.Plane):
+    def __init__(self, redshift=None, galaxies=None):
+        """
+        A `Plane` whose deflection angles are computed by a single numba function for the mass profiles of every
+        galaxy which are an `EllipticalIsothermal`, `SphericalIsothermal`, `EllipticalPowerLaw`, `SphericalPowerLaw`
+        or `ExternalShear`.
+        """
+        super().__init__(redshift=redshift, galaxies=galaxies)
+
+        mass_profiles = [
+            profile for galaxy in self.galaxies for profile in galaxy.mass_profiles
+        ]
+
+        self.mass_profiles_unfused = [
+            profile
+            for profile in mass_profiles
+            if type(profile) not in fused_profile_types
+        ]
+
+        profile_types_and_parameters = [
+            parameters_from(profile=profile)
+            for profile in mass_profiles
+            if type(profile) in fused_profile_types
+        ]
+
+        self.profile_types = np.array(
+            [profile_type for profile_type, _ in profile_types_and_parameters],
+            dtype="int",
+        )
+        self.parameters = np.array(
+            [parameters for _, parameters in profile_types_and_parameters],
+            dtype="float",
+        ).reshape(-1, 9)
+
+    @grid_decorators.grid_like_to_structure
+    def deflections_from_grid(self, grid):
+
+        deflections = deflections_fused_into(
+            grid=np.asarray(grid),
+            profile_types=self.profile_types,
+            parameters=self.parameters,
+            deflections=np.zeros((grid.shape[0], 2)),
+        )
+
+        for profile in self.mass_profiles_unfused:
+            deflections += np.asarray(profile.deflections_from_grid(grid=grid))
+
+        return deflections
+
+
+class TracerFused(al.Tracer):
+    @classmethod
+    def from_tracer(cls, tracer):
+        """
+        Returns a `TracerFused` with the same galaxies and cosmology as a `Tracer`.
+        """
+        return cls(
+            planes=[
+                PlaneFused(redshift=plane.redshift, galaxies=plane.galaxies)
+                for plane in tracer.planes
+            ],
+            cosmology=tracer.cosmology,
+        )
+
+
+"""
+__Analysis__
+
+The `AnalysisFused` creates a `TracerFused` for every model instance.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisFused(a.Analysis):
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerFused.from_tracer(tracer=tracer)
+
+
+"""
+__Phase__
+
+The `PhaseImagingFused` uses the `AnalysisFused`, and can be used in place of the `PhaseImaging` in any pipeline.
+"""
+
+
+class PhaseImagingFused(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisFused(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Comparison__
+
+Lets check the fused and standard deflection angles are identical and compare how long each takes to compute, for
+an `EllipticalIsothermal` and `EllipticalPowerLaw` with an `ExternalShear`, on a 100 x 100 grid with a `sub_size`
+of 4. The first call of the numba function compiles it, so we call it once before timing it.
+"""
+grid = al.Grid2D.uniform(shape_native=(100, 100), pixel_scales=0.05, sub_size=4)
+
+external_shear = al.mp.ExternalShear(elliptical_comps=(0.05, 0.05))
+
+lens_galaxies = {
+    "sie_shear": al.Galaxy(
+        redshift=0.5,
+        mass=al.mp.EllipticalIsothermal(
+            centre=(0.0, 0.0),
+            einstein_radius=1.6,
+            elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+        ),
+        shear=external_shear,
+    ),
+    "power_law_shear": al.Galaxy(
+        redshift=0.5,
+        mass=al.mp.EllipticalPowerLaw(
+            centre=(0.0, 0.0),
+            einstein_radius=1.6,
+            elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.7, phi=45.0),
+            slope=2.2,
+        ),
+        shear=external_shear,
+    ),
+}
+
+repeats = 10
+
+for name, lens_galaxy in lens_galaxies.items():
+
+    plane = al.Plane(redshift=0.5, galaxies=[lens_galaxy])
+    plane_fused = PlaneFused(redshift=0.5, galaxies=[lens_galaxy])
+
+    deflections_fused = plane_fused.deflections_from_grid(grid=grid)
+
+    start = time.time()
+    for _ in range(repeats):
+        deflections_fused = plane_fused.deflections_from_grid(grid=grid)
+    print(f"{name} PlaneFused time = {(time.time() - start) / repeats} s")
+
+    start = time.time()
+    for _ in range(repeats):
+        deflections = plane.deflections_from_grid(grid=grid)
+    print(f"{name} Plane time = {(time.time() - start) / repeats} s")
+
+    print(
+        f"{name} maximum difference between deflection angles = ",
+        np.max(np.abs(np.asarray(deflections_fused) - np.asarray(deflections))),
+    )
+
+"""
+__Model-Fit__
+
+We now fit the `mass_sie__source_sersic` dataset with an `EllipticalIsothermal` and `ExternalShear` using the
+`PhaseImagingFused`.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+lens = al.GalaxyModel(
+    redshift=0.5, mass=al.mp.EllipticalIsothermal, shear=al.mp.ExternalShear
+)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+phase = PhaseImagingFused(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "fused_deflections"),
+        name="phase__mass_sie_shear__source_sersic",
+        n_live_points=50,
+    ),
+    settings=al.SettingsPhaseImaging(),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+result = phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,557 @@
+"""
+Performance: Galaxy Population
+==============================
+
+Simulations of strong lenses with realistic substructure include hundreds of dark matter subhalos in the lens galaxy
+and line-of-sight halos between the observer and source. In **PyAutoLens** every halo is a `Galaxy` with its own
+mass profile, and computing the deflection angles of a plane loops over every galaxy and every mass profile in
+Python, where each mass profile evaluates NumPy functions over the whole grid. For hundreds of halos this overhead,
+and the temporary arrays created for every halo, make simulations slow.
+
+This script shows a `MassProfileArray`, a mass profile which stores the parameters of N spherical profiles of the
+same type as arrays and computes their summed convergence and deflection angles in a single numba function, which
+loops over every (y,x) coordinate and profile. Arrays are provided for the following profiles (and their
+subclasses, e.g. the `SphericalNFWMCRLudlow` and `SphericalTruncatedNFWMCRLudlow`):
+
+ - `SphericalIsothermalArray`: `SphericalIsothermal` profiles.
+ - `SphericalNFWArray`: `SphericalNFW` profiles.
+ - `SphericalTruncatedNFWArray`: `SphericalTruncatedNFW` profiles.
+
+A `GalaxyPopulation` takes a list of galaxies (for example the subhalos and line-of-sight halos of a simulation) and
+combines every galaxy at the same redshift whose only profiles are these mass profiles into one `Galaxy` with a
+`MassProfileArray` for every profile type. The `Tracer` then has one galaxy per plane for the population.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from autoconf import conf
+import autolens as al
+from autoarray import decorator_util
+from autoarray.structures.grids import grid_decorators
+from autogalaxy.profiles.mass_profiles.dark_mass_profiles import (
+    kappa_s_and_scale_radius_for_ludlow,
+)
+
+"""
+__Kernels__
+
+The numba functions below compute the summed deflection angles and convergence of N spherical profiles of one type,
+which is specified by the integer `profile_type`:
+
+ - 0: `SphericalIsothermal`, with parameters (einstein_radius,).
+ - 1: `SphericalNFW`, with parameters (kappa_s, scale_radius).
+ - 2: `SphericalTruncatedNFW`, with parameters (kappa_s, scale_radius, truncation_radius).
+
+The parameters are passed as an ndarray of shape [total_profiles, total_parameters]. The expressions are those used
+by **PyAutoLens** for each profile.
+
+Coordinates closer to the centre of a profile than its radial minimum (see `config/grids/radial_minimum.ini`) are
+moved to the radial minimum, in the same way as the `relocate_to_radial_minimum` decorator of **PyAutoLens**.
+"""
+isothermal = 0
+nfw = 1
+truncated_nfw = 2
+
+
+@decorator_util.jit()
+def coord_func_f_from(eta):
+
+    if eta > 1.0:
+        return np.arccos(1.0 / eta) / np.sqrt(eta ** 2 - 1.0)
+    elif eta < 1.0:
+        return np.arccosh(1.0 / eta) / np.sqrt(1.0 - eta ** 2)
+
+    return 1.0
+
+
+@decorator_util.jit()
+def coord_func_g_from(eta):
+
+    if eta == 1.0:
+        return 1.0 / 3.0
+
+    return (1.0 - coord_func_f_from(eta=eta)) / (eta ** 2 - 1.0)
+
+
+@decorator_util.jit()
+def coord_func_k_from(eta, tau):
+    return np.log(eta / (np.sqrt(eta ** 2 + tau ** 2) + tau))
+
+
+@decorator_util.jit()
+def relocated_from(y, x, radial_minimum):
+    """
+    Returns the (y,x) coordinates of a point relative to a profile centre and its radius, after moving it to the
+    radial minimum if it is closer to the centre.
+    """
+    radius = np.sqrt(y ** 2 + x ** 2)
+
+    if radius == 0.0:
+        return radial_minimum, radial_minimum, np.sqrt(2.0) * radial_minimum
+    elif radius < radial_minimum:
+        return (
+            y * radial_minimum / radius,
+            x * radial_minimum / radius,
+            radial_minimum,
+        )
+
+    return y, x, radius
+
+
+@decorator_util.jit()
+def deflection_from(profile_type, parameters, radius):
+    """
+    Returns the magnitude of the deflection angle of a spherical profile at a radius from its centre.
+    """
+    if profile_type == isothermal:
+        return parameters[0]
+
+    kappa_s = parameters[0]
+    scale_radius = parameters[1]
+
+    eta = radius / scale_radius
+
+    if profile_type == nfw:
+        return (
+            4.0
+            * kappa_s
+            * scale_radius
+            * (np.log(eta / 2.0) + coord_func_f_from(eta=eta))
+            / eta
+        )
+
+    tau = parameters[2] / scale_radius
+
+    m = (tau ** 2 / (tau ** 2 + 1.0) ** 2) * (
+        (tau ** 2 + 2.0 * eta ** 2 - 1.0) * coord_func_f_from(eta=eta)
+        + np.pi * tau
+        + (tau ** 2 - 1.0) * np.log(tau)
+        + np.sqrt(eta ** 2 + tau ** 2)
+        * (((tau ** 2 - 1.0) / tau) * coord_func_k_from(eta=eta, tau=tau) - np.pi)
+    )
+
+    return 4.0 * kappa_s * scale_radius * m / eta
+
+
+@decorator_util.jit()
+def convergence_from(profile_type, parameters, radius):
+    """
+    Returns the convergence of a spherical profile at a radius from its centre.
+    """
+    if profile_type == isothermal:
+        return parameters[0] / (2.0 * radius)
+
+    kappa_s = parameters[0]
+    scale_radius = parameters[1]
+
+    eta = radius / scale_radius
+
+    if profile_type == nfw:
+        return 2.0 * kappa_s * coord_func_g_from(eta=eta)
+
+    tau = parameters[2] / scale_radius
+
+    l = (tau ** 2 / (tau ** 2 + 1.0) ** 2) * (
+        (tau ** 2 + 1.0) * coord_func_g_from(eta=eta)
+        + 2.0 * coord_func_f_from(eta=eta)
+        - np.pi / np.sqrt(tau ** 2 + eta ** 2)
+        + ((tau ** 2 - 1.0) / (tau * np.sqrt(tau ** 2 + eta ** 2)))
+        * coord_func_k_from(eta=eta, tau=tau)
+    )
+
+    return 2.0 * kappa_s * l
+
+
+@decorator_util.jit()
+def deflections_array_from(grid, centres, parameters, profile_type, radial_minimum):
+
+    deflections = np.zeros((grid.shape[0], 2))
+
+    for i in range(grid.shape[0]):
+        for j in range(centres.shape[0]):
+
+            y, x, radius = relocated_from(
+                y=grid[i, 0] - centres[j, 0],
+                x=grid[i, 1] - centres[j, 1],
+                radial_minimum=radial_minimum,
+            )
+
+            deflection = deflection_from(
+                profile_type=profile_type, parameters=parameters[j], radius=radius
+            )
+
+            deflections[i, 0] += deflection * y / radius
+            deflections[i, 1] += deflection * x / radius
+
+    return deflections
+
+
+@decorator_util.jit()
+def convergence_array_from(grid, centres, parameters, profile_type, radial_minimum):
+
+    convergence = np.zeros(grid.shape[0])
+
+    for i in range(grid.shape[0]):
+        for j in range(centres.shape[0]):
+
+            y, x, radius = relocated_from(
+                y=grid[i, 0] - centres[j, 0],
+                x=grid[i, 1] - centres[j, 1],
+                radial_minimum=radial_minimum,
+            )
+
+            convergence[i] += convergence_from(
+                profile_type=profile_type, parameters=parameters[j], radius=radius
+            )
+
+    return convergence
+
+
+"""
+__Mass Profile Arrays__
+
+A `MassProfileArray` is a `MassProfile`, so it is added to a `Galaxy` like any other mass profile. Its `profiles`
+property returns the individual **PyAutoLens** mass profiles it represents, which are used to compute its potential
+(which is only used for visualization).
+"""
+
+
+class MassProfileArray(al.mp.MassProfile):
+
+    profile_class = None
+    profile_type = None
+    parameter_names = ()
+
+    def __init__(self, centres, **parameters):
+        """
+        A collection of N spherical mass profiles of the same type, whose summed convergence and deflection angles are
+        computed by a single numba function.
+
+        Parameters
+        ----------
+        centres : np.ndarray
+            The (y,x) arc-second coordinates of the profile centres, with shape [N, 2].
+        parameters : np.ndarray
+            The parameters of the profiles (e.g. `kappa_s`), each of shape [N].
+        """
+        self.centres = np.asarray(centres, dtype="float").reshape(-1, 2)
+
+        for name in self.parameter_names:
+            setattr(self, name, np.asarray(parameters[name], dtype="float"))
+
+    @classmethod
+    def from_profiles(cls, profiles):
+        """
+        Returns the `MassProfileArray` of a list of **PyAutoLens** mass profiles of its `profile_class`.
+        """
+        return cls(
+            centres=[profile.centre for profile in profiles],
+            **{
+                name: [getattr(profile, name) for profile in profiles]
+                for name in cls.parameter_names
+            },
+        )
+
+    def __len__(self):
+        return self.centres.shape[0]
+
+    @property
+    def parameters(self):
+        return np.stack(
+            [getattr(self, name) for name in self.parameter_names], axis=1
+        )
+
+    @property
+    def radial_minimum(self):
+        return conf.instance["grids"]["radial_minimum"]["radial_minimum"][
+            self.profile_class.__name__
+        ]
+
+    @property
+    def profiles(self):
+        return [
+            self.profile_class(
+                centre=tuple(centre),
+                **{name: getattr(self, name)[index] for name in self.parameter_names},
+            )
+            for index, centre in enumerate(self.centres)
+        ]
+
+    @grid_decorators.grid_like_to_structure
+    def deflections_from_grid(self, grid):
+        return deflections_array_from(
+            grid=np.asarray(grid),
+            centres=self.centres,
+            parameters=self.parameters,
+            profile_type=self.profile_type,
+            radial_minimum=self.radial_minimum,
+        )
+
+    @grid_decorators.grid_like_to_structure
+    def convergence_from_grid(self, grid):
+        return convergence_array_from(
+            grid=np.asarray(grid),
+            centres=self.centres,
+            parameters=self.parameters,
+            profile_type=self.profile_type,
+            radial_minimum=self.radial_minimum,
+        )
+
+    @grid_decorators.grid_like_to_structure
+    def potential_from_grid(self, grid):
+        return sum(
+            np.asarray(profile.potential_from_grid(grid=grid))
+            for profile in self.profiles
+        )
+
+
+class SphericalIsothermalArray(MassProfileArray):
+
+    profile_class = al.mp.SphericalIsothermal
+    profile_type = isothermal
+    parameter_names = ("einstein_radius",)
+
+
+class SphericalNFWArray(MassProfileArray):
+
+    profile_class = al.mp.SphericalNFW
+    profile_type = nfw
+    parameter_names = ("kappa_s", "scale_radius")
+
+
+class SphericalTruncatedNFWArray(MassProfileArray):
+
+    profile_class = al.mp.SphericalTruncatedNFW
+    profile_type = truncated_nfw
+    parameter_names = ("kappa_s", "scale_radius", "truncation_radius")
+
+    @classmethod
+    def from_mcr_ludlow(cls, centres, masses_at_200, redshift_object, redshift_source):
+        """
+        Returns the `SphericalTruncatedNFWArray` of N `SphericalTruncatedNFWMCRLudlow` profiles, whose kappa_s,
+        scale radius and truncation radius are computed from their masses using the Ludlow mass-concentration
+        relation.
+        """
+        kappa_s, scale_radius, radius_at_200 = map(
+            np.array,
+            zip(
+                *[
+                    kappa_s_and_scale_radius_for_ludlow(
+                        mass_at_200=mass_at_200,
+                        redshift_object=redshift_object,
+                        redshift_source=redshift_source,
+                    )
+                    for mass_at_200 in masses_at_200
+                ]
+            ),
+        )
+
+        return cls(
+            centres=centres,
+            kappa_s=kappa_s,
+            scale_radius=scale_radius,
+            truncation_radius=2.0 * radius_at_200,
+        )
+
+
+"""
+__Galaxy Population__
+
+The `GalaxyPopulation` groups the mass profiles of its galaxies by redshift and profile type.
+
+A galaxy is only combined into the population's galaxies if every profile it has is one of these mass profiles, and
+it has no pixelization or hyper galaxy. Every other galaxy is returned unchanged.
+
+Every unique redshift is a separate plane of the `Tracer`, so for line-of-sight halos the speed up comes from placing
+the halos on a discrete set of plane redshifts (which is also how multi-plane simulations are normally set up).
+"""
+
+
+class GalaxyPopulation:
+
+    mass_profile_array_classes = {
+        "truncated_nfw": SphericalTruncatedNFWArray,
+        "nfw": SphericalNFWArray,
+        "isothermal": SphericalIsothermalArray,
+    }
+
+    def __init__(self, galaxies):
+        """
+        A population of galaxies, whose spherical mass profiles are combined into one `Galaxy` per redshift.
+
+        Parameters
+        ----------
+        galaxies : [al.Galaxy]
+            The galaxies of the population, for example subhalos and line-of-sight halos.
+        """
+        self.galaxies_unchanged = []
+
+        profiles_of_redshift = {}
+
+        for galaxy in galaxies:
+
+            names = self.array_names_from(galaxy=galaxy)
+
+            if names is None:
+                self.galaxies_unchanged.append(galaxy)
+                continue
+
+            profiles = profiles_of_redshift.setdefault(galaxy.redshift, {})
+
+            for name, profile in zip(names, galaxy.mass_profiles):
+                profiles.setdefault(name, []).append(profile)
+
+        self.galaxies_population = [
+            al.Galaxy(
+                redshift=redshift,
+                **{
+                    name: self.mass_profile_array_classes[name].from_profiles(
+                        profiles=profiles[name]
+                    )
+                    for name in profiles
+                },
+            )
+            for redshift, profiles in sorted(profiles_of_redshift.items())
+        ]
+
+    def array_names_from(self, galaxy):
+        """
+        Returns the name of the `MassProfileArray` every mass profile of a galaxy is combined into, or `None` if the
+        galaxy cannot be combined into the population.
+        """
+        if (
+            galaxy.has_light_profile
+            or galaxy.has_pixelization
+            or galaxy.has_hyper_galaxy
+            or not galaxy.has_mass_profile
+        ):
+            return None
+
+        names = []
+
+        for profile in galaxy.mass_profiles:
+
+            name = next(
+                (
+                    name
+                    for name, array_class in self.mass_profile_array_classes.items()
+                    if isinstance(profile, array_class.profile_class)
+                ),
+                None,
+            )
+
+            if name is None:
+                return None
+
+            names.append(name)
+
+        return names
+
+    @property
+    def galaxies(self):
+        return self.galaxies_population + self.galaxies_unchanged
+
+
+"""
+__Simulation__
+
+We now create a strong lens with 200 subhalos in the lens galaxy and 300 line-of-sight halos, which are placed on 6
+planes between the lens and source. Every halo is a `SphericalTruncatedNFWMCRLudlow` with a mass between 10^6 and
+10^9 solar masses.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.EllipticalSersic(
+        centre=(0.1, 0.1),
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=60.0),
+        intensity=0.3,
+        effective_radius=1.0,
+        sersic_index=2.5,
+    ),
+)
+
+np.random.seed(1)
+
+halo_redshifts = [0.5] * 200 + list(
+    np.random.choice([0.2, 0.3, 0.4, 0.6, 0.7, 0.8], size=300)
+)
+
+halo_galaxies = [
+    al.Galaxy(
+        redshift=redshift,
+        mass=al.mp.SphericalTruncatedNFWMCRLudlow(
+            centre=tuple(np.random.uniform(-3.0, 3.0, size=2)),
+            mass_at_200=10.0 ** np.random.uniform(6.0, 9.0),
+            redshift_object=redshift,
+            redshift_source=1.0,
+        ),
+    )
+    for redshift in halo_redshifts
+]
+
+population = GalaxyPopulation(galaxies=halo_galaxies)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy] + halo_galaxies)
+
+tracer_population = al.Tracer.from_galaxies(
+    galaxies=[lens_galaxy, source_galaxy] + population.galaxies
+)
+
+print(f"Galaxies = {len(tracer.galaxies)}")
+print(f"Galaxies Using Population = {len(tracer_population.galaxies)}")
+
+"""
+__Comparison__
+
+We compare the run time and traced source-plane grid of the two tracers on the grid of the `hst` dataset. The first
+call of the population compiles its numba functions, so we call it once before timing it.
+"""
+grid = al.Grid2D.uniform(shape_native=(180, 180), pixel_scales=0.05, sub_size=1)
+
+tracer_population.traced_grids_of_planes_from_grid(grid=grid)
+
+start = time.time()
+traced_grid = tracer.traced_grids_of_planes_from_grid(grid=grid)[-1]
+print(f"Tracer Time = {time.time() - start}")
+
+start = time.time()
+traced_grid_population = tracer_population.traced_grids_of_planes_from_grid(
+    grid=grid
+)[-1]
+print(f"Tracer Using Population Time = {time.time() - start}")
+
+print(
+    f"Maximum Difference of Source Plane Grids = {np.max(np.abs(traced_grid_population - traced_grid))}"
+)
+
+"""
+The population's tracer is used to simulate imaging in the same way as any other tracer, for example as in the
+script `imaging/simulators/no_lens_light/mass_sie__source_sersic__intervening_objects.py`.
+"""
+psf = al.Kernel2D.from_gaussian(
+    shape_native=(21, 21), sigma=0.05, pixel_scales=grid.pixel_scales
+)
+
+simulator = al.SimulatorImaging(
+    exposure_time=300.0, psf=psf, background_sky_level=0.1, add_poisson_noise=True
+)
+
+imaging = simulator.from_tracer_and_grid(tracer=tracer_population, grid=grid)
+
+"""
+Finish.
+"""
@@ -0,0 +1,350 @@
+"""
+Performance: Incremental Ray Tracing
+====================================
+
+In the multi-plane phase of the SLaM subhalo pipeline (`make_pipeline_multi_plane`) the redshift of the subhalo is a
+free parameter, therefore every model the non-linear search fits places the subhalo in a different plane. By default
+`Tracer.traced_grids_of_planes_from_grid` recomputes the deflection angles of every plane in every likelihood
+evaluation, even though the galaxies of the other planes are often unchanged.
+
+The deflection angles of a plane depend only on the galaxies in that plane and the grid traced to it, and the grid
+traced to a plane depends only on the planes in front of it. Therefore, if the first N planes of a `Tracer` contain
+the same mass profiles at the same redshifts as the `Tracer` of the previous likelihood evaluation, their traced
+grids and deflection angles are identical and only the planes from the first changed plane onwards need to be
+re-traced.
+
+This script shows a `Tracer` which caches the traced grids and deflection angles of every plane, and re-traces
+only the planes from the first plane whose mass model or redshift changed. For example, when the lens mass is fixed
+and the subhalo is behind the lens galaxy, the deflection angles of the lens galaxy are computed once for the whole
+phase, and only the deflection angles of the subhalo's plane are computed in every likelihood evaluation.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from autogalaxy.util import cosmology_util
+from cache_keys import plane_key_from
+
+"""
+__Plane Keys__
+
+The key of a plane is its redshift and the class name and parameter values of every mass profile of its galaxies.
+The light profiles of a galaxy do not change how it deflects light and are therefore not part of the key, so a
+source galaxy whose light profile parameters change does not cause any plane to be re-traced.
+
+The `id` every model component is given by **PyAutoFit** is unique to each instance (even when its parameters are
+identical) and is therefore not part of the key. The key is computed by the `plane_key_from` function of the
+`cache_keys.py` module, which is shared by the `performance` scripts that cache quantities of the mass model.
+"""
+
+
+"""
+__Tracer__
+
+The `TracerIncremental` extends the `Tracer`, overwriting the `traced_grids_of_planes_from_grid` method which is
+used by the `FitImaging` to trace the `grid`, `blurring_grid` and `grid_inversion`.
+
+For every grid it traces, the cache stores the keys of the planes, their traced grids and their deflection angles.
+When the same grid is traced again, the planes in front of the first plane whose key changed are reused. The
+deflection angles between two planes are scaled by a factor which depends on the redshift of the last plane, so if
+the last plane's redshift changes only the (unscaled) deflection angles of the first plane are reused.
+
+Its cache is a dictionary owned by the `Analysis`, therefore it persists over every likelihood evaluation of the
+phase. Cache entries are keyed by the `id` of the grid that is traced and also store the grid, so that a temporary
+grid whose `id` is reused by Python can never be paired with the wrong traced grids.
+"""
+
+
+class TracerIncremental(al.Tracer):
+    def __init__(self, planes, cosmology, cache):
+        """
+        A `Tracer` which caches the traced grids and deflection angles of every plane, re-tracing only the planes
+        from the first plane whose mass model or redshift is different to the tracer which last used the cache.
+
+        Parameters
+        ----------
+        cache : dict
+            The dictionary the traced grids and deflection angles are stored in.
+        """
+        super().__init__(planes=planes, cosmology=cosmology)
+
+        self.cache = cache
+
+    @property
+    def plane_keys(self):
+        return [plane_key_from(plane=plane) for plane in self.planes]
+
+    def total_planes_reused_from(self, plane_keys, cached_plane_keys):
+        """
+        Returns the number of planes at the front of the tracer whose traced grids and deflection angles can be
+        reused from the cache, which is the index of the first plane whose key differs from the cached tracer.
+        """
+        total_planes_reused = 0
+
+        for plane_key, cached_plane_key in zip(plane_keys, cached_plane_keys):
+            if plane_key != cached_plane_key:
+                break
+            total_planes_reused += 1
+
+        if plane_keys[-1][0] != cached_plane_keys[-1][0]:
+            total_planes_reused = min(total_planes_reused, 1)
+
+        return total_planes_reused
+
+    def traced_grids_of_planes_from_grid(self, grid, plane_index_limit=None):
+
+        plane_keys = self.plane_keys
+
+        traced_grids = []
+        traced_deflections = []
+
+        entry = self.cache.get(id(grid))
+
+        if entry is not None and entry["grid"] is grid:
+
+            total_planes_reused = self.total_planes_reused_from(
+                plane_keys=plane_keys, cached_plane_keys=entry["plane_keys"]
+            )
+
+            """
+            The deflection angles of the last plane are never computed, so its traced grid is always re-traced
+            (which only sums the scaled deflection angles of the planes in front of it).
+            """
+            total_planes_reused = min(
+                total_planes_reused, len(entry["traced_deflections"])
+            )
+
+            if plane_index_limit is not None:
+                total_planes_reused = min(total_planes_reused, plane_index_limit)
+
+            traced_grids = entry["traced_grids"][:total_planes_reused]
+            traced_deflections = entry["traced_deflections"][:total_planes_reused]
+
+        for plane_index in range(len(traced_grids), self.total_planes):
+
+            plane = self.planes[plane_index]
+
+            scaled_grid = grid.copy()
+
+            for previous_plane_index in range(plane_index):
+                scaling_factor = cosmology_util.scaling_factor_between_redshifts_from(
+                    redshift_0=self.plane_redshifts[previous_plane_index],
+                    redshift_1=plane.redshift,
+                    redshift_final=self.plane_redshifts[-1],
+                    cosmology=self.cosmology,
+                )
+
+                scaled_grid -= scaling_factor * traced_deflections[previous_plane_index]
+
+            traced_grids.append(scaled_grid)
+
+            if plane_index == plane_index_limit:
+                break
+
+            if plane_index < self.total_planes - 1:
+                traced_deflections.append(plane.deflections_from_grid(grid=scaled_grid))
+
+        self.cache[id(grid)] = {
+            "grid": grid,
+            "plane_keys": plane_keys,
+            "traced_grids": [traced_grid.copy() for traced_grid in traced_grids],
+            "traced_deflections": traced_deflections,
+        }
+
+        return [traced_grid.copy() for traced_grid in traced_grids]
+
+
+"""
+__Analysis__
+
+The `AnalysisIncremental` creates a `TracerIncremental` for every model instance, passing it the cache shared by
+the whole phase.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisIncremental(a.Analysis):
+    def __init__(self, masked_imaging, settings, cosmology, results=None):
+
+        super().__init__(
+            masked_imaging=masked_imaging,
+            settings=settings,
+            cosmology=cosmology,
+            results=results,
+        )
+
+        self.ray_tracing_cache = {}
+
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerIncremental(
+            planes=tracer.planes,
+            cosmology=tracer.cosmology,
+            cache=self.ray_tracing_cache,
+        )
+
+
+"""
+__Phase__
+
+The `PhaseImagingIncremental` uses the `AnalysisIncremental`, and can be used in place of the `PhaseImaging` in any
+pipeline.
+"""
+
+
+class PhaseImagingIncremental(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisIncremental(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `mass_sie__subhalo_nfw__source_sersic` dataset, which includes a dark matter subhalo near the lens
+galaxy's Einstein ring.
+"""
+dataset_name = "mass_sie__subhalo_nfw__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    pixel_scales=0.05,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Model__
+
+We fix the lens mass to the values used to simulate the dataset, as we would in the SLaM subhalo pipeline with
+`SetupSubhalo(mass_is_model=False)`.
+
+In `make_pipeline_multi_plane` the `redshift_object` of the subhalo's `SphericalNFWMCRLudlow` is a free parameter,
+which is used to convert its `mass_at_200` to the NFW parameters. To place the subhalo in its own plane of the
+`Tracer` we pair the subhalo galaxy's redshift with this parameter, and we give it a `UniformPrior` between the lens
+and source galaxies.
+"""
+lens = al.GalaxyModel(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+    shear=al.mp.ExternalShear(elliptical_comps=(0.05, 0.05)),
+)
+
+subhalo = al.GalaxyModel(redshift=0.5, mass=al.mp.SphericalNFWMCRLudlow)
+
+subhalo.mass.mass_at_200 = af.LogUniformPrior(lower_limit=1.0e6, upper_limit=1.0e11)
+subhalo.mass.centre_0 = af.UniformPrior(lower_limit=-3.0, upper_limit=3.0)
+subhalo.mass.centre_1 = af.UniformPrior(lower_limit=-3.0, upper_limit=3.0)
+subhalo.mass.redshift_source = 1.0
+subhalo.mass.redshift_object = af.UniformPrior(lower_limit=0.5, upper_limit=1.0)
+subhalo.redshift = subhalo.mass.redshift_object
+
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+settings = al.SettingsPhaseImaging()
+
+phase = PhaseImagingIncremental(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "incremental_ray_tracing"),
+        name="phase_subhalo_multi_plane",
+        n_live_points=50,
+    ),
+    settings=settings,
+    galaxies=af.CollectionPriorModel(lens=lens, subhalo=subhalo, source=source),
+)
+
+"""
+Before running the phase, lets check the incremental and standard traced grids are identical and compare how long
+each takes to trace the grid of the `MaskedImaging`, for a sequence of random models. Every model places the subhalo
+behind the lens galaxy, therefore the deflection angles of the lens plane are reused.
+
+Both tracers first trace the grid of one model which is not timed, so that neither time includes the compilation of
+the numba functions used to compute the deflection angles, and the incremental timings are those of a model-fit whose
+lens plane has already been traced.
+"""
+analysis = phase.make_analysis(dataset=imaging, mask=mask)
+
+grid = analysis.masked_imaging.grid
+
+instance = phase.model.random_instance()
+
+analysis.tracer_for_instance(instance=instance).traced_grids_of_planes_from_grid(
+    grid=grid
+)
+al.Tracer.from_galaxies(galaxies=instance.galaxies).traced_grids_of_planes_from_grid(
+    grid=grid
+)
+
+instances = [phase.model.random_instance() for _ in range(10)]
+
+tracers_incremental = [
+    analysis.tracer_for_instance(instance=instance) for instance in instances
+]
+tracers = [
+    al.Tracer.from_galaxies(galaxies=instance.galaxies) for instance in instances
+]
+
+start = time.time()
+traced_grids_incremental = [
+    tracer.traced_grids_of_planes_from_grid(grid=grid)
+    for tracer in tracers_incremental
+]
+print(f"Incremental traced grids time = {(time.time() - start) / len(instances)} s")
+
+start = time.time()
+traced_grids = [tracer.traced_grids_of_planes_from_grid(grid=grid) for tracer in tracers]
+print(f"Standard traced grids time = {(time.time() - start) / len(instances)} s")
+
+print(
+    "Maximum difference between traced source-plane grids = ",
+    max(
+        np.max(np.abs(grids_incremental[-1] - grids[-1]))
+        for grids_incremental, grids in zip(traced_grids_incremental, traced_grids)
+    ),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+The `PhaseImagingIncremental` can be used in the multi-plane phase of the SLaM subhalo pipeline by passing it as the
+`phase_class` of `af.as_grid_search`. Where the lens mass is also a free parameter (`mass_is_model=True`) the lens
+plane changes in every likelihood evaluation, so the tracer is re-traced from the first plane and the phase runs at
+the same speed as a `PhaseImaging`.
+
+Finish.
+"""
@@ -0,0 +1,331 @@
+"""
+Performance: Input Deflections Interpolation
+============================================
+
+The script `misc/input_deflections_model.py` fits sources through a fixed deflection angle map (e.g. from a particle
+simulation), using the `InputDeflections` mass profile. To compute the deflection angles of a grid, the
+`InputDeflections` interpolates the map using `scipy.interpolate.griddata`, which for every grid (and separately for
+the y and x deflection angles):
+
+ 1) Computes the Delaunay triangulation of the `image_plane_grid` of the deflection angle map.
+ 2) Finds the triangle every (y,x) coordinate of the grid is in, and its barycentric weights in that triangle.
+ 3) Interpolates the deflection angles using these weights.
+
+Only step 3 depends on the deflection angle values, and steps 1 and 2 dominate the run time. The `preload_grid`
+and `preload_blurring_grid` inputs avoid this for the two grids that are passed in advance, but every other grid (for
+example the grid of a `Pixelization`'s image-plane pixels, or a second `InputDeflections` with the same
+`image_plane_grid`) repeats the whole calculation.
+
+This script shows an `InputDeflectionsCached` mass profile, which:
+
+ - Computes the Delaunay triangulation of every `image_plane_grid` once, and shares it between every
+   `InputDeflectionsCached` whose `image_plane_grid` has the same (y,x) coordinates.
+
+ - Stores the triangle vertices and barycentric weights of every grid it is used with, such that the deflection
+   angles of a grid with the same (y,x) coordinates as a previous grid are a weighted sum of 3 values per coordinate.
+
+ - Can load its deflection angle maps as memory-mapped arrays, such that only the values at the vertices of the
+   triangles that are used are read from the .fits files, as opposed to the full maps being loaded into memory.
+
+The interpolation is identical to that of `scipy.interpolate.griddata`, which also uses the barycentric weights of
+the Delaunay triangulation.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from astropy.io import fits
+from scipy.spatial import Delaunay
+import autofit as af
+import autolens as al
+from autoarray.structures.grids import grid_decorators
+from autogalaxy import exc
+from cache_keys import grid_key_from
+
+"""
+__Grid Keys__
+
+Triangulations and interpolation weights are stored using a key made from the (y,x) coordinates of the grid they
+were computed for, so that any grid with identical coordinates reuses them (regardless of whether it is the same
+object). The key is made by `grid_key_from` of the shared `cache_keys.py` module.
+"""
+triangulations = {}
+
+
+def triangulation_from(image_plane_grid):
+    """
+    Returns the Delaunay triangulation of an `image_plane_grid`, which is computed once for every set of (y,x)
+    coordinates.
+    """
+    key = grid_key_from(grid=image_plane_grid)
+
+    if key not in triangulations:
+        triangulations[key] = Delaunay(np.asarray(image_plane_grid))
+
+    return triangulations[key]
+
+
+"""
+__Memory Mapping__
+
+A deflection angle map stored in a .fits file can be memory-mapped by **astropy**, in which case its values are only
+read from disk when they are indexed. The rows of a .fits file run from the bottom of the image to the top, so the
+map is flipped upside-down (in the same way as `Array2D.from_fits`), which is a view of the memory-map as opposed to
+a copy. Its values are then in the same order as the (y,x) coordinates of an unmasked `image_plane_grid` with
+`sub_size=1` (which is how the maps and grid of `misc/input_deflections_model.py` are made).
+
+Flattening the flipped map to 1D would copy it, so the values of the map are indexed using `flat`, which reads only
+the values at the indexes.
+"""
+
+
+def array_memmap_from_fits(file_path, hdu=0):
+    """
+    Returns the array of a .fits file as a 2D memory-mapped ndarray, flipped upside-down.
+
+    Closing the .fits file does not close its memory-map, which stays open for as long as the array is used.
+    """
+    with fits.open(file_path, memmap=True) as hdu_list:
+        return hdu_list[hdu].data[::-1]
+
+
+"""
+__Mass Profile__
+
+The `InputDeflectionsCached` extends the `InputDeflections`, overwriting its `deflections_from_grid` method. Its
+inputs are the same as the `InputDeflections`, and the `preload_grid` and `preload_blurring_grid` are no longer
+necessary (if input, their interpolation weights are computed when the profile is created).
+"""
+
+
+class InputDeflectionsCached(al.mp.InputDeflections):
+    def __init__(
+        self,
+        deflections_y,
+        deflections_x,
+        image_plane_grid,
+        preload_grid=None,
+        preload_blurring_grid=None,
+    ):
+        """
+        An `InputDeflections` which reuses the Delaunay triangulation of its `image_plane_grid` and the
+        interpolation weights of every grid it computes deflection angles for (the most recent 10 grids are
+        stored).
+        """
+        self.image_plane_grid = image_plane_grid
+        self.interpolations = {}
+        self.total_cached_interpolations = 10
+
+        super().__init__(
+            deflections_y=deflections_y,
+            deflections_x=deflections_x,
+            image_plane_grid=image_plane_grid,
+            preload_grid=preload_grid,
+            preload_blurring_grid=preload_blurring_grid,
+        )
+
+    @classmethod
+    def from_fits(
+        cls,
+        deflections_y_path,
+        deflections_x_path,
+        image_plane_grid,
+        hdu=0,
+        preload_grid=None,
+        preload_blurring_grid=None,
+    ):
+        """
+        Returns an `InputDeflectionsCached` whose deflection angle maps are memory-mapped from .fits files.
+        """
+        return cls(
+            deflections_y=array_memmap_from_fits(file_path=deflections_y_path, hdu=hdu),
+            deflections_x=array_memmap_from_fits(file_path=deflections_x_path, hdu=hdu),
+            image_plane_grid=image_plane_grid,
+            preload_grid=preload_grid,
+            preload_blurring_grid=preload_blurring_grid,
+        )
+
+    def interpolation_from(self, grid):
+        """
+        Returns the indexes of the `image_plane_grid` coordinates at the vertices of the triangle every (y,x)
+        coordinate of a grid is in, and their barycentric weights.
+        """
+        key = grid_key_from(grid=grid)
+
+        if key in self.interpolations:
+            return self.interpolations[key]
+
+        triangulation = triangulation_from(image_plane_grid=self.image_plane_grid)
+
+        grid = np.asarray(grid)
+
+        simplices = triangulation.find_simplex(grid)
+
+        if np.any(simplices == -1):
+            raise exc.ProfileException(
+                "The grid input into the InputDeflectionsCached.deflections_from_grid() method has (y,x) "
+                "coodinates extending beyond the input image_plane_grid. "
+                ""
+                "Update the image_plane_grid to include deflection angles reaching to larger "
+                "radii or reduce the input grid. "
+            )
+
+        transforms = triangulation.transform[simplices]
+
+        barycentric = np.einsum(
+            "ijk,ik->ij", transforms[:, :2, :], grid - transforms[:, 2, :]
+        )
+
+        weights = np.hstack(
+            (barycentric, 1.0 - np.sum(barycentric, axis=1, keepdims=True))
+        )
+
+        if len(self.interpolations) >= self.total_cached_interpolations:
+            del self.interpolations[next(iter(self.interpolations))]
+
+        self.interpolations[key] = (triangulation.simplices[simplices], weights)
+
+        return self.interpolations[key]
+
+    @grid_decorators.grid_like_to_structure
+    def deflections_from_grid(self, grid):
+
+        vertices, weights = self.interpolation_from(grid=grid)
+
+        deflections_y = np.sum(
+            weights * np.asarray(self.deflections_y).flat[vertices], axis=1
+        )
+        deflections_x = np.sum(
+            weights * np.asarray(self.deflections_x).flat[vertices], axis=1
+        )
+
+        return self.normalization_scale * np.stack(
+            (deflections_y, deflections_x), axis=-1
+        )
+
+
+"""
+__Dataset__
+
+We use the same dataset, deflection angle maps and image-plane grid as `misc/input_deflections_model.py`.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native,
+    pixel_scales=imaging.pixel_scales,
+    radius=3.0,
+    sub_size=2,
+)
+
+grid = al.Grid2D.from_mask(mask=mask)
+
+image_plane_grid = al.Grid2D.uniform(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, sub_size=1
+)
+
+deflections_y = al.Array2D.from_fits(
+    file_path=path.join("dataset", "misc", "deflections_y.fits"),
+    pixel_scales=imaging.pixel_scales,
+)
+deflections_x = al.Array2D.from_fits(
+    file_path=path.join("dataset", "misc", "deflections_x.fits"),
+    pixel_scales=imaging.pixel_scales,
+)
+
+input_deflections = al.mp.InputDeflections(
+    deflections_y=deflections_y,
+    deflections_x=deflections_x,
+    image_plane_grid=image_plane_grid,
+)
+
+input_deflections_cached = InputDeflectionsCached.from_fits(
+    deflections_y_path=path.join("dataset", "misc", "deflections_y.fits"),
+    deflections_x_path=path.join("dataset", "misc", "deflections_x.fits"),
+    image_plane_grid=image_plane_grid,
+)
+
+"""
+The memory-mapped deflection angle maps have the same values in the same order as those loaded by `Array2D.from_fits`.
+"""
+assert np.array_equal(
+    np.asarray(input_deflections_cached.deflections_y).ravel(),
+    np.asarray(deflections_y.slim),
+)
+assert np.array_equal(
+    np.asarray(input_deflections_cached.deflections_x).ravel(),
+    np.asarray(deflections_x.slim),
+)
+
+"""
+Lets check the cached and standard deflection angles are identical and compare how long each takes to compute. The
+first call of the `InputDeflectionsCached` computes the triangulation and interpolation weights, which every
+subsequent call reuses.
+"""
+repeats = 10
+
+start = time.time()
+deflections_cached = input_deflections_cached.deflections_from_grid(grid=grid)
+print(f"InputDeflectionsCached first call time = {time.time() - start} s")
+
+start = time.time()
+for _ in range(repeats):
+    deflections_cached = input_deflections_cached.deflections_from_grid(grid=grid)
+print(f"InputDeflectionsCached time = {(time.time() - start) / repeats} s")
+
+start = time.time()
+for _ in range(repeats):
+    deflections = input_deflections.deflections_from_grid(grid=grid)
+print(f"InputDeflections time = {(time.time() - start) / repeats} s")
+
+print(
+    "Maximum difference between deflection angles = ",
+    np.max(np.abs(deflections_cached - deflections)),
+)
+
+assert np.allclose(deflections_cached, deflections, rtol=0.0, atol=1e-8)
+
+"""
+__Model-Fit__
+
+We now fit the source using the `InputDeflectionsCached`, as in `misc/input_deflections_model.py`. As the
+interpolation weights of every grid are computed once, the `preload_grid` and `preload_blurring_grid` are not
+passed.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=input_deflections_cached)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+settings_masked_imaging = al.SettingsMaskedImaging(
+    grid_class=al.Grid2D, sub_size=mask.sub_size
+)
+
+settings = al.SettingsPhaseImaging(settings_masked_imaging=settings_masked_imaging)
+
+phase = al.PhaseImaging(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "input_deflections_interpolation"),
+        name="phase__input_deflections_cached",
+        n_live_points=100,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=settings,
+)
+
+result = phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,120 @@
+"""
+Inversion Operators
+===================
+
+The sparse PSF blurring operators and linear solve shared by the `performance` scripts which compute the likelihood
+of imaging data outside of a `FitImaging` or `InversionImagingMatrix` (e.g. `batched_likelihood.py`,
+`sparse_mapping_matrix.py`, `w_tilde_curvature.py` and `single_precision.py`).
+
+The PSF convolution of a `Convolver` is stored as 'frames', which pair every image (or blurring) pixel with the image
+pixels its light is blurred into and the PSF value of every pairing. The blurring operators below are the same
+frames stored as a sparse matrix of dimensions [image_pixels, pixels], such that blurring an image (or every column of
+a mapping matrix) is one sparse matrix multiplication. They give identical results to the `Convolver`.
+
+The operators of a `Convolver` are created once and stored, as the `Convolver` of a `MaskedImaging` is the same for
+every fit. Only the most recent `max_blurring_operators` convolvers are stored.
+"""
+import numpy as np
+from collections import OrderedDict
+from scipy import sparse
+from autoarray import exc
+
+blurring_operators = OrderedDict()
+
+max_blurring_operators = 10
+
+
+def operator_from_frames(
+    frame_1d_indexes, frame_1d_kernels, frame_1d_lengths, total_image_pixels
+):
+    """
+    Returns the sparse matrix which maps values in a set of (image or blurring) pixels to the image pixels they are
+    blurred into by the PSF, using the frames computed by a `Convolver`.
+
+    Parameters
+    ----------
+    frame_1d_indexes : np.ndarray
+        The image pixel indexes every pixel's light is blurred into, of shape [total_pixels, kernel_max_size].
+    frame_1d_kernels : np.ndarray
+        The PSF kernel value paired with every entry of `frame_1d_indexes`.
+    frame_1d_lengths : np.ndarray
+        The number of entries of every frame which are used (frames at the edge of the mask are shorter).
+    total_image_pixels : int
+        The number of unmasked image pixels, which is the number of rows of the operator.
+    """
+    in_frame = (
+        np.arange(frame_1d_indexes.shape[1])[None, :] < frame_1d_lengths[:, None]
+    )
+
+    return sparse.csr_matrix(
+        (
+            frame_1d_kernels[in_frame],
+            (
+                frame_1d_indexes[in_frame],
+                np.repeat(np.arange(frame_1d_indexes.shape[0]), frame_1d_lengths),
+            ),
+        ),
+        shape=(total_image_pixels, frame_1d_indexes.shape[0]),
+    )
+
+
+def blurring_operators_from(convolver):
+    """
+    Returns the sparse PSF blurring operators of a `Convolver`, which blur the light in the image pixels and in the
+    blurring pixels (respectively) into the image pixels.
+    """
+    key = id(convolver)
+
+    if key in blurring_operators and blurring_operators[key][0] is convolver:
+        blurring_operators.move_to_end(key)
+        return blurring_operators[key][1]
+
+    operators = (
+        operator_from_frames(
+            frame_1d_indexes=convolver.image_frame_1d_indexes,
+            frame_1d_kernels=convolver.image_frame_1d_kernels,
+            frame_1d_lengths=convolver.image_frame_1d_lengths,
+            total_image_pixels=convolver.pixels_in_mask,
+        ),
+        operator_from_frames(
+            frame_1d_indexes=convolver.blurring_frame_1d_indexes,
+            frame_1d_kernels=convolver.blurring_frame_1d_kernels,
+            frame_1d_lengths=convolver.blurring_frame_1d_lengths,
+            total_image_pixels=convolver.pixels_in_mask,
+        ),
+    )
+
+    blurring_operators[key] = (convolver, operators)
+
+    if len(blurring_operators) > max_blurring_operators:
+        blurring_operators.popitem(last=False)
+
+    return operators
+
+
+def blurring_operator_from(convolver):
+    """
+    Returns the sparse PSF blurring operator of a `Convolver` of dimensions [image_pixels, image_pixels], whose columns
+    are the PSF centred on every image pixel (including only the image pixels in the mask). This is the operator which
+    blurs a mapping matrix.
+    """
+    return blurring_operators_from(convolver=convolver)[0]
+
+
+def reconstruction_from(curvature_reg_matrix, data_vector, check_solution=True):
+    """
+    Returns the reconstruction which solves the linear system of an `Inversion`, raising an `InversionException` in
+    the same circumstances as the `InversionImagingMatrix` (the matrix is singular, or `check_solution` is `True` and
+    every reconstructed value is the same).
+    """
+    try:
+        values = np.linalg.solve(curvature_reg_matrix, data_vector)
+    except np.linalg.LinAlgError:
+        raise exc.InversionException()
+
+    if check_solution:
+        if np.isclose(a=values[0], b=values[1], atol=1e-4).all():
+            if np.isclose(a=values[0], b=values, atol=1e-4).all():
+                raise exc.InversionException()
+
+    return values
@@ -0,0 +1,479 @@
+"""
+Performance: Likelihood Profiling
+=================================
+
+When a phase is slow, it is not clear where the time of each likelihood evaluation goes: is it the deflection
+angles of the mass model, the light profile images, the PSF convolution, or the matrices of the `Inversion`? This
+determines whether the fit is sped up by reducing the `sub_size`, using a `Grid2DInterpolate` or changing the
+`Pixelization`.
+
+This script shows a `LikelihoodProfiler`, which records the time spent in every stage of a `FitImaging` or
+`FitInterferometer`:
+
+ - `deflections`: The deflection angles of every plane, used to ray-trace the grids.
+ - `light_profile_images`: The images of the light profiles of every plane.
+ - `convolution`: The PSF convolution of the light profile images (imaging only).
+ - `fourier_transform`: The Fourier transform of the light profile images to visibilities (interferometer only).
+ - `mapping_matrix`: The source-plane pixelization grid, mapper and mapping matrix of an `Inversion`.
+ - `blurred_mapping_matrix`: The PSF convolution (or Fourier transform) of the mapping matrix.
+ - `data_vector`, `curvature_matrix`, `regularization_matrix`: The matrices of the `Inversion`'s linear algebra.
+ - `linear_solve`: The solution of the `Inversion`'s linear system.
+ - `log_determinants`: The Cholesky decompositions which give the log determinants of the Bayesian evidence.
+ - `other`: Everything else, for example the residuals and chi-squared.
+
+Time spent in a stage which is called within another stage (e.g. the deflection angles used to trace the
+pixelization grid of a mapper) is only counted for the inner stage, such that the times of all stages sum to the
+total time of the fit.
+
+Profiling is turned on for phases by setting `profile_likelihood=True` in the `[profiling]` section of
+`config/general.ini`, in which case the cumulative and per-call timings are output to the file `profiling.json` in
+the phase's output folder (alongside `model.results`) every `iterations_per_update` likelihood evaluations.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import json
+import time
+import numpy as np
+from contextlib import contextmanager
+from os import path
+from autoconf import conf
+import autofit as af
+import autolens as al
+from autoarray.inversion import inversions as inv, inversion_util
+
+"""
+__Profiler__
+
+The profiler times a stage by temporarily replacing the **PyAutoLens** functions which perform it with a timed
+version of that function. The functions are only replaced whilst a fit is profiled, and are restored afterwards, so
+profiling has no effect on any other calculation.
+"""
+profiled_functions = [
+    ("deflections", al.Plane, "deflections_from_grid"),
+    ("light_profile_images", al.Plane, "image_from_grid"),
+    ("convolution", al.Convolver, "convolved_image_from_image_and_blurring_image"),
+    ("fourier_transform", al.TransformerDFT, "visibilities_from_image"),
+    ("fourier_transform", al.TransformerNUFFT, "visibilities_from_image"),
+    ("mapping_matrix", al.Tracer, "mappers_of_planes_from_grid"),
+    ("blurred_mapping_matrix", al.Convolver, "convolve_mapping_matrix"),
+    (
+        "blurred_mapping_matrix",
+        al.TransformerDFT,
+        "transformed_mapping_matrix_from_mapping_matrix",
+    ),
+    (
+        "blurred_mapping_matrix",
+        al.TransformerNUFFT,
+        "transformed_mapping_matrix_from_mapping_matrix",
+    ),
+    ("data_vector", inversion_util, "data_vector_via_blurred_mapping_matrix_from"),
+    ("data_vector", inversion_util, "data_vector_via_transformed_mapping_matrix_from"),
+    ("curvature_matrix", inversion_util, "curvature_matrix_via_mapping_matrix_from"),
+    ("regularization_matrix", al.reg.Constant, "regularization_matrix_from_mapper"),
+    (
+        "regularization_matrix",
+        al.reg.AdaptiveBrightness,
+        "regularization_matrix_from_mapper",
+    ),
+    ("linear_solve", inv.InversionImagingMatrix, "from_data_mapper_and_regularization"),
+    (
+        "linear_solve",
+        inv.InversionInterferometerMatrix,
+        "from_data_mapper_and_regularization",
+    ),
+    (
+        "linear_solve",
+        inv.InversionInterferometerLinearOperator,
+        "from_data_mapper_and_regularization",
+    ),
+    ("log_determinants", inv, "log_determinant_of_matrix_cholesky"),
+]
+
+
+class LikelihoodProfiler:
+    def __init__(self):
+        """
+        Records the time spent in every stage of the likelihood function, cumulatively over every profiled call and
+        for the last profiled call.
+        """
+        self.stages = list(dict.fromkeys(stage for stage, _, _ in profiled_functions))
+        self.stages.append("other")
+
+        self.total_calls = 0
+        self.total_time = 0.0
+        self.cumulative_times = {stage: 0.0 for stage in self.stages}
+        self.last_call_times = {stage: 0.0 for stage in self.stages}
+
+        self._stage_stack = []
+        self._stage_start = None
+
+    def enter_stage(self, stage):
+
+        now = time.perf_counter()
+
+        if len(self._stage_stack) > 0:
+            self.last_call_times[self._stage_stack[-1]] += now - self._stage_start
+
+        self._stage_stack.append(stage)
+        self._stage_start = now
+
+    def exit_stage(self):
+
+        now = time.perf_counter()
+
+        self.last_call_times[self._stage_stack.pop()] += now - self._stage_start
+        self._stage_start = now
+
+    def timed(self, stage, func):
+        """
+        Returns the function wrapped such that the time spent in it (excluding any stage called within it) is added
+        to the stage.
+        """
+
+        def wrapper(*args, **kwargs):
+
+            self.enter_stage(stage=stage)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit_stage()
+
+        return wrapper
+
+    @contextmanager
+    def profile(self):
+        """
+        Profile every call of a profiled function within the context, for example:
+
+            with profiler.profile():
+                fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+                fit.figure_of_merit
+        """
+        originals = []
+
+        for stage, owner, name in profiled_functions:
+
+            original = owner.__dict__.get(name)
+            originals.append((owner, name, original))
+
+            if isinstance(original, classmethod):
+                setattr(
+                    owner,
+                    name,
+                    classmethod(self.timed(stage=stage, func=original.__func__)),
+                )
+            else:
+                setattr(owner, name, self.timed(stage=stage, func=getattr(owner, name)))
+
+        self.last_call_times = {stage: 0.0 for stage in self.stages}
+
+        start = time.perf_counter()
+        self.enter_stage(stage="other")
+
+        try:
+            yield self
+        finally:
+
+            self.exit_stage()
+            call_time = time.perf_counter() - start
+
+            for owner, name, original in originals[::-1]:
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+
+            self.total_calls += 1
+            self.total_time += call_time
+
+            for stage in self.stages:
+                self.cumulative_times[stage] += self.last_call_times[stage]
+
+    @property
+    def times_per_call(self):
+        return {
+            stage: self.cumulative_times[stage] / max(self.total_calls, 1)
+            for stage in self.stages
+        }
+
+    def output_to_json(self, file_path):
+        """
+        Output the cumulative times, mean times per call and last call times of every stage to a .json file.
+        """
+        with open(file_path, "w+") as f:
+            json.dump(
+                {
+                    "total_calls": self.total_calls,
+                    "total_time": self.total_time,
+                    "time_per_call": self.total_time / max(self.total_calls, 1),
+                    "cumulative_times": self.cumulative_times,
+                    "times_per_call": self.times_per_call,
+                    "last_call_times": self.last_call_times,
+                },
+                f,
+                indent=4,
+            )
+
+    def summary(self):
+
+        lines = [
+            f"Likelihood Profiling ({self.total_calls} calls, "
+            f"{self.total_time / max(self.total_calls, 1)} s per call):"
+        ]
+
+        for stage, time_per_call in self.times_per_call.items():
+            fraction = self.cumulative_times[stage] / max(self.total_time, 1e-30)
+            lines.append(f"    {stage} = {time_per_call} s ({100.0 * fraction:.1f}%)")
+
+        return "\n".join(lines)
+
+
+"""
+__Analysis__
+
+The analysis of an imaging and interferometer phase are extended such that, if `profile_likelihood=True` in
+`config/general.ini`, every likelihood evaluation is profiled. The profiling results are output every
+`iterations_per_update` likelihood evaluations and when the phase finishes (when `visualize` is called with
+`during_analysis=False`).
+
+The output path and `iterations_per_update` of the search are passed to the analysis by the phase.
+"""
+from autolens.pipeline.phase.imaging import analysis as a_imaging
+from autolens.pipeline.phase.interferometer import analysis as a_interferometer
+
+
+class AnalysisProfilingMixin:
+
+    paths = None
+    iterations_per_update = None
+
+    @property
+    def profiler(self):
+
+        if not conf.instance["general"]["profiling"]["profile_likelihood"]:
+            return None
+
+        if not hasattr(self, "_profiler"):
+            self._profiler = LikelihoodProfiler()
+
+        return self._profiler
+
+    def output_profiling(self):
+
+        if self.paths is None:
+            return
+
+        self.profiler.output_to_json(
+            file_path=path.join(self.paths.output_path, "profiling.json")
+        )
+
+    def log_likelihood_function(self, instance):
+
+        profiler = self.profiler
+
+        if profiler is None:
+            return super().log_likelihood_function(instance=instance)
+
+        with profiler.profile():
+            log_likelihood = super().log_likelihood_function(instance=instance)
+
+        if self.iterations_per_update is not None:
+            if profiler.total_calls % self.iterations_per_update == 0:
+                self.output_profiling()
+
+        return log_likelihood
+
+    def visualize(self, paths, instance, during_analysis):
+
+        super().visualize(
+            paths=paths, instance=instance, during_analysis=during_analysis
+        )
+
+        if self.profiler is not None and not during_analysis:
+            self.output_profiling()
+
+
+class AnalysisImagingProfiling(AnalysisProfilingMixin, a_imaging.Analysis):
+    pass
+
+
+class AnalysisInterferometerProfiling(
+    AnalysisProfilingMixin, a_interferometer.Analysis
+):
+    pass
+
+
+"""
+__Phase__
+
+The phases use the profiling analysis classes, and pass them the output path and `iterations_per_update` of their
+search.
+"""
+
+
+class PhaseImagingProfiling(al.PhaseImaging):
+
+    Analysis = AnalysisImagingProfiling
+
+    def make_analysis(self, dataset, mask, results=None):
+
+        analysis = super().make_analysis(dataset=dataset, mask=mask, results=results)
+
+        analysis.paths = self.search.paths
+        analysis.iterations_per_update = self.search.iterations_per_update
+
+        return analysis
+
+
+class PhaseInterferometerProfiling(al.PhaseInterferometer):
+
+    Analysis = AnalysisInterferometerProfiling
+
+    def make_analysis(self, dataset, mask, results=None):
+
+        analysis = super().make_analysis(dataset=dataset, mask=mask, results=results)
+
+        analysis.paths = self.search.paths
+        analysis.iterations_per_update = self.search.iterations_per_update
+
+        return analysis
+
+
+"""
+__Imaging__
+
+We first profile fits to the `mass_sie__source_sersic` imaging dataset directly, which does not require profiling to
+be turned on in the config. We profile a parametric source and a `VoronoiMagnification` source.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+masked_imaging = al.MaskedImaging(
+    imaging=imaging, mask=mask, settings=al.SettingsMaskedImaging(sub_size=2)
+)
+
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+)
+
+source_galaxy_parametric = al.Galaxy(
+    redshift=1.0,
+    bulge=al.lp.EllipticalSersic(
+        centre=(0.1, 0.1),
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=60.0),
+        intensity=0.3,
+        effective_radius=1.0,
+        sersic_index=2.5,
+    ),
+)
+
+source_galaxy_inversion = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification(shape=(30, 30)),
+    regularization=al.reg.Constant(coefficient=1.0),
+)
+
+for source_galaxy in [source_galaxy_parametric, source_galaxy_inversion]:
+
+    tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+    profiler = LikelihoodProfiler()
+
+    for _ in range(10):
+        with profiler.profile():
+            al.FitImaging(masked_imaging=masked_imaging, tracer=tracer).figure_of_merit
+
+    print(profiler.summary())
+
+"""
+__Interferometer__
+
+We next profile a fit to the `mass_sie__source_sersic` interferometer dataset, using a `VoronoiMagnification` source
+and both the `TransformerDFT` and `TransformerNUFFT`.
+"""
+dataset_path = path.join("dataset", "interferometer", dataset_name)
+
+interferometer = al.Interferometer.from_fits(
+    visibilities_path=path.join(dataset_path, "visibilities.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    uv_wavelengths_path=path.join(dataset_path, "uv_wavelengths.fits"),
+)
+
+real_space_mask = al.Mask2D.circular(
+    shape_native=(200, 200), pixel_scales=0.05, radius=3.0
+)
+
+visibilities_mask = np.full(fill_value=False, shape=interferometer.visibilities.shape)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy_inversion])
+
+for transformer_class in [al.TransformerDFT, al.TransformerNUFFT]:
+
+    masked_interferometer = al.MaskedInterferometer(
+        interferometer=interferometer,
+        visibilities_mask=visibilities_mask,
+        real_space_mask=real_space_mask,
+        settings=al.SettingsMaskedInterferometer(transformer_class=transformer_class),
+    )
+
+    profiler = LikelihoodProfiler()
+
+    for _ in range(3):
+        with profiler.profile():
+            al.FitInterferometer(
+                masked_interferometer=masked_interferometer, tracer=tracer
+            ).figure_of_merit
+
+    print(transformer_class.__name__)
+    print(profiler.summary())
+
+"""
+__Phase__
+
+To profile every likelihood evaluation of a phase, set `profile_likelihood=True` in the `[profiling]` section of
+`config/general.ini`. The file `profiling.json` is then output to the folder:
+
+ `autolens_workspace/output/performance/likelihood_profiling/phase_profiling`
+
+If `profile_likelihood=False` (the default) the phase below runs without profiling.
+"""
+
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+phase = PhaseImagingProfiling(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "likelihood_profiling"),
+        name="phase_profiling",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=al.SettingsPhaseImaging(),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
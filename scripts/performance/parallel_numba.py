@@ -0,0 +1,613 @@
+"""
+Performance: Parallel Numba
+===========================
+
+The `[numba]` section of `config/general.ini` has a `parallel` option, however the functions which compute the
+deflection angles, convergence and images of **PyAutoLens**'s mass and light profiles loop over the (y,x)
+coordinates of a grid serially. On a computer with many cores, a fit to a large mask therefore uses one core for
+every likelihood evaluation.
+
+This script shows parallel versions of the most commonly used profiles, whose calculations are performed by numba
+functions that loop over the grid using `numba.prange`, such that the coordinates are split over multiple threads:
+
+ - `EllipticalIsothermalParallel`: Analytic deflection angles of the `EllipticalIsothermal`.
+ - `EllipticalCoredPowerLawParallel`: Deflection angles and convergence of the `EllipticalCoredPowerLaw`, where the
+   deflection angle integral (computed by **PyAutoLens** using `quad_grid`) is evaluated via Gauss-Legendre quadrature.
+ - `EllipticalNFWParallel`: Deflection angles of the `EllipticalNFW`, again computed via Gauss-Legendre quadrature.
+ - `EllipticalSersicParallel`: The image of the `EllipticalSersic` light profile.
+
+These profiles are used in a lens model the same way as their standard counterparts.
+
+A phase can be run with both multiple processes (the `number_of_cores` of its non-linear search, where every
+process evaluates a different lens model) and multiple threads (which evaluate each likelihood evaluation in
+parallel). The number of threads is set via the `number_of_threads` input of the `SettingsPhaseImagingParallel`,
+which if not set defaults to the number of cores of the computer divided by the `number_of_cores` of the search.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import os
+import time
+import numba
+import numpy as np
+from os import path
+from autoconf import conf
+import autofit as af
+import autolens as al
+from autoarray.structures.grids import grid_decorators
+
+"""
+__Numba__
+
+The parallel functions always use `parallel=True`, but otherwise use the `nopython` and `cache` settings of the
+`[numba]` section of `config/general.ini`.
+
+The number of threads the parallel functions use is set via `numba.set_num_threads`, and cannot exceed the number
+of threads numba was launched with (`numba.config.NUMBA_NUM_THREADS`, which defaults to the number of cores).
+"""
+nopython = conf.instance["general"]["numba"]["nopython"]
+cache = conf.instance["general"]["numba"]["cache"]
+
+
+def jit_parallel():
+    def wrapper(func):
+        return numba.jit(func, nopython=nopython, cache=cache, parallel=True)
+
+    return wrapper
+
+
+"""
+__Quadrature__
+
+The deflection angles of the `EllipticalCoredPowerLaw` and `EllipticalNFW` are integrals over a variable u between
+0 and 1. **PyAutoLens** computes these with adaptive quadrature (`quad_grid`), which evaluates the integrand a
+different number of times for every coordinate. For the parallel functions we instead use a fixed number of
+Gauss-Legendre quadrature points, so that every coordinate performs the same calculation.
+
+The integrands diverge at u=0 (where they behave as u to the power -(slope - 1) / 2 for a power-law with a small
+core radius), which Gauss-Legendre quadrature integrates poorly. We therefore change the variable of integration
+to t, where u = t ** power, which removes this divergence for a suitable power.
+"""
+
+
+def quadrature_from(total_points, power):
+    """
+    Returns the values of the integration variable u and their weights for Gauss-Legendre quadrature between u=0 and
+    u=1, after the change of variable u = t ** power (the weights include the term du / dt).
+
+    Parameters
+    ----------
+    total_points : int
+        The number of Gauss-Legendre quadrature points.
+    power : float
+        The power of the change of variable u = t ** power.
+    """
+    t, weights = np.polynomial.legendre.leggauss(total_points)
+
+    t = 0.5 * (t + 1.0)
+    weights = 0.5 * weights
+
+    return t ** power, weights * power * t ** (power - 1.0)
+
+
+"""
+__Kernels__
+
+The numba functions below compute the deflection angles, convergence and images of each profile in parallel. They
+take as input a grid that has been transformed to the reference frame of the profile, and return deflection angles
+that have been rotated back to the original reference frame (using the profile's `cos_phi` and `sin_phi`).
+"""
+
+
+@jit_parallel()
+def deflections_isothermal_parallel_from(grid, axis_ratio, factor, cos_phi, sin_phi):
+
+    deflections = np.zeros((grid.shape[0], 2))
+
+    q_factor = np.sqrt(1.0 - axis_ratio ** 2)
+
+    for i in numba.prange(grid.shape[0]):
+
+        psi = np.sqrt(axis_ratio ** 2 * grid[i, 1] ** 2 + grid[i, 0] ** 2)
+
+        deflection_y = factor * np.arctanh(q_factor * grid[i, 0] / psi)
+        deflection_x = factor * np.arctan(q_factor * grid[i, 1] / psi)
+
+        deflections[i, 0] = deflection_x * sin_phi + deflection_y * cos_phi
+        deflections[i, 1] = deflection_x * cos_phi - deflection_y * sin_phi
+
+    return deflections
+
+
+@jit_parallel()
+def deflections_cored_power_law_parallel_from(
+    grid,
+    axis_ratio,
+    slope,
+    core_radius,
+    einstein_radius_rescaled,
+    quadrature_u,
+    quadrature_weights,
+    cos_phi,
+    sin_phi,
+):
+
+    deflections = np.zeros((grid.shape[0], 2))
+
+    for i in numba.prange(grid.shape[0]):
+
+        y = grid[i, 0]
+        x = grid[i, 1]
+
+        integral_y = 0.0
+        integral_x = 0.0
+
+        for j in range(quadrature_u.shape[0]):
+
+            u = quadrature_u[j]
+            denominator = 1.0 - (1.0 - axis_ratio ** 2) * u
+            eta_u_squared = u * (x ** 2 + y ** 2 / denominator)
+
+            integrand = (core_radius ** 2 + eta_u_squared) ** (-(slope - 1.0) / 2.0)
+
+            integral_y += quadrature_weights[j] * integrand / denominator ** 1.5
+            integral_x += quadrature_weights[j] * integrand / denominator ** 0.5
+
+        deflection_y = axis_ratio * y * einstein_radius_rescaled * integral_y
+        deflection_x = axis_ratio * x * einstein_radius_rescaled * integral_x
+
+        deflections[i, 0] = deflection_x * sin_phi + deflection_y * cos_phi
+        deflections[i, 1] = deflection_x * cos_phi - deflection_y * sin_phi
+
+    return deflections
+
+
+@jit_parallel()
+def convergence_cored_power_law_parallel_from(
+    grid, axis_ratio, slope, core_radius, einstein_radius_rescaled
+):
+
+    convergence = np.zeros(grid.shape[0])
+
+    for i in numba.prange(grid.shape[0]):
+
+        grid_eta_squared = grid[i, 1] ** 2 + (grid[i, 0] / axis_ratio) ** 2
+
+        convergence[i] = einstein_radius_rescaled * (
+            core_radius ** 2 + grid_eta_squared
+        ) ** (-(slope - 1.0) / 2.0)
+
+    return convergence
+
+
+@jit_parallel()
+def deflections_nfw_parallel_from(
+    grid,
+    axis_ratio,
+    kappa_s,
+    scale_radius,
+    quadrature_u,
+    quadrature_weights,
+    cos_phi,
+    sin_phi,
+):
+
+    deflections = np.zeros((grid.shape[0], 2))
+
+    for i in numba.prange(grid.shape[0]):
+
+        y = grid[i, 0]
+        x = grid[i, 1]
+
+        integral_y = 0.0
+        integral_x = 0.0
+
+        for j in range(quadrature_u.shape[0]):
+
+            u = quadrature_u[j]
+            denominator = 1.0 - (1.0 - axis_ratio ** 2) * u
+            eta_u = np.sqrt(u * (x ** 2 + y ** 2 / denominator)) / scale_radius
+
+            if abs(eta_u - 1.0) < 1.0e-6:
+                integrand = 2.0 / 3.0
+            else:
+                if eta_u > 1.0:
+                    eta_u_2 = np.arctan(np.sqrt(eta_u ** 2 - 1.0)) / np.sqrt(
+                        eta_u ** 2 - 1.0
+                    )
+                else:
+                    eta_u_2 = np.arctanh(np.sqrt(1.0 - eta_u ** 2)) / np.sqrt(
+                        1.0 - eta_u ** 2
+                    )
+
+                integrand = 2.0 * (1.0 - eta_u_2) / (eta_u ** 2 - 1.0)
+
+            integral_y += quadrature_weights[j] * integrand / denominator ** 1.5
+            integral_x += quadrature_weights[j] * integrand / denominator ** 0.5
+
+        deflection_y = axis_ratio * y * kappa_s * integral_y
+        deflection_x = axis_ratio * x * kappa_s * integral_x
+
+        deflections[i, 0] = deflection_x * sin_phi + deflection_y * cos_phi
+        deflections[i, 1] = deflection_x * cos_phi - deflection_y * sin_phi
+
+    return deflections
+
+
+@jit_parallel()
+def image_sersic_parallel_from(
+    grid, axis_ratio, intensity, effective_radius, sersic_index, sersic_constant
+):
+
+    image = np.zeros(grid.shape[0])
+
+    for i in numba.prange(grid.shape[0]):
+
+        grid_radius = np.sqrt(axis_ratio) * np.sqrt(
+            grid[i, 1] ** 2 + (grid[i, 0] / axis_ratio) ** 2
+        )
+
+        image[i] = intensity * np.exp(
+            -sersic_constant
+            * ((grid_radius / effective_radius) ** (1.0 / sersic_index) - 1.0)
+        )
+
+    return image
+
+
+"""
+__Profiles__
+
+The parallel profiles inherit from the standard profiles, overwriting only the functions which are computed in
+parallel. They use the same grid decorators as the standard profiles, which transform the grid to the profile's
+reference frame and return the results as the appropriate data structure.
+
+The number of Gauss-Legendre quadrature points is a class attribute, which can be increased for higher precision.
+"""
+
+
+class EllipticalIsothermalParallel(al.mp.EllipticalIsothermal):
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid):
+
+        factor = (
+            2.0
+            * self.einstein_radius_rescaled
+            * self.axis_ratio
+            / np.sqrt(1 - self.axis_ratio ** 2)
+        )
+
+        return deflections_isothermal_parallel_from(
+            grid=np.asarray(grid),
+            axis_ratio=self.axis_ratio,
+            factor=factor,
+            cos_phi=self.cos_phi,
+            sin_phi=self.sin_phi,
+        )
+
+
+class EllipticalCoredPowerLawParallel(al.mp.EllipticalCoredPowerLaw):
+
+    quadrature_points = 64
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def convergence_from_grid(self, grid):
+
+        return convergence_cored_power_law_parallel_from(
+            grid=np.asarray(grid),
+            axis_ratio=self.axis_ratio,
+            slope=self.slope,
+            core_radius=self.core_radius,
+            einstein_radius_rescaled=self.einstein_radius_rescaled,
+        )
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid):
+
+        quadrature_u, quadrature_weights = quadrature_from(
+            total_points=self.quadrature_points,
+            power=min(max(2.0 / (3.0 - self.slope), 1.0), 8.0),
+        )
+
+        return deflections_cored_power_law_parallel_from(
+            grid=np.asarray(grid),
+            axis_ratio=self.axis_ratio,
+            slope=self.slope,
+            core_radius=self.core_radius,
+            einstein_radius_rescaled=self.einstein_radius_rescaled,
+            quadrature_u=quadrature_u,
+            quadrature_weights=quadrature_weights,
+            cos_phi=self.cos_phi,
+            sin_phi=self.sin_phi,
+        )
+
+
+class EllipticalNFWParallel(al.mp.EllipticalNFW):
+
+    quadrature_points = 64
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid, **kwargs):
+
+        quadrature_u, quadrature_weights = quadrature_from(
+            total_points=self.quadrature_points, power=2.0
+        )
+
+        return deflections_nfw_parallel_from(
+            grid=np.asarray(grid),
+            axis_ratio=self.axis_ratio,
+            kappa_s=self.kappa_s,
+            scale_radius=self.scale_radius,
+            quadrature_u=quadrature_u,
+            quadrature_weights=quadrature_weights,
+            cos_phi=self.cos_phi,
+            sin_phi=self.sin_phi,
+        )
+
+
+class EllipticalSersicParallel(al.lp.EllipticalSersic):
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def image_from_grid(self, grid, grid_radial_minimum=None):
+
+        return image_sersic_parallel_from(
+            grid=np.asarray(grid),
+            axis_ratio=self.axis_ratio,
+            intensity=self.intensity,
+            effective_radius=self.effective_radius,
+            sersic_index=self.sersic_index,
+            sersic_constant=self.sersic_constant,
+        )
+
+
+"""
+__Threads__
+
+The number of threads used by a phase's likelihood evaluations is set in its settings, via the
+`SettingsPhaseImagingParallel` object.
+"""
+
+
+class SettingsPhaseImagingParallel(al.SettingsPhaseImaging):
+    def __init__(
+        self,
+        settings_masked_imaging=al.SettingsMaskedImaging(),
+        settings_pixelization=al.SettingsPixelization(use_border=True),
+        settings_inversion=al.SettingsInversion(),
+        settings_lens=al.SettingsLens(),
+        log_likelihood_cap=None,
+        number_of_threads=None,
+    ):
+        """
+        The settings of an imaging phase, extended to include the number of threads used by the parallel numba
+        functions of every likelihood evaluation.
+
+        Parameters
+        ----------
+        number_of_threads : int or None
+            The number of threads used by each likelihood evaluation. If None, the number of cores of the computer
+            divided by the number of cores (processes) of the phase's non-linear search is used.
+        """
+        super().__init__(
+            settings_masked_imaging=settings_masked_imaging,
+            settings_pixelization=settings_pixelization,
+            settings_inversion=settings_inversion,
+            settings_lens=settings_lens,
+            log_likelihood_cap=log_likelihood_cap,
+        )
+
+        self.number_of_threads = number_of_threads
+
+
+def number_of_threads_from(number_of_threads, number_of_cores):
+    """
+    Returns the number of threads each process of a non-linear search uses, such that the total number of threads
+    over all processes does not exceed the number of threads available to numba.
+    """
+    if number_of_threads is None:
+        number_of_threads = (os.cpu_count() or 1) // max(number_of_cores, 1)
+
+    return min(max(number_of_threads, 1), numba.config.NUMBA_NUM_THREADS)
+
+
+"""
+The number of threads is set at the start of every likelihood evaluation, as opposed to once when the phase begins,
+because the processes of a parallel non-linear search (e.g. `Dynesty` with `number_of_cores > 1`) are created
+after the phase has begun and each have their own numba thread count.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisParallel(a.Analysis):
+
+    number_of_threads = 1
+
+    def log_likelihood_function(self, instance):
+
+        if numba.get_num_threads() != self.number_of_threads:
+            numba.set_num_threads(self.number_of_threads)
+
+        return super().log_likelihood_function(instance=instance)
+
+
+class PhaseImagingParallel(al.PhaseImaging):
+
+    Analysis = AnalysisParallel
+
+    def make_analysis(self, dataset, mask, results=None):
+
+        analysis = super().make_analysis(dataset=dataset, mask=mask, results=results)
+
+        analysis.number_of_threads = number_of_threads_from(
+            number_of_threads=getattr(self.settings, "number_of_threads", None),
+            number_of_cores=self.search.number_of_cores,
+        )
+
+        return analysis
+
+
+"""
+__Comparison__
+
+We now compare the run times and results of the standard and parallel profiles on the grid of the `hst_up` dataset,
+which has a pixel scale of 0.03" and therefore many image pixels.
+"""
+dataset_name = "hst_up"
+dataset_path = path.join("dataset", "imaging", "instruments", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.03,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+grid = al.Grid2D.from_mask(
+    mask=al.Mask2D.circular(
+        shape_native=imaging.shape_native,
+        pixel_scales=imaging.pixel_scales,
+        sub_size=4,
+        radius=3.0,
+    )
+)
+
+elliptical_comps = al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0)
+
+profile_pairs = [
+    (
+        al.mp.EllipticalIsothermal(
+            centre=(0.0, 0.0), elliptical_comps=elliptical_comps, einstein_radius=1.6
+        ),
+        EllipticalIsothermalParallel(
+            centre=(0.0, 0.0), elliptical_comps=elliptical_comps, einstein_radius=1.6
+        ),
+        "deflections_from_grid",
+    ),
+    (
+        al.mp.EllipticalCoredPowerLaw(
+            centre=(0.0, 0.0),
+            elliptical_comps=elliptical_comps,
+            einstein_radius=1.6,
+            slope=2.2,
+            core_radius=0.05,
+        ),
+        EllipticalCoredPowerLawParallel(
+            centre=(0.0, 0.0),
+            elliptical_comps=elliptical_comps,
+            einstein_radius=1.6,
+            slope=2.2,
+            core_radius=0.05,
+        ),
+        "deflections_from_grid",
+    ),
+    (
+        al.mp.EllipticalNFW(
+            centre=(0.0, 0.0),
+            elliptical_comps=elliptical_comps,
+            kappa_s=0.2,
+            scale_radius=10.0,
+        ),
+        EllipticalNFWParallel(
+            centre=(0.0, 0.0),
+            elliptical_comps=elliptical_comps,
+            kappa_s=0.2,
+            scale_radius=10.0,
+        ),
+        "deflections_from_grid_via_integrator",
+    ),
+    (
+        al.lp.EllipticalSersic(
+            centre=(0.1, 0.1),
+            elliptical_comps=elliptical_comps,
+            intensity=0.3,
+            effective_radius=1.0,
+            sersic_index=2.5,
+        ),
+        EllipticalSersicParallel(
+            centre=(0.1, 0.1),
+            elliptical_comps=elliptical_comps,
+            intensity=0.3,
+            effective_radius=1.0,
+            sersic_index=2.5,
+        ),
+        "image_from_grid",
+    ),
+]
+
+"""
+The parallel numba functions are compiled on their first call, so we call them once before timing them.
+
+The standard `EllipticalNFW` computes its deflection angles via a sum of Gaussians (its `deflections_from_grid`),
+which is an approximation, so we compare the parallel `EllipticalNFW` to its exact integral calculation.
+"""
+numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+
+for profile, profile_parallel, func_name in profile_pairs:
+
+    parallel_func_name = (
+        "deflections_from_grid" if func_name.startswith("deflections") else func_name
+    )
+
+    getattr(profile_parallel, parallel_func_name)(grid=grid)
+
+    start = time.time()
+    result = getattr(profile, func_name)(grid=grid)
+    time_standard = time.time() - start
+
+    start = time.time()
+    result_parallel = getattr(profile_parallel, parallel_func_name)(grid=grid)
+    time_parallel = time.time() - start
+
+    print(
+        f"{profile.__class__.__name__}: Standard Time = {time_standard}, "
+        f"Parallel Time ({numba.get_num_threads()} threads) = {time_parallel}, "
+        f"Maximum Fractional Difference = "
+        f"{np.max(np.abs(result_parallel - result) / np.maximum(np.abs(result), 1e-8))}"
+    )
+
+"""
+__Phase__
+
+We now fit the `hst_up` dataset with a phase using the parallel profiles. The search uses 2 cores (processes), with
+each likelihood evaluation using 4 threads.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=EllipticalIsothermalParallel)
+source = al.GalaxyModel(redshift=1.0, bulge=EllipticalSersicParallel)
+
+phase = PhaseImagingParallel(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "parallel_numba"),
+        name="phase_parallel",
+        n_live_points=50,
+        number_of_cores=2,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=SettingsPhaseImagingParallel(
+        settings_masked_imaging=al.SettingsMaskedImaging(
+            grid_class=al.Grid2D, sub_size=2
+        ),
+        number_of_threads=4,
+    ),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
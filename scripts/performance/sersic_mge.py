@@ -0,0 +1,364 @@
+"""
+Performance: Sersic MGE
+=======================
+
+Light-and-mass profiles (`al.lmp`), for example the `EllipticalSersic` and `EllipticalExponential` used for the
+stellar mass of the `light_parametric__mass_light_dark` lens models, compute their deflection angles via a
+Multi-Gaussian Expansion (MGE) of their convergence. This decomposes the Sersic profile into a sum of Gaussians (see
+https://arxiv.org/abs/1906.08263), each of whose deflection angles is computed in closed-form.
+
+This script speeds up these deflection angle calculations in two ways:
+
+ - The Gaussian decomposition of a Sersic profile depends on its intensity, effective radius and mass-to-light
+   ratio only through a rescaling of the Gaussian amplitudes and widths. The dimensionless decomposition is therefore
+   a function of only the Sersic index, and is computed once on a fine grid of Sersic indexes, cached and
+   interpolated, as opposed to being recomputed every time the deflection angles are computed.
+
+ - The deflection angles of the Gaussians are computed by a numba function which loops over every (y,x) coordinate,
+   as opposed to NumPy functions which create temporary arrays the size of the grid for every Gaussian.
+
+The deflection angles are identical to those computed by **PyAutoLens** up to floating point rounding, so the only
+approximation is the interpolation of the Gaussian decomposition in Sersic index.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+import autofit as af
+import autolens as al
+from autoarray import decorator_util
+
+"""
+__Coefficients__
+
+The dimensionless Gaussian decomposition of a Sersic profile with an intensity, effective radius and mass-to-light
+ratio of 1.0 is computed using **PyAutoLens**'s `decompose_convergence_into_gaussians` method, on a grid of Sersic
+indexes with a spacing of 0.01.
+
+For a Sersic profile with a given Sersic index, the Gaussian amplitudes are interpolated from this grid and
+multiplied by the profile's intensity and mass-to-light ratio, and the Gaussian widths (which do not depend on
+the Sersic index) multiplied by its effective radius.
+
+The interpolated amplitudes have a fractional error below 1e-4 (weighted by the mass of each Gaussian). Below a
+Sersic index of 0.8 the Gaussian amplitudes oscillate rapidly with Sersic index and cannot be interpolated, so
+Sersic indexes outside the range of the grid have their decomposition computed directly.
+"""
+sersic_indexes = np.linspace(0.8, 8.0, 721)
+
+sersic_mge_cache = {}
+
+
+def sersic_mge_coefficients_from(sersic_index):
+    """
+    Returns the amplitudes and widths (sigmas) of the dimensionless Gaussian decomposition of a Sersic profile with
+    the input Sersic index.
+    """
+    return al.mp.EllipticalSersic(
+        intensity=1.0,
+        effective_radius=1.0,
+        sersic_index=sersic_index,
+        mass_to_light_ratio=1.0,
+    ).decompose_convergence_into_gaussians()
+
+
+def sersic_mge_table_from():
+
+    if "table" not in sersic_mge_cache:
+
+        coefficients = [
+            sersic_mge_coefficients_from(sersic_index=sersic_index)
+            for sersic_index in sersic_indexes
+        ]
+
+        sersic_mge_cache["table"] = (
+            np.array([amps for amps, sigmas in coefficients]),
+            coefficients[0][1],
+        )
+
+    return sersic_mge_cache["table"]
+
+
+def sersic_mge_cached_from(sersic_index):
+    """
+    Returns the amplitudes and widths of the dimensionless Gaussian decomposition of a Sersic profile, interpolated
+    from the cached grid of Sersic indexes.
+    """
+    if not sersic_indexes[0] <= sersic_index <= sersic_indexes[-1]:
+        return sersic_mge_coefficients_from(sersic_index=sersic_index)
+
+    amplitudes, sigmas = sersic_mge_table_from()
+
+    index = min(
+        int((sersic_index - sersic_indexes[0]) / (sersic_indexes[1] - sersic_indexes[0])),
+        sersic_indexes.shape[0] - 2,
+    )
+
+    weight = (sersic_index - sersic_indexes[index]) / (
+        sersic_indexes[index + 1] - sersic_indexes[index]
+    )
+
+    return (
+        (1.0 - weight) * amplitudes[index] + weight * amplitudes[index + 1],
+        sigmas,
+    )
+
+
+"""
+__Kernel__
+
+**PyAutoLens** computes the deflection angles of every Gaussian using the function `w_f_approx`, an approximation of
+the Faddeeva function which splits the grid into 6 regions and evaluates a different expression in each. For every
+Gaussian this creates many temporary arrays the size of the grid, which dominates the run time.
+
+The numba function `zeta_from` instead loops over the (y,x) coordinates and Gaussians, evaluating the same
+approximation for one coordinate at a time via `w_f_from`. The deflection angles are therefore identical to those of
+**PyAutoLens**, up to floating point rounding.
+
+The second Faddeeva function term of a Gaussian's deflection angles is multiplied by an exponential, which underflows
+to zero for coordinates far from the centre of narrow Gaussians. For these coordinates the second term is skipped.
+"""
+
+
+@decorator_util.jit()
+def w_f_from(z):
+    """
+    Returns the approximation of the Faddeeva function used by **PyAutoLens** (see `w_f_approx`) for a single complex
+    number `z` with a positive imaginary component.
+    """
+    sqrt_pi = 1.0 / np.sqrt(np.pi)
+    i_sqrt_pi = 1j * sqrt_pi
+
+    z_imag2 = z.imag ** 2
+    abs_z2 = z.real ** 2 + z_imag2
+
+    if abs_z2 >= 38000.0:
+        return i_sqrt_pi / z
+
+    if abs_z2 >= 256.0:
+        return i_sqrt_pi * z / (z * z - 0.5)
+
+    if abs_z2 >= 62.0:
+        return (i_sqrt_pi / z) * (1.0 + 0.5 / (z * z - 1.5))
+
+    if abs_z2 >= 30.0 and z_imag2 >= 1.0e-13:
+        zz = z * z
+        return (i_sqrt_pi * z) * (zz - 2.5) / (zz * (zz - 3.0) + 0.75)
+
+    if abs_z2 > 2.5 and z_imag2 < 0.072:
+
+        u = -z * z
+
+        f1 = sqrt_pi + 0j
+        f2 = 1.0 + 0j
+
+        for s in (1.320522, 35.7668, 219.031, 1540.787, 3321.99, 36183.31):
+            f1 = s - f1 * u
+        for s in (1.841439, 61.57037, 364.2191, 2186.181, 9022.228, 24322.84, 32066.6):
+            f2 = s - f2 * u
+
+        return np.exp(u) + 1j * z * f1 / f2
+
+    t3 = -1j * z
+
+    f1 = sqrt_pi + 0j
+    f2 = 1.0 + 0j
+
+    for s in (5.9126262, 30.180142, 93.15558, 181.92853, 214.38239, 122.60793):
+        f1 = f1 * t3 + s
+    for s in (
+        10.479857,
+        53.992907,
+        170.35400,
+        348.70392,
+        457.33448,
+        352.73063,
+        122.60793,
+    ):
+        f2 = f2 * t3 + s
+
+    return f1 / f2
+
+
+@decorator_util.jit()
+def zeta_from(grid, amps, sigmas, axis_ratio):
+    """
+    Returns the sum of the (complex) deflection angles of the Gaussians, in the same form as the
+    `zeta_from_grid` method of **PyAutoLens**'s `MassProfileMGE`.
+    """
+    output_grid = np.zeros(grid.shape[0], dtype=np.complex128)
+
+    q2 = axis_ratio ** 2.0
+
+    for i in range(grid.shape[0]):
+
+        for j in range(sigmas.shape[0]):
+
+            scale_factor = axis_ratio / (sigmas[j] * np.sqrt(2.0 * (1.0 - q2)))
+
+            xs = grid[i, 1] * scale_factor
+            ys = np.abs(grid[i, 0]) * scale_factor
+
+            zeta = -1j * w_f_from(xs + 1j * ys)
+
+            expv = -(xs ** 2.0) * (1.0 - q2) - ys ** 2.0 * (1.0 / q2 - 1.0)
+
+            if expv > -745.0:
+                zeta += (
+                    1j
+                    * np.exp(expv)
+                    * w_f_from(axis_ratio * xs + 1j * ys / axis_ratio)
+                )
+
+            output_grid[i] += amps[j] * sigmas[j] * zeta
+
+        if grid[i, 0] < 0.0:
+            output_grid[i] = np.conj(output_grid[i])
+
+    return output_grid
+
+
+"""
+__Profiles__
+
+The `MassProfileSersicMGE` class overwrites the `decompose_convergence_into_gaussians` and `zeta_from_grid` methods
+of a Sersic mass profile, and is combined with the **PyAutoLens** light-and-mass profiles to give profiles which are
+used in a lens model the same way as their standard counterparts.
+"""
+
+
+class MassProfileSersicMGE:
+    def decompose_convergence_into_gaussians(self):
+
+        amps, sigmas = sersic_mge_cached_from(sersic_index=self.sersic_index)
+
+        return (
+            self.mass_to_light_ratio * self.intensity * amps,
+            self.effective_radius * sigmas,
+        )
+
+    @staticmethod
+    def zeta_from_grid(grid, amps, sigmas, axis_ratio):
+        return zeta_from(
+            grid=np.asarray(grid),
+            amps=np.asarray(amps, dtype="float"),
+            sigmas=np.asarray(sigmas, dtype="float"),
+            axis_ratio=axis_ratio,
+        )
+
+
+class EllipticalSersicMGE(MassProfileSersicMGE, al.lmp.EllipticalSersic):
+    pass
+
+
+class EllipticalExponentialMGE(MassProfileSersicMGE, al.lmp.EllipticalExponential):
+    pass
+
+
+class EllipticalDevVaucouleursMGE(
+    MassProfileSersicMGE, al.lmp.EllipticalDevVaucouleurs
+):
+    pass
+
+
+"""
+__Comparison__
+
+We now compare the deflection angles of the standard and MGE-cached profiles, on the grid of the `hst` dataset with
+a sub-size of 2, and the deflection angles computed by integrating the profile (which are exact).
+
+The first call of the cached profile computes the table of Gaussian decompositions and compiles its numba functions,
+so we call it once before timing it.
+"""
+grid = al.Grid2D.uniform(shape_native=(180, 180), pixel_scales=0.05, sub_size=2)
+
+bulge_kwargs = dict(
+    centre=(0.0, 0.0),
+    elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    intensity=1.0,
+    effective_radius=0.8,
+    sersic_index=3.237,
+    mass_to_light_ratio=0.3,
+)
+
+bulge = al.lmp.EllipticalSersic(**bulge_kwargs)
+bulge_mge = EllipticalSersicMGE(**bulge_kwargs)
+
+bulge_mge.deflections_from_grid(grid=grid)
+
+start = time.time()
+deflections = bulge.deflections_from_grid(grid=grid)
+print(f"Standard MGE Time = {time.time() - start}")
+
+start = time.time()
+deflections_mge = bulge_mge.deflections_from_grid(grid=grid)
+print(f"Cached MGE Time = {time.time() - start}")
+
+print(
+    f"Maximum Difference Standard vs Cached MGE = {np.max(np.abs(deflections_mge - deflections))}"
+)
+
+"""
+The integrator is slow, so we compare to it on a small number of coordinates.
+"""
+grid_irregular = al.Grid2DIrregular(
+    grid=[(0.05, 0.1), (0.3, -0.2), (-0.8, 0.6), (1.5, 1.2), (-2.5, -3.0)]
+)
+
+deflections_integrator = bulge.deflections_from_grid_via_integrator(
+    grid=grid_irregular
+)
+
+print("Integrator:", deflections_integrator)
+print("Standard MGE:", bulge.deflections_from_grid(grid=grid_irregular))
+print("Cached MGE:", bulge_mge.deflections_from_grid(grid=grid_irregular))
+
+"""
+__Model__
+
+We now fit the `light_sersic_exp__mass_mlr_nfw__source_sersic` dataset with a light and dark matter lens model, as in
+the example `imaging/modeling/light_parametric__mass_light_dark__source_parametric.py`, using the MGE-cached bulge
+and disk.
+"""
+dataset_name = "light_sersic_exp__mass_mlr_nfw__source_sersic"
+dataset_path = path.join("dataset", "imaging", "with_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+bulge = af.PriorModel(EllipticalSersicMGE)
+disk = af.PriorModel(EllipticalExponentialMGE)
+
+bulge.centre = disk.centre
+
+lens = al.GalaxyModel(
+    redshift=0.5, bulge=bulge, disk=disk, dark=al.mp.SphericalNFWMCRLudlow
+)
+source = al.GalaxyModel(redshift=1.0, bulge=al.lp.EllipticalSersic)
+
+phase = al.PhaseImaging(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "sersic_mge"),
+        name="phase_mass_light_dark",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,536 @@
+"""
+Performance: Single Precision
+=============================
+
+Every calculation in a **PyAutoLens** fit, from the (y,x) coordinates of the `Grid2D` to the curvature matrix of an
+`Inversion`, is performed using 64-bit floats. For large masks of high resolution data (e.g. the 0.03" `hst_up`
+dataset) the memory used by a fit is dominated by the blurred mapping matrix of the `Inversion`, which has
+dimensions [image_pixels, source_pixels], and this memory is what limits how many fits can be run concurrently on
+one computer.
+
+This script shows a `precision="float32"` mode, where the grids and blurred mapping matrix are stored using 32-bit
+floats, halving their memory and memory traffic. The blurred mapping matrix is computed from the source pixel that
+every sub-pixel maps to, as the product of sparse 32-bit PSF blurring and mapping matrices, as opposed to blurring the
+dense 64-bit mapping matrix. 64-bit floats are kept where the precision matters:
+
+ - The image and noise-map, such that the residuals and chi-squared are computed and summed using 64-bit floats.
+ - The data vector and curvature matrix, which are sums over every image pixel and are accumulated using 64-bit
+   floats (from the non-zero entries of the sparse blurred mapping matrix, which are few).
+ - The curvature + regularization matrix, such that its Cholesky decomposition, the linear solve and the
+   log determinants of the Bayesian evidence use 64-bit floats.
+
+The phase also has a validation mode, which for every `precision_validation_interval` likelihood evaluations repeats
+the fit at 64-bit precision and reports the error of the 32-bit log likelihood.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from scipy import sparse
+import autofit as af
+import autolens as al
+import autolens.plot as aplt
+from autoarray import exc
+from autoarray.inversion.inversions import InversionImagingMatrix
+from autolens.fit import fit as f
+from inversion_operators import operator_from_frames, reconstruction_from
+
+"""
+__Settings__
+
+The `precision` is an input of both the `SettingsMaskedImaging` (which sets the precision of the grids and PSF
+convolution) and the `SettingsInversion` (which sets the precision of the `Inversion` matrices).
+"""
+
+
+def check_precision(precision):
+
+    if precision not in ("float64", "float32"):
+        raise exc.DatasetException("The precision must be one of {float64, float32}")
+
+
+class SettingsMaskedImagingPrecision(al.SettingsMaskedImaging):
+    def __init__(
+        self,
+        grid_class=al.Grid2D,
+        grid_inversion_class=al.Grid2D,
+        sub_size=2,
+        sub_size_inversion=2,
+        fractional_accuracy=0.9999,
+        sub_steps=None,
+        pixel_scales_interp=None,
+        signal_to_noise_limit=None,
+        psf_shape_2d=None,
+        renormalize_psf=True,
+        precision="float64",
+        precision_validation_interval=None,
+    ):
+        """
+        The settings of a `MaskedImagingPrecision`, which in addition to the `SettingsMaskedImaging` set the floating
+        point precision of its grids and PSF convolution.
+
+        Parameters
+        ----------
+        precision : str
+            Whether the grids and blurred mapping matrices are stored using 64-bit (`float64`) or 32-bit (`float32`)
+            floats.
+        precision_validation_interval : int or None
+            If input, every `precision_validation_interval` likelihood evaluations are repeated at 64-bit precision
+            and the error of the log likelihood is reported.
+        """
+        super().__init__(
+            grid_class=grid_class,
+            grid_inversion_class=grid_inversion_class,
+            sub_size=sub_size,
+            sub_size_inversion=sub_size_inversion,
+            fractional_accuracy=fractional_accuracy,
+            sub_steps=sub_steps,
+            pixel_scales_interp=pixel_scales_interp,
+            signal_to_noise_limit=signal_to_noise_limit,
+            psf_shape_2d=psf_shape_2d,
+            renormalize_psf=renormalize_psf,
+        )
+
+        check_precision(precision=precision)
+
+        self.precision = precision
+        self.precision_validation_interval = precision_validation_interval
+
+
+class SettingsInversionPrecision(al.SettingsInversion):
+    def __init__(
+        self,
+        use_linear_operators=False,
+        tolerance=1e-8,
+        maxiter=250,
+        check_solution=True,
+        precision="float64",
+    ):
+        """
+        The settings of an `Inversion`, which in addition to the `SettingsInversion` set the floating point precision
+        of its blurred mapping matrix and curvature matrix.
+        """
+        super().__init__(
+            use_linear_operators=use_linear_operators,
+            tolerance=tolerance,
+            maxiter=maxiter,
+            check_solution=check_solution,
+        )
+
+        check_precision(precision=precision)
+
+        self.precision = precision
+
+
+"""
+__Convolver__
+
+The `Convolver` blurs the mapping matrix using 64-bit floats. The `ConvolverPrecision` instead stores the PSF
+convolution of the image pixels as a sparse matrix at the input precision, such that the blurred mapping matrix is
+computed by one sparse matrix multiplication and is stored at that precision.
+
+The `blurred_mapping_matrix_from` method creates the sparse mapping matrix at the input precision from the source
+pixel index of every sub-pixel of a mapper, so the dense 64-bit mapping matrix of the mapper is not blurred or copied.
+"""
+
+
+class ConvolverPrecision(al.Convolver):
+    def __init__(self, mask, kernel, precision="float64"):
+
+        super().__init__(mask=mask, kernel=kernel)
+
+        self.precision = precision
+
+        self.blurring_operator = operator_from_frames(
+            frame_1d_indexes=self.image_frame_1d_indexes,
+            frame_1d_kernels=self.image_frame_1d_kernels.astype(precision),
+            frame_1d_lengths=self.image_frame_1d_lengths,
+            total_image_pixels=self.pixels_in_mask,
+        )
+
+    def convolve_mapping_matrix(self, mapping_matrix):
+
+        if self.precision == "float64":
+            return super().convolve_mapping_matrix(mapping_matrix=mapping_matrix)
+
+        return self.blurring_operator @ np.asarray(mapping_matrix, dtype=self.precision)
+
+    def blurred_mapping_matrix_from(self, mapper):
+        """
+        Returns the blurred mapping matrix of a mapper as a sparse matrix at the input precision.
+        """
+        pixelization_index_for_sub_slim_index = (
+            mapper.pixelization_index_for_sub_slim_index
+        )
+
+        mapping_matrix = sparse.csr_matrix(
+            (
+                np.full(
+                    pixelization_index_for_sub_slim_index.shape[0],
+                    mapper.source_grid_slim.mask.sub_fraction,
+                    dtype=self.precision,
+                ),
+                (
+                    mapper.source_grid_slim.mask._slim_index_for_sub_slim_index,
+                    pixelization_index_for_sub_slim_index,
+                ),
+            ),
+            shape=(self.pixels_in_mask, mapper.pixels),
+        )
+
+        return (self.blurring_operator @ mapping_matrix).tocsr()
+
+
+"""
+__Masked Imaging__
+
+The `MaskedImagingPrecision` stores its grids at the input precision, which means every light and mass profile is
+evaluated using 32-bit floats when `precision="float32"`. The image and noise-map remain 64-bit.
+"""
+
+
+class MaskedImagingPrecision(al.MaskedImaging):
+    def __init__(self, imaging, mask, settings=SettingsMaskedImagingPrecision()):
+
+        super().__init__(imaging=imaging, mask=mask, settings=settings)
+
+        self.precision = settings.precision
+
+        if self.precision == "float64":
+            return
+
+        self.grid = self.grid.astype(self.precision)
+        self.grid_inversion = self.grid_inversion.astype(self.precision)
+
+        if self.psf is not None:
+
+            self.convolver = ConvolverPrecision(
+                mask=self.mask, kernel=self.psf, precision=self.precision
+            )
+            self.blurring_grid = self.blurring_grid.astype(self.precision)
+
+
+"""
+__Inversion__
+
+The `TracerPrecision` overwrites the `Tracer` method which creates an `Inversion` for imaging data. If the
+`SettingsInversion` have `precision="float32"`, the blurred mapping matrix is computed by the `ConvolverPrecision` of
+a 32-bit `MaskedImagingPrecision` and stored using 32-bit floats. Its non-zero entries are converted to 64-bit to
+compute the data vector and curvature matrix, such that their sums over every image pixel are accumulated using
+64-bit floats.
+"""
+
+
+class TracerPrecision(al.Tracer):
+    def inversion_imaging_from_grid_and_data(
+        self,
+        grid,
+        image,
+        noise_map,
+        convolver,
+        settings_pixelization=al.SettingsPixelization(),
+        settings_inversion=al.SettingsInversion(),
+    ):
+
+        precision = getattr(settings_inversion, "precision", "float64")
+
+        if precision == "float64":
+            return super().inversion_imaging_from_grid_and_data(
+                grid=grid,
+                image=image,
+                noise_map=noise_map,
+                convolver=convolver,
+                settings_pixelization=settings_pixelization,
+                settings_inversion=settings_inversion,
+            )
+
+        mapper = self.mappers_of_planes_from_grid(
+            grid=grid, settings_pixelization=settings_pixelization
+        )[-1]
+
+        regularization = self.regularizations_of_planes[-1]
+
+        blurred_mapping_matrix = convolver.blurred_mapping_matrix_from(mapper=mapper)
+
+        inverse_noise_map = 1.0 / np.asarray(noise_map)
+
+        weighted_mapping_matrix = sparse.diags(
+            inverse_noise_map
+        ) @ blurred_mapping_matrix.astype("float64")
+
+        data_vector = weighted_mapping_matrix.T @ (
+            np.asarray(image) * inverse_noise_map
+        )
+
+        curvature_matrix = (
+            weighted_mapping_matrix.T @ weighted_mapping_matrix
+        ).toarray()
+
+        regularization_matrix = regularization.regularization_matrix_from_mapper(
+            mapper=mapper
+        )
+
+        curvature_reg_matrix = np.add(curvature_matrix, regularization_matrix)
+
+        values = reconstruction_from(
+            curvature_reg_matrix=curvature_reg_matrix,
+            data_vector=data_vector,
+            check_solution=settings_inversion.check_solution,
+        )
+
+        return InversionImagingMatrix(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            blurred_mapping_matrix=blurred_mapping_matrix.toarray(),
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            reconstruction=values,
+            settings=settings_inversion,
+        )
+
+
+"""
+__Analysis__
+
+The `AnalysisPrecision` uses the `TracerPrecision` for every fit. In validation mode it also holds a 64-bit
+`MaskedImaging`, and every `precision_validation_interval` likelihood evaluations it repeats the fit with it and
+prints the difference between the two log likelihoods.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisPrecision(a.Analysis):
+    def __init__(
+        self,
+        masked_imaging,
+        settings,
+        cosmology,
+        results=None,
+        masked_imaging_float64=None,
+        precision_validation_interval=None,
+    ):
+
+        super().__init__(
+            masked_imaging=masked_imaging,
+            settings=settings,
+            cosmology=cosmology,
+            results=results,
+        )
+
+        self.masked_imaging_float64 = masked_imaging_float64
+        self.precision_validation_interval = precision_validation_interval
+        self.total_log_likelihood_calls = 0
+        self.log_likelihood_errors = []
+
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerPrecision(planes=tracer.planes, cosmology=tracer.cosmology)
+
+    def log_likelihood_function(self, instance):
+
+        log_likelihood = super().log_likelihood_function(instance=instance)
+
+        self.total_log_likelihood_calls += 1
+
+        if self.masked_imaging_float64 is not None:
+            if self.total_log_likelihood_calls % self.precision_validation_interval == 0:
+
+                log_likelihood_float64 = self.log_likelihood_float64_for_instance(
+                    instance=instance
+                )
+
+                self.log_likelihood_errors.append(
+                    log_likelihood - log_likelihood_float64
+                )
+
+                print(
+                    f"Precision Validation: float64 log likelihood = {log_likelihood_float64}, "
+                    f"error = {self.log_likelihood_errors[-1]}, "
+                    f"maximum error = {np.max(np.abs(self.log_likelihood_errors))}"
+                )
+
+        return log_likelihood
+
+    def log_likelihood_float64_for_instance(self, instance):
+        """
+        Returns the log likelihood of a model instance computed entirely using 64-bit floats.
+        """
+        self.associate_hyper_images(instance=instance)
+
+        return f.FitImaging(
+            masked_imaging=self.masked_imaging_float64,
+            tracer=super().tracer_for_instance(instance=instance),
+            hyper_image_sky=self.hyper_image_sky_for_instance(instance=instance),
+            hyper_background_noise=self.hyper_background_noise_for_instance(
+                instance=instance
+            ),
+            settings_pixelization=self.settings.settings_pixelization,
+            settings_inversion=al.SettingsInversion(
+                use_linear_operators=self.settings.settings_inversion.use_linear_operators,
+                check_solution=self.settings.settings_inversion.check_solution,
+            ),
+        ).figure_of_merit
+
+
+"""
+__Phase__
+
+The `PhaseImagingPrecision` creates its analysis using a `MaskedImagingPrecision` and, in validation mode, a 64-bit
+`MaskedImaging`.
+"""
+
+
+class PhaseImagingPrecision(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        settings_masked_imaging = self.settings.settings_masked_imaging
+
+        masked_imaging = MaskedImagingPrecision(
+            imaging=dataset, mask=mask, settings=settings_masked_imaging
+        )
+
+        if settings_masked_imaging.precision_validation_interval is None:
+            masked_imaging_float64 = None
+        else:
+            masked_imaging_float64 = al.MaskedImaging(
+                imaging=dataset, mask=mask, settings=settings_masked_imaging
+            )
+
+        self.output_phase_info()
+
+        return AnalysisPrecision(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+            masked_imaging_float64=masked_imaging_float64,
+            precision_validation_interval=settings_masked_imaging.precision_validation_interval,
+        )
+
+
+"""
+__Dataset__
+
+We use the `hst_up` dataset, which has a pixel scale of 0.03" and therefore a large number of image pixels in a 3.0"
+circular mask.
+"""
+dataset_name = "hst_up"
+dataset_path = path.join("dataset", "imaging", "instruments", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.03,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+imaging_plotter = aplt.ImagingPlotter(
+    imaging=imaging, visuals_2d=aplt.Visuals2D(mask=mask)
+)
+imaging_plotter.subplot_imaging()
+
+"""
+__Precision Comparison__
+
+We fit the true lens model of the dataset with a `VoronoiMagnification` source, using 64-bit and 32-bit precision,
+and compare their run times, the memory of their blurred mapping matrices and their log likelihoods.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification(shape=(40, 40)),
+    regularization=al.reg.Constant(coefficient=1.0),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+tracer = TracerPrecision(planes=tracer.planes, cosmology=tracer.cosmology)
+
+for precision in ["float64", "float32"]:
+
+    masked_imaging = MaskedImagingPrecision(
+        imaging=imaging,
+        mask=mask,
+        settings=SettingsMaskedImagingPrecision(precision=precision),
+    )
+
+    settings_inversion = SettingsInversionPrecision(precision=precision)
+
+    fit = al.FitImaging(
+        masked_imaging=masked_imaging,
+        tracer=tracer,
+        settings_inversion=settings_inversion,
+    )
+
+    start = time.time()
+    for _ in range(5):
+        fit = al.FitImaging(
+            masked_imaging=masked_imaging,
+            tracer=tracer,
+            settings_inversion=settings_inversion,
+        )
+        fit.log_evidence
+    print(f"{precision} FitImaging time = {(time.time() - start) / 5} s")
+
+    print(
+        f"{precision} blurred mapping matrix memory = "
+        f"{fit.inversion.blurred_mapping_matrix.nbytes / 1e6} MB"
+    )
+    print(f"{precision} log evidence = {fit.log_evidence}")
+
+"""
+__Phase__
+
+We now fit a lens model using 32-bit precision, with the validation mode reporting the log likelihood error every
+1000 likelihood evaluations.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal)
+source = al.GalaxyModel(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification,
+    regularization=al.reg.Constant,
+)
+
+settings = al.SettingsPhaseImaging(
+    settings_masked_imaging=SettingsMaskedImagingPrecision(
+        precision="float32", precision_validation_interval=1000
+    ),
+    settings_inversion=SettingsInversionPrecision(precision="float32"),
+)
+
+phase = PhaseImagingPrecision(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "single_precision"),
+        name="phase_float32",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=settings,
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,475 @@
+"""
+Performance: Sparse Mapping Matrix
+==================================
+
+The mapper of every **PyAutoLens** pixelization (`Rectangular`, `VoronoiMagnification` and `VoronoiBrightnessImage`)
+creates a mapping matrix of dimensions [image_pixels, source_pixels], whose entries are the fraction of every image
+pixel's sub-pixels that map to every source pixel. The `Inversion` blurs it with the PSF to give the blurred mapping
+matrix, which is multiplied by itself to give the curvature matrix F = (BM)^T W (BM), where W is the inverse noise
+squared.
+
+Every image sub-pixel maps to one source pixel, so almost every entry of these matrices is zero. For a 40 x 40 source
+pixelization and a high resolution mask with ~30000 sub-pixels, the dense matrices take up hundreds of megabytes each,
+and most of the `Inversion`'s run time is spent looping over (or multiplying) their zeros.
+
+This script shows sparse versions of the three pixelizations, whose mappers store the mapping matrix as a
+`scipy.sparse.csr_matrix` made from the source pixel index and weight (the sub-fraction) of every sub-pixel. The
+`InversionImagingSparse` then computes:
+
+ - The blurred mapping matrix as the product of a sparse PSF blurring operator and the sparse mapping matrix.
+ - The data vector and curvature matrix directly from the sparse blurred mapping matrix, where only the curvature
+   matrix (of dimensions [source_pixels, source_pixels]) is dense.
+
+The reconstruction, log evidence and every other quantity of the fit are identical to the standard `Inversion`.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from scipy import sparse
+import autofit as af
+import autolens as al
+from autoarray.inversion import mappers
+from autoarray.inversion.inversions import InversionImagingMatrix
+from autoarray.structures.arrays.two_d import array_2d
+from autoarray.structures.grids.two_d import grid_2d_pixelization
+from inversion_operators import blurring_operator_from, reconstruction_from
+
+"""
+__Mappers__
+
+The `MapperSparse` is used with the `MapperRectangular` and `MapperVoronoi`, replacing the dense mapping matrix they
+create when they are initialized with a sparse mapping matrix.
+
+The source pixel index of every sub-pixel (the `pixelization_index_for_sub_slim_index`) is computed once and stored,
+as it is used by both the sparse mapping matrix and the adaptive regularization schemes. The dense `mapping_matrix`
+is still available (e.g. for visualization), but is only created if it is used.
+"""
+
+
+class MapperSparse:
+    def __init__(
+        self,
+        source_grid_slim,
+        source_pixelization_grid,
+        data_pixelization_grid=None,
+        hyper_image=None,
+    ):
+        """
+        A mapper whose mapping matrix is a sparse matrix, whose only non-zero entries are the sub-fractions of the
+        sub-pixels that map to every source pixel.
+        """
+        self.source_grid_slim = source_grid_slim
+        self.source_pixelization_grid = source_pixelization_grid
+        self.data_pixelization_grid = data_pixelization_grid
+        self.hyper_image = hyper_image
+
+        self._pixelization_index_for_sub_slim_index = None
+
+        self.sparse_mapping_matrix = sparse.csr_matrix(
+            (
+                np.full(
+                    self.pixelization_index_for_sub_slim_index.shape[0],
+                    self.source_grid_slim.mask.sub_fraction,
+                ),
+                (
+                    self._slim_index_for_sub_slim_index,
+                    self.pixelization_index_for_sub_slim_index,
+                ),
+            ),
+            shape=(self.source_grid_slim.mask.pixels_in_mask, self.pixels),
+        )
+
+    @property
+    def pixelization_index_for_sub_slim_index(self):
+
+        if self._pixelization_index_for_sub_slim_index is None:
+            self._pixelization_index_for_sub_slim_index = (
+                super().pixelization_index_for_sub_slim_index
+            )
+
+        return self._pixelization_index_for_sub_slim_index
+
+    @property
+    def mapping_matrix(self):
+        return self.sparse_mapping_matrix.toarray()
+
+
+class MapperRectangularSparse(MapperSparse, mappers.MapperRectangular):
+
+    pass
+
+
+class MapperVoronoiSparse(MapperSparse, mappers.MapperVoronoi):
+
+    pass
+
+
+"""
+__Pixelizations__
+
+The sparse pixelizations create their mappers in the same way as the **PyAutoLens** pixelizations, but return the
+sparse mappers above. They are used in a `GalaxyModel` in place of the standard pixelizations and have the same
+parameters.
+"""
+
+
+class RectangularSparse(al.pix.Rectangular):
+    def mapper_from_grid_and_sparse_grid(
+        self,
+        grid,
+        sparse_grid=None,
+        sparse_image_plane_grid=None,
+        hyper_image=None,
+        settings=al.SettingsPixelization(),
+    ):
+
+        if settings.use_border:
+            relocated_grid = grid.relocated_grid_from_grid(grid=grid)
+        else:
+            relocated_grid = grid
+
+        pixelization_grid = grid_2d_pixelization.Grid2DRectangular.overlay_grid(
+            shape_native=self.shape, grid=relocated_grid
+        )
+
+        return MapperRectangularSparse(
+            source_grid_slim=relocated_grid,
+            source_pixelization_grid=pixelization_grid,
+            hyper_image=hyper_image,
+        )
+
+
+class VoronoiSparse:
+    def mapper_from_grid_and_sparse_grid(
+        self,
+        grid,
+        sparse_grid=None,
+        sparse_image_plane_grid=None,
+        hyper_image=None,
+        settings=al.SettingsPixelization(),
+    ):
+
+        if settings.use_border:
+            relocated_grid = grid.relocated_grid_from_grid(grid=grid)
+            relocated_pixelization_grid = grid.relocated_pixelization_grid_from_pixelization_grid(
+                pixelization_grid=sparse_grid
+            )
+        else:
+            relocated_grid = grid
+            relocated_pixelization_grid = sparse_grid
+
+        pixelization_grid = grid_2d_pixelization.Grid2DVoronoi(
+            grid=relocated_pixelization_grid,
+            nearest_pixelization_index_for_slim_index=sparse_grid.sparse_index_for_slim_index,
+        )
+
+        return MapperVoronoiSparse(
+            source_grid_slim=relocated_grid,
+            source_pixelization_grid=pixelization_grid,
+            data_pixelization_grid=sparse_image_plane_grid,
+            hyper_image=hyper_image,
+        )
+
+
+class VoronoiMagnificationSparse(VoronoiSparse, al.pix.VoronoiMagnification):
+
+    pass
+
+
+class VoronoiBrightnessImageSparse(VoronoiSparse, al.pix.VoronoiBrightnessImage):
+
+    pass
+
+
+"""
+__Blurring Operator__
+
+The PSF convolution of the `Convolver` is stored as a sparse matrix of dimensions [image_pixels, image_pixels], whose
+columns are the PSF centred on every image pixel (including only the image pixels in the mask). The blurred mapping
+matrix is then the product of this matrix and the sparse mapping matrix.
+
+The blurring operator is created (once per `Convolver`) by the `blurring_operator_from` function of the
+`inversion_operators.py` module, which the other `performance` scripts share.
+"""
+
+
+"""
+__Inversion__
+
+The `InversionImagingSparse` is an `InversionImagingMatrix` whose blurred mapping matrix is sparse. Only the methods
+which use the blurred mapping matrix are changed.
+"""
+
+
+class InversionImagingSparse(InversionImagingMatrix):
+    @classmethod
+    def from_data_mapper_and_regularization(
+        cls,
+        image,
+        noise_map,
+        convolver,
+        mapper,
+        regularization,
+        settings=al.SettingsInversion(),
+    ):
+
+        blurring_operator = blurring_operator_from(convolver=convolver)
+
+        blurred_mapping_matrix = (
+            blurring_operator @ mapper.sparse_mapping_matrix
+        ).tocsr()
+
+        inverse_noise_map = 1.0 / np.asarray(noise_map)
+
+        weighted_mapping_matrix = (
+            sparse.diags(inverse_noise_map) @ blurred_mapping_matrix
+        ).tocsr()
+
+        data_vector = weighted_mapping_matrix.T @ (
+            np.asarray(image) * inverse_noise_map
+        )
+
+        curvature_matrix = (
+            weighted_mapping_matrix.T @ weighted_mapping_matrix
+        ).toarray()
+
+        regularization_matrix = regularization.regularization_matrix_from_mapper(
+            mapper=mapper
+        )
+
+        curvature_reg_matrix = np.add(curvature_matrix, regularization_matrix)
+
+        values = reconstruction_from(
+            curvature_reg_matrix=curvature_reg_matrix,
+            data_vector=data_vector,
+            check_solution=settings.check_solution,
+        )
+
+        return InversionImagingSparse(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            blurred_mapping_matrix=blurred_mapping_matrix,
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            reconstruction=values,
+            settings=settings,
+        )
+
+    @property
+    def mapped_reconstructed_image(self):
+
+        reconstructed_image = self.blurred_mapping_matrix @ self.reconstruction
+
+        return array_2d.Array2D(
+            array=reconstructed_image,
+            mask=self.mapper.source_grid_slim.mask.mask_sub_1,
+            store_slim=True,
+        )
+
+
+"""
+__Tracer__
+
+The `TracerSparse` uses the `InversionImagingSparse` when the mapper of its source plane is sparse, which is the case
+when its pixelization is one of the sparse pixelizations above.
+"""
+
+
+class TracerSparse(al.Tracer):
+    def inversion_imaging_from_grid_and_data(
+        self,
+        grid,
+        image,
+        noise_map,
+        convolver,
+        settings_pixelization=al.SettingsPixelization(),
+        settings_inversion=al.SettingsInversion(),
+    ):
+
+        mapper = self.mappers_of_planes_from_grid(
+            grid=grid, settings_pixelization=settings_pixelization
+        )[-1]
+
+        if not isinstance(mapper, MapperSparse):
+            return InversionImagingMatrix.from_data_mapper_and_regularization(
+                image=image,
+                noise_map=noise_map,
+                convolver=convolver,
+                mapper=mapper,
+                regularization=self.regularizations_of_planes[-1],
+                settings=settings_inversion,
+            )
+
+        return InversionImagingSparse.from_data_mapper_and_regularization(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=self.regularizations_of_planes[-1],
+            settings=settings_inversion,
+        )
+
+
+"""
+__Analysis__
+
+The `AnalysisSparse` creates a `TracerSparse` for every model instance.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisSparse(a.Analysis):
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerSparse(planes=tracer.planes, cosmology=tracer.cosmology)
+
+
+"""
+__Phase__
+
+The `PhaseImagingSparse` uses the `AnalysisSparse`, and can be used in place of the `PhaseImaging` in any pipeline.
+"""
+
+
+class PhaseImagingSparse(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisSparse(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `hst_up` dataset, which has a pixel scale of 0.03" and therefore a large number of image pixels in a 3.0"
+circular mask.
+"""
+dataset_name = "hst_up"
+dataset_path = path.join("dataset", "imaging", "instruments", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.03,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+masked_imaging = al.MaskedImaging(
+    imaging=imaging, mask=mask, settings=al.SettingsMaskedImaging(sub_size=2)
+)
+
+"""
+__Comparison__
+
+We fit the true lens model of the dataset with a 40 x 40 source pixelization using the dense and sparse mapping
+matrices, and compare their run times, the memory of their blurred mapping matrices and their log evidences.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.8, phi=45.0),
+    ),
+)
+
+pixelizations = {
+    "Rectangular": (
+        al.pix.Rectangular(shape=(40, 40)),
+        RectangularSparse(shape=(40, 40)),
+    ),
+    "VoronoiMagnification": (
+        al.pix.VoronoiMagnification(shape=(40, 40)),
+        VoronoiMagnificationSparse(shape=(40, 40)),
+    ),
+}
+
+repeats = 3
+
+for name, (pixelization, pixelization_sparse) in pixelizations.items():
+
+    for label, pix in [("dense", pixelization), ("sparse", pixelization_sparse)]:
+
+        source_galaxy = al.Galaxy(
+            redshift=1.0,
+            pixelization=pix,
+            regularization=al.reg.Constant(coefficient=1.0),
+        )
+
+        tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+        tracer = TracerSparse(planes=tracer.planes, cosmology=tracer.cosmology)
+
+        start = time.time()
+        for _ in range(repeats):
+            fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer)
+            fit.log_evidence
+        print(f"{name} {label} FitImaging time = {(time.time() - start) / repeats} s")
+
+        blurred_mapping_matrix = fit.inversion.blurred_mapping_matrix
+
+        if sparse.issparse(blurred_mapping_matrix):
+            memory = (
+                blurred_mapping_matrix.data.nbytes
+                + blurred_mapping_matrix.indices.nbytes
+                + blurred_mapping_matrix.indptr.nbytes
+            )
+        else:
+            memory = blurred_mapping_matrix.nbytes
+
+        print(f"{name} {label} blurred mapping matrix memory = {memory / 1e6} MB")
+        print(f"{name} {label} log evidence = {fit.log_evidence}")
+
+"""
+__Phase__
+
+We now fit a lens model with a `VoronoiMagnificationSparse` source using the `PhaseImagingSparse`.
+"""
+lens = al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal)
+source = al.GalaxyModel(
+    redshift=1.0,
+    pixelization=VoronoiMagnificationSparse,
+    regularization=al.reg.Constant,
+)
+
+phase = PhaseImagingSparse(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "sparse_mapping_matrix"),
+        name="phase_sparse",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(lens=lens, source=source),
+    settings=al.SettingsPhaseImaging(
+        settings_masked_imaging=al.SettingsMaskedImaging(sub_size=2)
+    ),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
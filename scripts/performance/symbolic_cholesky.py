@@ -0,0 +1,473 @@
+"""
+Performance: Symbolic Cholesky
+==============================
+
+Every likelihood evaluation of an `Inversion` factorizes the curvature + regularization matrix F + H
+[source_pixels, source_pixels] three times, using dense algorithms whose cost scales with source_pixels^3:
+
+ - It solves (F + H) s = D for the reconstruction.
+ - It computes the log determinant of F + H using a Cholesky decomposition.
+ - It computes the log determinant of the regularization matrix H using a Cholesky decomposition.
+
+This script removes two of these dense factorizations:
+
+ - F + H is factorized once, using a dense Cholesky decomposition (`scipy.linalg.cho_factor`), and its factor is
+   reused for both the solution (`scipy.linalg.cho_solve`) and the log determinant. The solve and log determinant no
+   longer factorize the same matrix twice, which is where most of the time is saved.
+ - H is factorized as a banded matrix, using a symbolic analysis which is performed once per pixelization topology.
+
+Every source pixel of H is paired only with its neighbors, and its non-zero pattern is fixed by the topology of the
+pixelization, which for a `Rectangular` pixelization is its shape and for a Voronoi pixelization changes only slightly
+between lens models. The `Constant` and `AdaptiveBrightness` regularizations only change its values. The symbolic
+analysis is a reverse Cuthill-McKee ordering (from `scipy.sparse.csgraph`), which reorders the source pixels such that
+every non-zero entry of H lies close to the diagonal. The reordered matrix is factorized as a banded matrix (using
+`scipy.linalg.cholesky_banded`), whose cost scales with source_pixels * bandwidth^2, and for a 40 x 40 `Rectangular`
+pixelization its bandwidth is ~40.
+
+F + H is not factorized this way. Every source pixel of F is paired with every source pixel whose image pixels are
+blurred together by the PSF, which includes the source pixels of every multiple image of the lens. These pairings
+are far apart in the source plane, so no ordering gives F + H a narrow band (for a 40 x 40 `Rectangular` pixelization
+its bandwidth after reordering is over 1000) and a banded factorization is no faster than the dense one.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import time
+import numpy as np
+from os import path
+from scipy import linalg
+from scipy import sparse
+from scipy.sparse import csgraph
+import autofit as af
+import autolens as al
+from autoarray import exc
+from autoarray.inversion import inversion_util
+from autoarray.inversion import mappers
+from autoarray.inversion.inversions import InversionImagingMatrix
+
+"""
+__Symbolic Analysis__
+
+The `SymbolicAnalysis` of a non-zero pattern is the ordering of the source pixels and the bandwidth of the reordered
+pattern. The analysis of the regularization matrix of every pixelization topology is stored in the `symbolic_analyses`
+dictionary, which is keyed by the type of mapper, its number of pixels and (for a `Rectangular` pixelization) its
+shape.
+"""
+
+
+def bandwidth_from(pattern, ordering):
+    """
+    Returns the bandwidth of a symmetric non-zero pattern after its rows and columns are reordered, which is the largest
+    distance of any non-zero entry from the diagonal.
+    """
+    position = np.empty(ordering.shape[0], dtype="int")
+    position[ordering] = np.arange(ordering.shape[0])
+
+    rows, columns = np.nonzero(pattern)
+
+    return int(np.max(np.abs(position[rows] - position[columns]), initial=0))
+
+
+class SymbolicAnalysis:
+    def __init__(self, ordering, bandwidth):
+        """
+        The symbolic analysis of the non-zero pattern of a symmetric matrix, which reorders its rows and columns such that
+        every non-zero entry lies within the bandwidth of the diagonal.
+
+        Parameters
+        ----------
+        ordering : np.ndarray
+            The index of the row (and column) of the matrix which is placed at every row of the reordered matrix.
+        bandwidth : int
+            The largest distance from the diagonal of any non-zero entry of the reordered matrix.
+        """
+        self.ordering = ordering
+        self.bandwidth = bandwidth
+
+    @classmethod
+    def from_pattern(cls, pattern):
+
+        ordering = csgraph.reverse_cuthill_mckee(
+            sparse.csr_matrix(pattern), symmetric_mode=True
+        ).astype("int")
+
+        return SymbolicAnalysis(
+            ordering=ordering,
+            bandwidth=bandwidth_from(pattern=pattern, ordering=ordering),
+        )
+
+
+symbolic_analyses = {}
+
+
+def topology_key_from(mapper):
+
+    if isinstance(mapper, mappers.MapperRectangular):
+        return type(mapper).__name__, mapper.pixels, mapper.shape_native
+
+    return type(mapper).__name__, mapper.pixels
+
+
+def symbolic_analysis_from(matrix, key, reanalysis_factor=1.5):
+    """
+    Returns the `SymbolicAnalysis` of a matrix, reusing the analysis stored for its key.
+
+    The stored ordering is reused for any pattern, with the bandwidth increased if the pattern has non-zero entries
+    outside it. If the bandwidth exceeds the `reanalysis_factor` times the bandwidth of the pattern the ordering was
+    computed for, the pattern is analysed again.
+    """
+    pattern = matrix != 0.0
+
+    if key in symbolic_analyses:
+
+        analysed_bandwidth, analysis = symbolic_analyses[key]
+
+        bandwidth = bandwidth_from(pattern=pattern, ordering=analysis.ordering)
+
+        if bandwidth <= analysis.bandwidth:
+            return analysis
+
+        if bandwidth <= reanalysis_factor * analysed_bandwidth:
+            analysis = SymbolicAnalysis(
+                ordering=analysis.ordering, bandwidth=bandwidth
+            )
+            symbolic_analyses[key] = (analysed_bandwidth, analysis)
+            return analysis
+
+    analysis = SymbolicAnalysis.from_pattern(pattern=pattern)
+
+    symbolic_analyses[key] = (analysis.bandwidth, analysis)
+
+    return analysis
+
+
+"""
+__Cholesky Factor__
+
+The `CholeskyFactor` is the numerical factorization of a matrix reordered by its `SymbolicAnalysis`. It stores the
+lower triangular factor in the banded format of `scipy.linalg.cholesky_banded`, where row k is the k-th diagonal below
+the main diagonal.
+"""
+
+
+class CholeskyFactor:
+    def __init__(self, factor, ordering):
+
+        self.factor = factor
+        self.ordering = ordering
+
+    @classmethod
+    def from_matrix_and_analysis(cls, matrix, analysis):
+        """
+        Returns the Cholesky factor of a symmetric positive-definite matrix, which raises an `InversionException` if
+        the matrix is not positive-definite (in the same way as the `Inversion`).
+        """
+        reordered = matrix[np.ix_(analysis.ordering, analysis.ordering)]
+
+        banded = np.zeros((analysis.bandwidth + 1, matrix.shape[0]))
+
+        for k in range(analysis.bandwidth + 1):
+            banded[k, : matrix.shape[0] - k] = np.diagonal(reordered, offset=-k)
+
+        try:
+            factor = linalg.cholesky_banded(banded, lower=True, check_finite=False)
+        except linalg.LinAlgError:
+            raise exc.InversionException()
+
+        return CholeskyFactor(factor=factor, ordering=analysis.ordering)
+
+    @property
+    def log_determinant(self):
+        return 2.0 * np.sum(np.log(self.factor[0]))
+
+
+"""
+__Inversion__
+
+The `InversionImagingCholesky` is an `InversionImagingMatrix` which factorizes the curvature + regularization matrix
+once, and solves for the reconstruction and computes its log determinant from the same (dense) Cholesky factor. The
+log determinant of the regularization matrix is computed from its banded Cholesky factor.
+
+The regularization matrix is only factorized if its log determinant is used (e.g. by the log evidence of a fit).
+"""
+
+
+class InversionImagingCholesky(InversionImagingMatrix):
+    def __init__(
+        self,
+        image,
+        noise_map,
+        convolver,
+        mapper,
+        regularization,
+        blurred_mapping_matrix,
+        regularization_matrix,
+        curvature_reg_matrix,
+        curvature_reg_factor,
+        reconstruction,
+        settings,
+    ):
+
+        super().__init__(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            blurred_mapping_matrix=blurred_mapping_matrix,
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            reconstruction=reconstruction,
+            settings=settings,
+        )
+
+        self.curvature_reg_factor = curvature_reg_factor
+
+    @classmethod
+    def from_data_mapper_and_regularization(
+        cls,
+        image,
+        noise_map,
+        convolver,
+        mapper,
+        regularization,
+        settings=al.SettingsInversion(),
+    ):
+
+        blurred_mapping_matrix = convolver.convolve_mapping_matrix(
+            mapping_matrix=mapper.mapping_matrix
+        )
+
+        data_vector = inversion_util.data_vector_via_blurred_mapping_matrix_from(
+            blurred_mapping_matrix=blurred_mapping_matrix,
+            image=image,
+            noise_map=noise_map,
+        )
+
+        curvature_matrix = inversion_util.curvature_matrix_via_mapping_matrix_from(
+            mapping_matrix=blurred_mapping_matrix, noise_map=noise_map
+        )
+
+        regularization_matrix = regularization.regularization_matrix_from_mapper(
+            mapper=mapper
+        )
+
+        curvature_reg_matrix = np.add(curvature_matrix, regularization_matrix)
+
+        try:
+            curvature_reg_factor = linalg.cho_factor(
+                curvature_reg_matrix, lower=True, check_finite=False
+            )
+        except linalg.LinAlgError:
+            raise exc.InversionException()
+
+        values = linalg.cho_solve(
+            curvature_reg_factor, data_vector, check_finite=False
+        )
+
+        if settings.check_solution:
+            if np.isclose(a=values[0], b=values[1], atol=1e-4).all():
+                if np.isclose(a=values[0], b=values, atol=1e-4).all():
+                    raise exc.InversionException()
+
+        return InversionImagingCholesky(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            blurred_mapping_matrix=blurred_mapping_matrix,
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            curvature_reg_factor=curvature_reg_factor,
+            reconstruction=values,
+            settings=settings,
+        )
+
+    @property
+    def log_det_curvature_reg_matrix_term(self):
+        return 2.0 * np.sum(np.log(np.diagonal(self.curvature_reg_factor[0])))
+
+    @property
+    def log_det_regularization_matrix_term(self):
+
+        regularization_factor = CholeskyFactor.from_matrix_and_analysis(
+            matrix=self.regularization_matrix,
+            analysis=symbolic_analysis_from(
+                matrix=self.regularization_matrix,
+                key=("regularization_matrix",) + topology_key_from(mapper=self.mapper),
+            ),
+        )
+
+        return regularization_factor.log_determinant
+
+
+"""
+__Tracer__
+
+The `TracerCholesky` uses the `InversionImagingCholesky` for its source-plane inversion.
+"""
+
+
+class TracerCholesky(al.Tracer):
+    def inversion_imaging_from_grid_and_data(
+        self,
+        grid,
+        image,
+        noise_map,
+        convolver,
+        settings_pixelization=al.SettingsPixelization(),
+        settings_inversion=al.SettingsInversion(),
+    ):
+
+        mapper = self.mappers_of_planes_from_grid(
+            grid=grid, settings_pixelization=settings_pixelization
+        )[-1]
+
+        return InversionImagingCholesky.from_data_mapper_and_regularization(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=self.regularizations_of_planes[-1],
+            settings=settings_inversion,
+        )
+
+
+"""
+__Analysis__
+
+The `AnalysisCholesky` creates a `TracerCholesky` for every model instance.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisCholesky(a.Analysis):
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerCholesky(planes=tracer.planes, cosmology=tracer.cosmology)
+
+
+"""
+__Phase__
+
+The `PhaseImagingCholesky` uses the `AnalysisCholesky`, and can be used in place of the `PhaseImaging` in any
+pipeline.
+"""
+
+
+class PhaseImagingCholesky(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = al.MaskedImaging(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisCholesky(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `mass_sie__source_sersic` dataset.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+masked_imaging = al.MaskedImaging(imaging=imaging, mask=mask)
+
+"""
+__Comparison__
+
+We fit the true lens model of the dataset with a `Rectangular` source using the standard and Cholesky inversions, and
+compare their run times and log evidences. The first fit of the `TracerCholesky` performs the symbolic analysis of the
+regularization matrix, so we time it separately from the fits which reuse it.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.Rectangular(shape=(40, 40)),
+    regularization=al.reg.Constant(coefficient=1.0),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+tracer_cholesky = TracerCholesky(planes=tracer.planes, cosmology=tracer.cosmology)
+
+start = time.time()
+fit = al.FitImaging(masked_imaging=masked_imaging, tracer=tracer_cholesky)
+fit.log_evidence
+print(f"Cholesky first FitImaging time = {time.time() - start} s")
+
+for analysis_key, (_, analysis) in symbolic_analyses.items():
+    print(f"{analysis_key[0]} bandwidth = {analysis.bandwidth}")
+
+repeats = 5
+
+for name, fit_tracer in [("Standard", tracer), ("Cholesky", tracer_cholesky)]:
+
+    start = time.time()
+    for _ in range(repeats):
+        fit = al.FitImaging(masked_imaging=masked_imaging, tracer=fit_tracer)
+        fit.log_evidence
+    print(f"{name} FitImaging time = {(time.time() - start) / repeats} s")
+    print(f"{name} log evidence = {fit.log_evidence}")
+
+"""
+__Phase__
+
+We now fit the dataset with a `Rectangular` source, where every likelihood evaluation reuses the symbolic analysis
+of the regularization matrix of the first.
+"""
+phase = PhaseImagingCholesky(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "symbolic_cholesky"),
+        name="phase__source_inversion_rectangular",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal),
+        source=al.GalaxyModel(
+            redshift=1.0,
+            pixelization=al.pix.Rectangular,
+            regularization=al.reg.Constant,
+        ),
+    ),
+)
+
+phase.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""
@@ -0,0 +1,895 @@
+"""
+Performance: Tabulated Deflections
+==================================
+
+The deflection angles of the `EllipticalNFW`, `EllipticalGeneralizedNFW` and `EllipticalCoredPowerLaw` mass
+profiles have no analytic solution, and are computed by numerically integrating their convergence for every (y,x)
+coordinate. This is why `config/grids/interpolate.ini` marks them for interpolation when using a `Grid2DInterpolate`.
+
+For model-fits which evaluate these profiles millions of times (for example the dark matter of the `SetupMassLightDark`
+SLaM pipelines, or the NFW subhalos of a subhalo grid search) this script shows how their deflection angles can
+instead be computed from precomputed tables, which are calculated once, stored on disk and loaded by every
+subsequent model-fit.
+
+The tables are dimensionless, in that coordinates are divided by the profile's scale length (the `scale_radius` of
+the NFW profiles and the `core_radius` of the cored power-law) and the deflection angles by its normalization. A
+single table therefore applies to every profile, and is a function of only:
+
+ - The scaled radius of the coordinate from the profile centre.
+ - The angle of the coordinate in the profile's reference frame.
+ - The axis-ratio of the profile.
+ - The inner slope of the `EllipticalGeneralizedNFW` or slope of the `EllipticalCoredPowerLaw`.
+
+Deflection angles are computed by cubic interpolation of the table. When a table is created, its interpolation
+error is measured (see below), and the table is refined until this error is below an input tolerance. A table is
+never used with an error above the tolerance it is requested with.
+
+Coordinates outside the radial range of a table, and profiles whose axis-ratio or slope is outside the range of their
+table, have their deflection angles computed by integration (using the same quadrature used to compute the tables).
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import os
+import time
+import numpy as np
+from os import path
+import autolens as al
+from autogalaxy import exc
+from autoarray.structures.grids import grid_decorators
+
+"""
+__Integrals__
+
+For an elliptical mass profile with convergence k(xi), where xi is the elliptical radius, the deflection angles in the
+reference frame of the profile are:
+
+ deflection_y = y * T_1(y, x) and deflection_x = x * T_0(y, x)
+
+where:
+
+ T_n(y, x) = axis_ratio * integral[k(xi(u)) / (1 - (1 - axis_ratio**2) * u) ** (n + 0.5)] from u=0 to u=1
+
+ xi(u) = sqrt(u * (x**2 + y**2 / (1 - (1 - axis_ratio**2) * u)))
+
+This is the calculation **PyAutoLens** performs for these profiles. The tables store the logarithm of the integrals
+T_1 and T_0, which are positive and vary smoothly (as a power-law at small and large radii) with the logarithm of
+radius, such that interpolation is accurate.
+
+The integrals are computed via Gauss-Legendre quadrature, after the change of variable u = t ** power, which removes
+the divergence of a cuspy convergence at u=0 and resolves the scale radius (or core) of the profile at u ~ 1 / r**2 for
+coordinates at large radii r.
+"""
+
+
+def quadrature_from(total_points, power):
+    """
+    Returns the values of the integration variable u and their weights for Gauss-Legendre quadrature between u=0 and
+    u=1, after the change of variable u = t ** power (the weights include the term du / dt).
+    """
+    t, weights = np.polynomial.legendre.leggauss(total_points)
+
+    t = 0.5 * (t + 1.0)
+    weights = 0.5 * weights
+
+    return t ** power, weights * power * t ** (power - 1.0)
+
+
+def deflection_integrals_from(
+    grid,
+    axis_ratio,
+    convergence_func,
+    shape_parameter,
+    power,
+    quadrature_points=128,
+    pixels_per_batch=2 ** 12,
+):
+    """
+    Returns the integrals T_1 and T_0 (see above) at every dimensionless (y,x) coordinate of a grid, as an ndarray of
+    shape [total_coordinates, 2].
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        The dimensionless (y,x) coordinates in the reference frame of the profile.
+    axis_ratio : float
+        The axis-ratio of the profile.
+    convergence_func : func
+        The dimensionless convergence of the profile as a function of the dimensionless elliptical radius and the
+        shape parameter.
+    shape_parameter : float or None
+        The inner slope or slope of the profile, which is passed to `convergence_func`.
+    power : float
+        The power of the change of variable u = t ** power used for the quadrature.
+    """
+    u, weights = quadrature_from(total_points=quadrature_points, power=power)
+
+    denominator = 1.0 - (1.0 - axis_ratio ** 2) * u
+
+    integrals = np.zeros((grid.shape[0], 2))
+
+    for start in range(0, grid.shape[0], pixels_per_batch):
+
+        y_squared = grid[start : start + pixels_per_batch, 0, None] ** 2
+        x_squared = grid[start : start + pixels_per_batch, 1, None] ** 2
+
+        xi = np.sqrt(u * (x_squared + y_squared / denominator))
+
+        convergence = weights * convergence_func(xi, shape_parameter)
+
+        integrals[start : start + pixels_per_batch, 0] = axis_ratio * (
+            convergence @ denominator ** -1.5
+        )
+        integrals[start : start + pixels_per_batch, 1] = axis_ratio * (
+            convergence @ denominator ** -0.5
+        )
+
+    return integrals
+
+
+"""
+__Convergence__
+
+The dimensionless convergence of each profile, where xi is the elliptical radius divided by the scale length. The
+deflection angles computed from these are multiplied by the following factors:
+
+ - `EllipticalCoredPowerLaw`: einstein_radius_rescaled * core_radius ** (2 - slope).
+ - `EllipticalNFW`: kappa_s * scale_radius.
+ - `EllipticalGeneralizedNFW`: kappa_s * scale_radius.
+"""
+
+
+def convergence_cored_power_law_from(xi, slope):
+    return (1.0 + xi ** 2) ** (-(slope - 1.0) / 2.0)
+
+
+def convergence_nfw_from(xi, shape_parameter=None):
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        coord_func = np.where(
+            xi > 1.0,
+            np.arccos(np.minimum(1.0 / xi, 1.0)) / np.sqrt(np.abs(xi ** 2 - 1.0)),
+            np.arccosh(np.maximum(1.0 / xi, 1.0)) / np.sqrt(np.abs(1.0 - xi ** 2)),
+        )
+
+        convergence = 2.0 * (1.0 - coord_func) / (xi ** 2 - 1.0)
+
+    return np.where(np.abs(xi - 1.0) < 1.0e-7, 2.0 / 3.0, convergence)
+
+
+"""
+The convergence of the `EllipticalGeneralizedNFW` includes an integral over the line-of-sight, I(xi), which is
+tabulated once for every inner slope on a fine logarithmic grid of radii (in the same way as **PyAutoLens**).
+
+This integral is over y=0 to y=1 and peaks at y ~ xi, so it is computed via Gauss-Legendre quadrature after the
+change of variable y = sin(theta) and theta = exp(v), which is accurate for every radius.
+"""
+
+generalized_nfw_integrals = {}
+
+
+def generalized_nfw_integral_from(xi, inner_slope, quadrature_points=256):
+
+    if inner_slope not in generalized_nfw_integrals:
+
+        log_xi = np.linspace(-10.0, 6.0, 1601)
+        eta = 10.0 ** log_xi[:, None]
+
+        v_min = np.log(1.0e-6 * np.minimum(eta, 1.0))
+        v_range = np.log(0.5 * np.pi) - v_min
+
+        t, weights = np.polynomial.legendre.leggauss(quadrature_points)
+
+        theta = np.exp(v_min + 0.5 * (t + 1.0) * v_range)
+
+        integrand = (
+            (np.sin(theta) + eta) ** (inner_slope - 4.0)
+            * 2.0
+            * np.sin(0.5 * theta) ** 2
+            * np.cos(theta)
+            * theta
+        )
+
+        integral = np.sum(integrand * 0.5 * weights * v_range, axis=1)
+
+        generalized_nfw_integrals[inner_slope] = (log_xi, np.log10(integral))
+
+    log_xi, log_integral = generalized_nfw_integrals[inner_slope]
+
+    return 10.0 ** np.interp(np.log10(xi), log_xi, log_integral)
+
+
+def convergence_generalized_nfw_from(xi, inner_slope):
+    return (
+        2.0
+        * xi ** (1.0 - inner_slope)
+        * (
+            (1.0 + xi) ** (inner_slope - 3.0)
+            + (3.0 - inner_slope)
+            * generalized_nfw_integral_from(xi=xi, inner_slope=inner_slope)
+        )
+    )
+
+
+"""
+__Table__
+
+A `DeflectionTable` stores the logarithm of the integrals T_1 and T_0 on a regular grid of log10 scaled radius,
+angle, axis-ratio and shape parameter (a table whose profile has no shape parameter, the `EllipticalNFW`, has one
+value for this dimension).
+
+The table is interpolated using cubic (4 point Lagrange) interpolation along every dimension. Linear interpolation
+requires a table too large to store in memory to reach a fractional error of 1e-4.
+
+__Error Bound__
+
+The error of interpolating a table is largest near the centre of the table's cells, and the error of interpolating
+along every dimension is bounded by the sum of the errors of interpolating along each dimension separately. When a
+table is created, we therefore compute the integrals exactly at the mid-point of every cell along each dimension,
+and store the sum over dimensions of the maximum fractional error of interpolating to these mid-points as the
+table's `max_fractional_error`.
+
+The table is stored in single precision, which adds a fractional error of ~1e-6. This error is computed from the
+stored table and included in its `max_fractional_error`.
+
+While this error exceeds the input tolerance, the number of values in the dimension with the largest error is doubled
+and the table recomputed. If the tolerance cannot be reached without the table exceeding `max_table_values` values
+(or is below the single precision error), a `ProfileException` is raised, as opposed to using a less accurate table.
+"""
+
+
+def interpolation_stencil_from(values, value):
+    """
+    Returns the indexes and weights of the 4 values of the 1D array `values` (which are uniformly spaced and in
+    ascending order) used to interpolate it at `value` via cubic Lagrange interpolation, where `value` can be a float
+    or ndarray.
+
+    If `values` has fewer than 4 entries (e.g. the shape parameter of the `EllipticalNFW`) its first value is used.
+    """
+    value = np.asarray(value, dtype="float")
+
+    indexes = np.zeros(value.shape + (4,), dtype="int")
+    weights = np.zeros(value.shape + (4,))
+
+    if values.shape[0] < 4:
+        weights[..., 0] = 1.0
+        return indexes, weights
+
+    position = (value - values[0]) / (values[1] - values[0])
+
+    lower_index = np.clip(np.floor(position).astype("int") - 1, 0, values.shape[0] - 4)
+
+    s = position - lower_index
+
+    indexes[:] = lower_index[..., None] + np.arange(4)
+
+    weights[..., 0] = -(s - 1.0) * (s - 2.0) * (s - 3.0) / 6.0
+    weights[..., 1] = s * (s - 2.0) * (s - 3.0) / 2.0
+    weights[..., 2] = -s * (s - 1.0) * (s - 3.0) / 2.0
+    weights[..., 3] = s * (s - 1.0) * (s - 2.0) / 6.0
+
+    return indexes, weights
+
+
+class DeflectionTable:
+    def __init__(
+        self,
+        log_radii,
+        angles,
+        axis_ratios,
+        shape_parameters,
+        log_integrals,
+        max_fractional_error,
+    ):
+        """
+        A table of the dimensionless deflection angle integrals of an elliptical mass profile.
+
+        Parameters
+        ----------
+        log_radii : np.ndarray
+            The log10 dimensionless radii of the table.
+        angles : np.ndarray
+            The angles (in radians, between 0 and pi / 2) of the table in the profile's reference frame.
+        axis_ratios : np.ndarray
+            The axis-ratios of the table.
+        shape_parameters : np.ndarray
+            The inner slopes or slopes of the table.
+        log_integrals : np.ndarray
+            The log10 integrals T_1 and T_0, of shape [radii, angles, axis_ratios, shape_parameters, 2].
+        max_fractional_error : float
+            The estimated maximum fractional error of interpolating the table.
+        """
+        self.log_radii = log_radii
+        self.angles = angles
+        self.axis_ratios = axis_ratios
+        self.shape_parameters = shape_parameters
+        self.log_integrals = log_integrals
+        self.max_fractional_error = max_fractional_error
+
+    def is_valid_for(self, tolerance):
+        return self.max_fractional_error <= tolerance
+
+    @classmethod
+    def from_convergence_func(
+        cls,
+        convergence_func,
+        power_func,
+        log_radii,
+        angles,
+        axis_ratios,
+        shape_parameters,
+        tolerance=1.0e-4,
+        max_table_values=1.0e8,
+    ):
+        """
+        Compute a table for a profile's dimensionless convergence, refining it until its estimated maximum
+        fractional error is below the tolerance.
+
+        When an axis is refined, the exact integrals at its mid-points (computed to estimate the error) are
+        interleaved with the table, as opposed to recomputing the table.
+
+        Parameters
+        ----------
+        convergence_func : func
+            The dimensionless convergence of the profile.
+        power_func : func
+            Returns the power of the change of variable of the quadrature for a shape parameter.
+        tolerance : float
+            The maximum fractional error of the table's deflection angles.
+        max_table_values : float
+            The maximum number of values of the table. If the table must be larger to reach the tolerance, a
+            `ProfileException` is raised.
+        """
+        axes = [log_radii, angles, axis_ratios, shape_parameters]
+
+        log_integrals = log_integrals_from(
+            convergence_func=convergence_func, power_func=power_func, axes=axes
+        )
+
+        while True:
+
+            errors, log_integrals_mid = zip(
+                *[
+                    max_fractional_error_along_axis_from(
+                        convergence_func=convergence_func,
+                        power_func=power_func,
+                        axes=axes,
+                        log_integrals=log_integrals,
+                        axis=axis,
+                    )
+                    for axis in range(4)
+                ]
+            )
+
+            single_precision_error = single_precision_error_from(
+                log_integrals=log_integrals
+            )
+
+            max_fractional_error = sum(errors) + single_precision_error
+
+            if max_fractional_error < tolerance:
+                break
+
+            axis = int(np.argmax(errors))
+
+            total_values_refined = (
+                log_integrals.size
+                // log_integrals.shape[axis]
+                * (2 * log_integrals.shape[axis] - 1)
+            )
+
+            if (
+                single_precision_error >= tolerance
+                or total_values_refined > max_table_values
+            ):
+                raise exc.ProfileException(
+                    f"A deflection table with an estimated maximum fractional error of {max_fractional_error} "
+                    f"cannot be refined to the tolerance of {tolerance} within {int(max_table_values)} values."
+                )
+
+            axes[axis] = np.linspace(
+                axes[axis][0], axes[axis][-1], 2 * axes[axis].shape[0] - 1
+            )
+
+            log_integrals_refined = np.zeros(
+                log_integrals.shape[:axis]
+                + (axes[axis].shape[0],)
+                + log_integrals.shape[axis + 1 :]
+            )
+
+            index = [slice(None)] * log_integrals.ndim
+            index[axis] = slice(0, None, 2)
+            log_integrals_refined[tuple(index)] = log_integrals
+            index[axis] = slice(1, None, 2)
+            log_integrals_refined[tuple(index)] = log_integrals_mid[axis]
+
+            log_integrals = log_integrals_refined
+
+        return cls(
+            log_radii=axes[0],
+            angles=axes[1],
+            axis_ratios=axes[2],
+            shape_parameters=axes[3],
+            log_integrals=log_integrals.astype("float32"),
+            max_fractional_error=max_fractional_error,
+        )
+
+    @classmethod
+    def from_npz(cls, file_path):
+
+        arrays = np.load(file_path)
+
+        return cls(
+            log_radii=arrays["log_radii"],
+            angles=arrays["angles"],
+            axis_ratios=arrays["axis_ratios"],
+            shape_parameters=arrays["shape_parameters"],
+            log_integrals=arrays["log_integrals"],
+            max_fractional_error=float(arrays["max_fractional_error"]),
+        )
+
+    def output_to_npz(self, file_path):
+
+        np.savez(
+            file_path,
+            log_radii=self.log_radii,
+            angles=self.angles,
+            axis_ratios=self.axis_ratios,
+            shape_parameters=self.shape_parameters,
+            log_integrals=self.log_integrals,
+            max_fractional_error=self.max_fractional_error,
+        )
+
+    def contains(self, axis_ratio, shape_parameter):
+
+        shape_parameter = 0.0 if shape_parameter is None else shape_parameter
+
+        return (self.axis_ratios[0] <= axis_ratio <= self.axis_ratios[-1]) and (
+            self.shape_parameters.shape[0] == 1
+            or self.shape_parameters[0] <= shape_parameter <= self.shape_parameters[-1]
+        )
+
+    def integrals_from(self, grid, axis_ratio, shape_parameter):
+        """
+        Returns the integrals T_1 and T_0 at every dimensionless (y,x) coordinate of a grid, by interpolating the
+        table. Coordinates outside the radial range of the table are returned as NaN.
+
+        The table is first interpolated to the profile's axis-ratio and shape parameter, giving a 2D table of radius
+        and angle which is then interpolated at every coordinate.
+        """
+        shape_parameter = 0.0 if shape_parameter is None else shape_parameter
+
+        q_indexes, q_weights = interpolation_stencil_from(
+            values=self.axis_ratios, value=axis_ratio
+        )
+        s_indexes, s_weights = interpolation_stencil_from(
+            values=self.shape_parameters, value=shape_parameter
+        )
+
+        log_integrals = np.einsum(
+            "i,j,raijk->rak",
+            q_weights,
+            s_weights,
+            self.log_integrals[:, :, q_indexes][:, :, :, s_indexes],
+        )
+
+        with np.errstate(divide="ignore"):
+            log_radii = 0.5 * np.log10(grid[:, 0] ** 2 + grid[:, 1] ** 2)
+
+        angles = np.arctan2(np.abs(grid[:, 0]), np.abs(grid[:, 1]))
+
+        r_indexes, r_weights = interpolation_stencil_from(
+            values=self.log_radii, value=log_radii
+        )
+        a_indexes, a_weights = interpolation_stencil_from(
+            values=self.angles, value=angles
+        )
+
+        log_interpolated = np.zeros((grid.shape[0], 2))
+
+        for i in range(4):
+            for j in range(4):
+                log_interpolated += (r_weights[:, i] * a_weights[:, j])[
+                    :, None
+                ] * log_integrals[r_indexes[:, i], a_indexes[:, j]]
+
+        integrals = 10.0 ** log_interpolated
+
+        outside = (log_radii < self.log_radii[0]) | (log_radii > self.log_radii[-1])
+        integrals[outside] = np.nan
+
+        return integrals
+
+
+def grid_from(log_radii, angles):
+    """
+    Returns the dimensionless (y,x) coordinates of every radius and angle of a table, ordered by radius then angle.
+    """
+    radii = 10.0 ** log_radii[:, None]
+
+    return np.stack(
+        (
+            (radii * np.sin(angles[None, :])).ravel(),
+            (radii * np.cos(angles[None, :])).ravel(),
+        ),
+        axis=1,
+    )
+
+
+def log_integrals_from(convergence_func, power_func, axes):
+    """
+    Returns the log10 integrals T_1 and T_0 at every value of a table's axes (log radii, angles, axis-ratios and
+    shape parameters).
+    """
+    log_radii, angles, axis_ratios, shape_parameters = axes
+
+    grid = grid_from(log_radii=log_radii, angles=angles)
+
+    log_integrals = np.zeros(
+        (
+            log_radii.shape[0],
+            angles.shape[0],
+            axis_ratios.shape[0],
+            shape_parameters.shape[0],
+            2,
+        )
+    )
+
+    for q_index, axis_ratio in enumerate(axis_ratios):
+        for s_index, shape_parameter in enumerate(shape_parameters):
+
+            integrals = deflection_integrals_from(
+                grid=grid,
+                axis_ratio=axis_ratio,
+                convergence_func=convergence_func,
+                shape_parameter=shape_parameter,
+                power=power_func(shape_parameter),
+            )
+
+            log_integrals[:, :, q_index, s_index] = np.log10(integrals).reshape(
+                log_radii.shape[0], angles.shape[0], 2
+            )
+
+    return log_integrals
+
+
+def max_fractional_error_along_axis_from(
+    convergence_func, power_func, axes, log_integrals, axis
+):
+    """
+    Returns the maximum fractional error of interpolating a table along one of its axes, by comparing the
+    interpolated and exact integrals at the mid-point of every cell of that axis, and these exact integrals.
+    """
+    if axes[axis].shape[0] == 1:
+        return 0.0, None
+
+    axes_mid = list(axes)
+    axes_mid[axis] = 0.5 * (axes[axis][1:] + axes[axis][:-1])
+
+    log_integrals_exact = log_integrals_from(
+        convergence_func=convergence_func, power_func=power_func, axes=axes_mid
+    )
+
+    indexes, weights = interpolation_stencil_from(
+        values=axes[axis], value=axes_mid[axis]
+    )
+
+    shape = [1] * log_integrals.ndim
+    shape[axis] = -1
+
+    log_integrals_interpolated = sum(
+        weights[:, i].reshape(shape) * np.take(log_integrals, indexes[:, i], axis=axis)
+        for i in range(4)
+    )
+
+    max_fractional_error = np.max(
+        np.abs(10.0 ** (log_integrals_interpolated - log_integrals_exact) - 1.0)
+    )
+
+    return float(max_fractional_error), log_integrals_exact
+
+
+def single_precision_error_from(log_integrals):
+    """
+    Returns the maximum fractional error of the integrals of a table due to storing it in single precision.
+    """
+    return float(
+        np.max(
+            np.abs(
+                10.0 ** (log_integrals.astype("float32").astype("float") - log_integrals)
+                - 1.0
+            )
+        )
+    )
+
+
+"""
+__Table Files__
+
+The settings of every table are defined below, where the shape parameter of the `EllipticalGeneralizedNFW` is its
+inner slope and of the `EllipticalCoredPowerLaw` its slope.
+
+Tables are output to the folder `autolens_workspace/output/deflection_tables` the first time they are used, and
+loaded from there afterwards. A table is recomputed if it has a larger error than the tolerance it is requested with.
+"""
+deflection_table_path = path.join("output", "deflection_tables")
+
+deflection_table_settings = {
+    "elliptical_nfw": dict(
+        convergence_func=convergence_nfw_from,
+        power_func=lambda shape_parameter: 4.0,
+        log_radii=np.linspace(-5.0, 4.0, 91),
+        angles=np.linspace(0.0, 0.5 * np.pi, 65),
+        axis_ratios=np.linspace(0.2, 1.0, 33),
+        shape_parameters=np.array([0.0]),
+    ),
+    "elliptical_generalized_nfw": dict(
+        convergence_func=convergence_generalized_nfw_from,
+        power_func=lambda inner_slope: 4.0,
+        log_radii=np.linspace(-5.0, 4.0, 91),
+        angles=np.linspace(0.0, 0.5 * np.pi, 65),
+        axis_ratios=np.linspace(0.2, 1.0, 33),
+        shape_parameters=np.linspace(0.0, 1.9, 39),
+    ),
+    "elliptical_cored_power_law": dict(
+        convergence_func=convergence_cored_power_law_from,
+        power_func=lambda slope: 4.0 / (3.0 - slope),
+        log_radii=np.linspace(-3.0, 5.0, 81),
+        angles=np.linspace(0.0, 0.5 * np.pi, 65),
+        axis_ratios=np.linspace(0.2, 1.0, 33),
+        shape_parameters=np.linspace(1.5, 2.9, 15),
+    ),
+}
+
+deflection_tables = {}
+
+
+def deflection_table_from(name, tolerance=1.0e-4):
+    """
+    Returns the `DeflectionTable` of the input name, loading it from memory or disk if a table with an error below
+    the tolerance has previously been computed, and otherwise computing it and outputting it to disk.
+    """
+    if name in deflection_tables:
+        if deflection_tables[name].is_valid_for(tolerance=tolerance):
+            return deflection_tables[name]
+
+    file_path = path.join(deflection_table_path, f"{name}.npz")
+
+    table = None
+
+    if path.exists(file_path):
+
+        table = DeflectionTable.from_npz(file_path=file_path)
+
+        if not table.is_valid_for(tolerance=tolerance):
+            table = None
+
+    if table is None:
+
+        table = DeflectionTable.from_convergence_func(
+            **deflection_table_settings[name], tolerance=tolerance
+        )
+
+        os.makedirs(deflection_table_path, exist_ok=True)
+        table.output_to_npz(file_path=file_path)
+
+    deflection_tables[name] = table
+
+    return table
+
+
+def deflections_tabulated_from(
+    grid, name, axis_ratio, shape_parameter, scale_length, normalization, tolerance
+):
+    """
+    Returns the deflection angles of a profile, in its reference frame, at every (y,x) coordinate of a grid (which is
+    in the profile's reference frame) using its table.
+
+    Coordinates outside the radial range of the table, or all coordinates if the profile's axis-ratio or shape
+    parameter is outside the table, are computed via quadrature.
+    """
+    table = deflection_table_from(name=name, tolerance=tolerance)
+    settings = deflection_table_settings[name]
+
+    grid_scaled = np.asarray(grid) / scale_length
+
+    if table.contains(axis_ratio=axis_ratio, shape_parameter=shape_parameter):
+        integrals = table.integrals_from(
+            grid=grid_scaled, axis_ratio=axis_ratio, shape_parameter=shape_parameter
+        )
+    else:
+        integrals = np.full(grid_scaled.shape, np.nan)
+
+    outside = np.isnan(integrals[:, 0])
+
+    if np.any(outside):
+        integrals[outside] = deflection_integrals_from(
+            grid=grid_scaled[outside],
+            axis_ratio=axis_ratio,
+            convergence_func=settings["convergence_func"],
+            shape_parameter=shape_parameter,
+            power=settings["power_func"](shape_parameter),
+        )
+
+    return normalization * scale_length * grid_scaled * integrals
+
+
+"""
+__Profiles__
+
+The tabulated profiles inherit from the standard profiles, overwriting only their `deflections_from_grid` method.
+The tolerance of the tables they use is a class attribute.
+"""
+
+
+class EllipticalNFWTabulated(al.mp.EllipticalNFW):
+
+    tolerance = 1.0e-4
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid, **kwargs):
+
+        deflections = deflections_tabulated_from(
+            grid=grid,
+            name="elliptical_nfw",
+            axis_ratio=self.axis_ratio,
+            shape_parameter=None,
+            scale_length=self.scale_radius,
+            normalization=self.kappa_s,
+            tolerance=self.tolerance,
+        )
+
+        return self.rotate_grid_from_profile(deflections)
+
+
+class EllipticalGeneralizedNFWTabulated(al.mp.EllipticalGeneralizedNFW):
+
+    tolerance = 1.0e-4
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid):
+
+        deflections = deflections_tabulated_from(
+            grid=grid,
+            name="elliptical_generalized_nfw",
+            axis_ratio=self.axis_ratio,
+            shape_parameter=self.inner_slope,
+            scale_length=self.scale_radius,
+            normalization=self.kappa_s,
+            tolerance=self.tolerance,
+        )
+
+        return self.rotate_grid_from_profile(deflections)
+
+
+class EllipticalCoredPowerLawTabulated(al.mp.EllipticalCoredPowerLaw):
+
+    tolerance = 1.0e-4
+
+    @grid_decorators.grid_like_to_structure
+    @grid_decorators.transform
+    @grid_decorators.relocate_to_radial_minimum
+    def deflections_from_grid(self, grid):
+
+        core_radius = max(self.core_radius, 1.0e-8)
+
+        deflections = deflections_tabulated_from(
+            grid=grid,
+            name="elliptical_cored_power_law",
+            axis_ratio=self.axis_ratio,
+            shape_parameter=self.slope,
+            scale_length=core_radius,
+            normalization=self.einstein_radius_rescaled
+            * core_radius ** (1.0 - self.slope),
+            tolerance=self.tolerance,
+        )
+
+        return self.rotate_grid_from_profile(deflections)
+
+
+"""
+__Comparison__
+
+We now compare the deflection angles and run times of the tabulated profiles and the standard profiles, on the grid
+of the `hst` dataset. The first call of a tabulated profile computes its table (which takes a few minutes for the
+`EllipticalGeneralizedNFW` and `EllipticalCoredPowerLaw`) or loads it from disk.
+
+The standard `EllipticalNFW` computes its deflection angles via a sum of Gaussians (an approximation), so we compare
+it to its exact calculation, `deflections_from_grid_via_integrator`. The `EllipticalGeneralizedNFW` with an inner
+slope of 1 is an `EllipticalNFW`, so we compare it to the `EllipticalNFW`.
+"""
+grid = al.Grid2D.uniform(shape_native=(180, 180), pixel_scales=0.05)
+
+elliptical_comps = al.convert.elliptical_comps_from(axis_ratio=0.7, phi=30.0)
+
+nfw = al.mp.EllipticalNFW(
+    centre=(0.1, 0.0), elliptical_comps=elliptical_comps, kappa_s=0.2, scale_radius=15.0
+)
+nfw_tabulated = EllipticalNFWTabulated(
+    centre=(0.1, 0.0), elliptical_comps=elliptical_comps, kappa_s=0.2, scale_radius=15.0
+)
+gnfw_tabulated = EllipticalGeneralizedNFWTabulated(
+    centre=(0.1, 0.0),
+    elliptical_comps=elliptical_comps,
+    kappa_s=0.2,
+    inner_slope=1.0,
+    scale_radius=15.0,
+)
+
+cored_power_law = al.mp.EllipticalCoredPowerLaw(
+    centre=(0.0, 0.0),
+    elliptical_comps=elliptical_comps,
+    einstein_radius=1.6,
+    slope=2.3,
+    core_radius=0.05,
+)
+cored_power_law_tabulated = EllipticalCoredPowerLawTabulated(
+    centre=(0.0, 0.0),
+    elliptical_comps=elliptical_comps,
+    einstein_radius=1.6,
+    slope=2.3,
+    core_radius=0.05,
+)
+
+for name, func, func_tabulated in [
+    (
+        "EllipticalNFW",
+        nfw.deflections_from_grid_via_integrator,
+        nfw_tabulated.deflections_from_grid,
+    ),
+    (
+        "EllipticalGeneralizedNFW",
+        nfw.deflections_from_grid_via_integrator,
+        gnfw_tabulated.deflections_from_grid,
+    ),
+    (
+        "EllipticalCoredPowerLaw",
+        cored_power_law.deflections_from_grid,
+        cored_power_law_tabulated.deflections_from_grid,
+    ),
+]:
+
+    func_tabulated(grid=grid)
+
+    start = time.time()
+    deflections = func(grid=grid)
+    time_standard = time.time() - start
+
+    start = time.time()
+    deflections_tabulated = func_tabulated(grid=grid)
+    time_tabulated = time.time() - start
+
+    fractional_error = np.max(
+        np.linalg.norm(deflections_tabulated - deflections, axis=1)
+        / np.linalg.norm(deflections, axis=1)
+    )
+
+    print(
+        f"{name}: Standard Time = {time_standard}, Tabulated Time = {time_tabulated}, "
+        f"Maximum Fractional Difference = {fractional_error}"
+    )
+
+for name in deflection_table_settings:
+    print(
+        f"{name} table estimated maximum fractional error = "
+        f"{deflection_table_from(name=name).max_fractional_error}"
+    )
+
+"""
+__Model__
+
+The tabulated profiles are used in a lens model in the same way as the standard profiles, for example an NFW subhalo
+of a subhalo grid search:
+
+ subhalo = al.GalaxyModel(redshift=0.5, mass=EllipticalNFWTabulated)
+
+Finish.
+"""
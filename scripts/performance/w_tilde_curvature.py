@@ -0,0 +1,556 @@
+"""
+Performance: W-Tilde Curvature
+==============================
+
+The curvature matrix and data vector of an `Inversion` are:
+
+ F = (BM)^T N (BM)
+
+ D = (BM)^T N d
+
+where M is the mapping matrix [image_pixels, source_pixels], B is the PSF blurring of the image pixels
+[image_pixels, image_pixels], N is the diagonal matrix of the inverse noise squared and d is the image. Every
+likelihood evaluation the `Inversion` blurs the mapping matrix (which changes with the lens model) with the PSF and
+multiplies it by itself, even though B and N are the same for every fit to a `MaskedImaging`.
+
+Rearranging the brackets:
+
+ F = M^T (B^T N B) M = M^T W M
+
+ D = M^T (B^T N d)
+
+The "w-tilde" matrix W = B^T N B [image_pixels, image_pixels] pairs every two image pixels which are blurred into a
+common image pixel by the PSF, weighted by the inverse noise squared. It depends only on the mask, PSF and noise-map,
+and is non-zero only for image pixels closer together than the width of the PSF, so it is stored as a sparse matrix.
+
+This script shows a `MaskedImagingWTilde`, which computes W once when it is created, and an `InversionImagingWTilde`,
+which computes the curvature matrix and data vector from W and the mapper's source pixel index of every sub-pixel,
+without the blurred mapping matrix.
+
+Computing W takes longer than a single likelihood evaluation, so it is stored in a .npz file next to the dataset,
+named using a hash of the mask, PSF and noise-map. Every phase that fits the same dataset and mask (for example the
+phases of the SLaM source inversion pipeline, or the inversion phases of `pipelines/hyper`) loads it instead of
+computing it again.
+
+If a fit scales the noise-map (e.g. using a hyper galaxy or the `HyperBackgroundNoise`) W no longer applies, and the
+standard `Inversion` is used.
+"""
+# %matplotlib inline
+# from pyprojroot import here
+# workspace_path = str(here())
+# %cd $workspace_path
+# print(f"Working Directory has been set to `{workspace_path}`")
+
+import hashlib
+import time
+import numpy as np
+from os import path
+from scipy import sparse
+import autofit as af
+import autolens as al
+from autoarray.inversion.inversions import InversionImagingMatrix
+from autoarray.structures.arrays.two_d import array_2d
+from inversion_operators import blurring_operator_from, reconstruction_from
+
+"""
+__Sparse Matrices__
+
+The PSF blurring operator B of a `Convolver` and the mapping matrix M of a mapper are created as sparse matrices. The
+mapping matrix uses only the source pixel index of every sub-pixel and its sub-fraction. The blurring operator is
+created by the `blurring_operator_from` function of the shared `inversion_operators.py` module.
+"""
+
+
+def mapping_matrix_from(mapper):
+    """
+    Returns the sparse mapping matrix of a mapper.
+    """
+    pixelization_index_for_sub_slim_index = mapper.pixelization_index_for_sub_slim_index
+
+    return sparse.csr_matrix(
+        (
+            np.full(
+                pixelization_index_for_sub_slim_index.shape[0],
+                mapper.source_grid_slim.mask.sub_fraction,
+            ),
+            (
+                mapper.source_grid_slim.mask._slim_index_for_sub_slim_index,
+                pixelization_index_for_sub_slim_index,
+            ),
+        ),
+        shape=(mapper.source_grid_slim.mask.pixels_in_mask, mapper.pixels),
+    )
+
+
+"""
+__W-Tilde__
+
+The `WTilde` stores W, the blurring operator B and the noise-map W was computed for.
+
+Every W computed in a Python process is also stored in memory, using the same key as its file name, such that
+phases run one after another reuse it without loading it from disk.
+"""
+w_tildes = {}
+
+
+def w_tilde_key_from(mask, psf, noise_map):
+    """
+    Returns a hash of the mask, PSF and noise-map of a `MaskedImaging`, which W depends on.
+    """
+    sha1 = hashlib.sha1()
+
+    for array in (mask, psf, noise_map):
+        array = np.ascontiguousarray(array)
+        sha1.update(str(array.shape).encode())
+        sha1.update(array.tobytes())
+
+    return sha1.hexdigest()
+
+
+class WTilde:
+    def __init__(self, w_tilde, blurring_operator, noise_map):
+        """
+        The w-tilde matrix W = B^T N B of a `MaskedImaging`, from which the curvature matrix and data vector of an
+        `Inversion` are computed without its blurred mapping matrix.
+
+        Parameters
+        ----------
+        w_tilde : sparse.csr_matrix
+            The w-tilde matrix, of dimensions [image_pixels, image_pixels].
+        blurring_operator : sparse.csr_matrix
+            The PSF blurring operator, of dimensions [image_pixels, image_pixels].
+        noise_map : np.ndarray
+            The 1D noise-map W was computed for.
+        """
+        self.w_tilde = w_tilde
+        self.blurring_operator = blurring_operator
+        self.noise_map = noise_map
+
+    @classmethod
+    def from_masked_imaging(cls, masked_imaging, w_tilde_path=None):
+        """
+        Returns the `WTilde` of a `MaskedImaging`, which is loaded from the .npz file in `w_tilde_path` if it has
+        already been computed for its mask, PSF and noise-map, and otherwise is computed and output to this file.
+        """
+        noise_map = np.asarray(masked_imaging.noise_map)
+
+        key = w_tilde_key_from(
+            mask=masked_imaging.mask,
+            psf=masked_imaging.psf.native,
+            noise_map=noise_map,
+        )
+
+        if key in w_tildes:
+            return w_tildes[key]
+
+        blurring_operator = blurring_operator_from(convolver=masked_imaging.convolver)
+
+        if w_tilde_path is None:
+            file_path = None
+        else:
+            file_path = path.join(w_tilde_path, f"w_tilde_{key}.npz")
+
+        if file_path is not None and path.exists(file_path):
+
+            w_tilde = sparse.load_npz(file_path)
+
+        else:
+
+            w_tilde = (
+                blurring_operator.T
+                @ sparse.diags(1.0 / noise_map ** 2.0)
+                @ blurring_operator
+            ).tocsr()
+
+            if file_path is not None:
+                sparse.save_npz(file_path, w_tilde)
+
+        w_tildes[key] = cls(
+            w_tilde=w_tilde, blurring_operator=blurring_operator, noise_map=noise_map
+        )
+
+        return w_tildes[key]
+
+    def data_vector_from(self, mapping_matrix, image):
+        return mapping_matrix.T @ (
+            self.blurring_operator.T @ (np.asarray(image) / self.noise_map ** 2.0)
+        )
+
+    def curvature_matrix_from(self, mapping_matrix):
+        return (mapping_matrix.T @ (self.w_tilde @ mapping_matrix)).toarray()
+
+
+"""
+__Masked Imaging__
+
+The `MaskedImagingWTilde` computes (or loads) the `WTilde` of its mask, PSF and noise-map. The directory its file is
+stored in is set by the `SettingsMaskedImagingWTilde`, and is normally the directory of the dataset.
+"""
+
+
+class SettingsMaskedImagingWTilde(al.SettingsMaskedImaging):
+    def __init__(
+        self,
+        grid_class=al.Grid2D,
+        grid_inversion_class=al.Grid2D,
+        sub_size=2,
+        sub_size_inversion=2,
+        fractional_accuracy=0.9999,
+        sub_steps=None,
+        pixel_scales_interp=None,
+        signal_to_noise_limit=None,
+        psf_shape_2d=None,
+        renormalize_psf=True,
+        w_tilde_path=None,
+    ):
+        """
+        The settings of a `MaskedImagingWTilde`, which in addition to the `SettingsMaskedImaging` set the directory
+        its w-tilde matrix is stored in.
+
+        Parameters
+        ----------
+        w_tilde_path : str or None
+            The directory the w-tilde matrix is output to and loaded from. If `None`, it is not stored on disk.
+        """
+        super().__init__(
+            grid_class=grid_class,
+            grid_inversion_class=grid_inversion_class,
+            sub_size=sub_size,
+            sub_size_inversion=sub_size_inversion,
+            fractional_accuracy=fractional_accuracy,
+            sub_steps=sub_steps,
+            pixel_scales_interp=pixel_scales_interp,
+            signal_to_noise_limit=signal_to_noise_limit,
+            psf_shape_2d=psf_shape_2d,
+            renormalize_psf=renormalize_psf,
+        )
+
+        self.w_tilde_path = w_tilde_path
+
+
+class MaskedImagingWTilde(al.MaskedImaging):
+    def __init__(self, imaging, mask, settings=SettingsMaskedImagingWTilde()):
+
+        super().__init__(imaging=imaging, mask=mask, settings=settings)
+
+        self.w_tilde = WTilde.from_masked_imaging(
+            masked_imaging=self,
+            w_tilde_path=getattr(settings, "w_tilde_path", None),
+        )
+
+
+"""
+__Inversion__
+
+The `InversionImagingWTilde` is an `InversionImagingMatrix` which does not have a blurred mapping matrix. Its
+reconstructed image is computed by mapping the reconstruction to the image pixels and blurring it with the PSF.
+"""
+
+
+class InversionImagingWTilde(InversionImagingMatrix):
+    def __init__(
+        self,
+        image,
+        noise_map,
+        convolver,
+        mapper,
+        regularization,
+        mapping_matrix,
+        w_tilde,
+        regularization_matrix,
+        curvature_reg_matrix,
+        reconstruction,
+        settings,
+    ):
+
+        super().__init__(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            blurred_mapping_matrix=None,
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            reconstruction=reconstruction,
+            settings=settings,
+        )
+
+        self.mapping_matrix = mapping_matrix
+        self.w_tilde = w_tilde
+
+    @classmethod
+    def from_data_mapper_and_regularization(
+        cls,
+        image,
+        noise_map,
+        convolver,
+        mapper,
+        regularization,
+        w_tilde=None,
+        settings=al.SettingsInversion(),
+    ):
+
+        mapping_matrix = mapping_matrix_from(mapper=mapper)
+
+        data_vector = w_tilde.data_vector_from(
+            mapping_matrix=mapping_matrix, image=image
+        )
+
+        curvature_matrix = w_tilde.curvature_matrix_from(mapping_matrix=mapping_matrix)
+
+        regularization_matrix = regularization.regularization_matrix_from_mapper(
+            mapper=mapper
+        )
+
+        curvature_reg_matrix = np.add(curvature_matrix, regularization_matrix)
+
+        values = reconstruction_from(
+            curvature_reg_matrix=curvature_reg_matrix,
+            data_vector=data_vector,
+            check_solution=settings.check_solution,
+        )
+
+        return InversionImagingWTilde(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=regularization,
+            mapping_matrix=mapping_matrix,
+            w_tilde=w_tilde,
+            regularization_matrix=regularization_matrix,
+            curvature_reg_matrix=curvature_reg_matrix,
+            reconstruction=values,
+            settings=settings,
+        )
+
+    @property
+    def mapped_reconstructed_image(self):
+
+        reconstructed_image = self.w_tilde.blurring_operator @ (
+            self.mapping_matrix @ self.reconstruction
+        )
+
+        return array_2d.Array2D(
+            array=reconstructed_image,
+            mask=self.mapper.source_grid_slim.mask.mask_sub_1,
+            store_slim=True,
+        )
+
+
+"""
+__Tracer__
+
+The `TracerWTilde` is given the `WTilde` of the `MaskedImaging` it fits, and uses the `InversionImagingWTilde` if
+the noise-map of the fit is the one W was computed for.
+"""
+
+
+class TracerWTilde(al.Tracer):
+    def __init__(self, planes, cosmology, w_tilde=None):
+
+        super().__init__(planes=planes, cosmology=cosmology)
+
+        self.w_tilde = w_tilde
+
+    def inversion_imaging_from_grid_and_data(
+        self,
+        grid,
+        image,
+        noise_map,
+        convolver,
+        settings_pixelization=al.SettingsPixelization(),
+        settings_inversion=al.SettingsInversion(),
+    ):
+
+        if self.w_tilde is None or not np.array_equal(
+            np.asarray(noise_map), self.w_tilde.noise_map
+        ):
+            return super().inversion_imaging_from_grid_and_data(
+                grid=grid,
+                image=image,
+                noise_map=noise_map,
+                convolver=convolver,
+                settings_pixelization=settings_pixelization,
+                settings_inversion=settings_inversion,
+            )
+
+        mapper = self.mappers_of_planes_from_grid(
+            grid=grid, settings_pixelization=settings_pixelization
+        )[-1]
+
+        return InversionImagingWTilde.from_data_mapper_and_regularization(
+            image=image,
+            noise_map=noise_map,
+            convolver=convolver,
+            mapper=mapper,
+            regularization=self.regularizations_of_planes[-1],
+            w_tilde=self.w_tilde,
+            settings=settings_inversion,
+        )
+
+
+"""
+__Analysis__
+
+The `AnalysisWTilde` creates a `TracerWTilde` for every model instance, which is given the `WTilde` of its
+`MaskedImagingWTilde`.
+"""
+from autolens.pipeline.phase.imaging import analysis as a
+
+
+class AnalysisWTilde(a.Analysis):
+    def tracer_for_instance(self, instance):
+
+        tracer = super().tracer_for_instance(instance=instance)
+
+        return TracerWTilde(
+            planes=tracer.planes,
+            cosmology=tracer.cosmology,
+            w_tilde=self.masked_imaging.w_tilde,
+        )
+
+
+"""
+__Phase__
+
+The `PhaseImagingWTilde` uses the `MaskedImagingWTilde` and `AnalysisWTilde`, and can be used in place of the
+`PhaseImaging` in any pipeline.
+"""
+
+
+class PhaseImagingWTilde(al.PhaseImaging):
+    def make_analysis(self, dataset, mask, results=None):
+
+        masked_imaging = MaskedImagingWTilde(
+            imaging=dataset, mask=mask, settings=self.settings.settings_masked_imaging
+        )
+
+        self.output_phase_info()
+
+        return AnalysisWTilde(
+            masked_imaging=masked_imaging,
+            settings=self.settings,
+            cosmology=self.cosmology,
+            results=results,
+        )
+
+
+"""
+__Dataset__
+
+We use the `mass_sie__source_sersic` dataset, and store its w-tilde matrix in the dataset's directory.
+"""
+dataset_name = "mass_sie__source_sersic"
+dataset_path = path.join("dataset", "imaging", "no_lens_light", dataset_name)
+
+imaging = al.Imaging.from_fits(
+    image_path=path.join(dataset_path, "image.fits"),
+    psf_path=path.join(dataset_path, "psf.fits"),
+    noise_map_path=path.join(dataset_path, "noise_map.fits"),
+    pixel_scales=0.1,
+)
+
+mask = al.Mask2D.circular(
+    shape_native=imaging.shape_native, pixel_scales=imaging.pixel_scales, radius=3.0
+)
+
+settings_masked_imaging = SettingsMaskedImagingWTilde(w_tilde_path=dataset_path)
+
+start = time.time()
+masked_imaging = MaskedImagingWTilde(
+    imaging=imaging, mask=mask, settings=settings_masked_imaging
+)
+print(f"MaskedImagingWTilde time = {time.time() - start} s")
+
+print(f"W-Tilde non-zero entries = {masked_imaging.w_tilde.w_tilde.nnz}")
+
+"""
+__Comparison__
+
+We fit the true lens model of the dataset with a `VoronoiMagnification` source using the standard and w-tilde
+inversions, and compare their run times and log evidences.
+"""
+lens_galaxy = al.Galaxy(
+    redshift=0.5,
+    mass=al.mp.EllipticalIsothermal(
+        centre=(0.0, 0.0),
+        einstein_radius=1.6,
+        elliptical_comps=al.convert.elliptical_comps_from(axis_ratio=0.9, phi=45.0),
+    ),
+)
+
+source_galaxy = al.Galaxy(
+    redshift=1.0,
+    pixelization=al.pix.VoronoiMagnification(shape=(30, 30)),
+    regularization=al.reg.Constant(coefficient=1.0),
+)
+
+tracer = al.Tracer.from_galaxies(galaxies=[lens_galaxy, source_galaxy])
+
+tracer_w_tilde = TracerWTilde(
+    planes=tracer.planes, cosmology=tracer.cosmology, w_tilde=masked_imaging.w_tilde
+)
+
+repeats = 5
+
+for name, fit_tracer in [("Standard", tracer), ("W-Tilde", tracer_w_tilde)]:
+
+    start = time.time()
+    for _ in range(repeats):
+        fit = al.FitImaging(masked_imaging=masked_imaging, tracer=fit_tracer)
+        fit.log_evidence
+    print(f"{name} FitImaging time = {(time.time() - start) / repeats} s")
+    print(f"{name} log evidence = {fit.log_evidence}")
+
+"""
+__Phases__
+
+We now fit the dataset with two phases, as in the source inversion pipelines, where the first phase fits the lens
+mass and the second phase fits a `Rectangular` source with the lens mass fixed. The first phase computes the w-tilde
+matrix (or loads it, as it was output above) and the second phase reuses it.
+"""
+settings = al.SettingsPhaseImaging(settings_masked_imaging=settings_masked_imaging)
+
+phase1 = PhaseImagingWTilde(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "w_tilde_curvature"),
+        name="phase_1__source_inversion_magnification",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=al.GalaxyModel(redshift=0.5, mass=al.mp.EllipticalIsothermal),
+        source=al.GalaxyModel(
+            redshift=1.0,
+            pixelization=al.pix.VoronoiMagnification,
+            regularization=al.reg.Constant,
+        ),
+    ),
+    settings=settings,
+)
+
+phase1_result = phase1.run(dataset=imaging, mask=mask)
+
+phase2 = PhaseImagingWTilde(
+    search=af.DynestyStatic(
+        path_prefix=path.join("performance", "w_tilde_curvature"),
+        name="phase_2__source_inversion_rectangular",
+        n_live_points=50,
+    ),
+    galaxies=af.CollectionPriorModel(
+        lens=phase1_result.instance.galaxies.lens,
+        source=al.GalaxyModel(
+            redshift=1.0,
+            pixelization=al.pix.Rectangular,
+            regularization=al.reg.Constant,
+        ),
+    ),
+    settings=settings,
+)
+
+phase2.run(dataset=imaging, mask=mask)
+
+"""
+Finish.
+"""